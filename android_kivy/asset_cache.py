@@ -0,0 +1,291 @@
+# filename: asset_cache.py
+"""
+底图 / 置顶图层的解码缓存。
+
+每次生成都 Image.open(...).convert("RGBA") 一张约 290 KB 的 PNG，意味着完整的
+inflate + 模式转换。这里把每个文件只解码一次，保存为只读的 RGBA 图像，
+调用方需要修改时通过 copy_asset() 取得工作副本。
+
+- 失效：每次取用时检查文件 mtime / 大小；有变化时再比对内容哈希，内容真正改变才重新解码
+- 内存：可选的字节预算（按 宽×高×4 估算），超出时按 LRU 淘汰；pin() 固定的文件常驻不淘汰
+- 预热：warm_up_assets() 可在启动时提前解码全部底图
+- 统计：usage() 按文件汇总占用、解码与淘汰次数（角色包的内存统计，见 packs.py）
+- 预编译：源文件旁有 asset_compiler.py 生成的 "<文件名>.rgba" 且与源文件哈希一致时，
+  直接 mmap 其中的 RGBA 像素（不解码，各进程经系统页缓存共享内存）；过期或缺失时照常解码。
+  置顶图层的预编译文件还带有文字框处的裁剪（overlay_region() 命中时不再裁剪）
+"""
+import mmap
+import os
+from io import BytesIO
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from PIL import Image
+
+from byte_lru import ByteLRU
+from sidecar import file_digest, read_header, source_digest
+
+
+# 预编译文件格式（见 sidecar.py）：魔数 | uint32 头长度 | JSON 头 | 填充到 COMPILED_ALIGN | 宽×高×4 字节 RGBA 像素
+COMPILED_SUFFIX = ".rgba"
+COMPILED_MAGIC = b"SKRGBA01"
+COMPILED_ALIGN = 4096  # 像素数据按页对齐，mmap 后可直接作为图像缓冲区
+COMPILED_VERSION = 1
+
+_UNKNOWN = object()
+
+
+Box = Tuple[int, int, int, int]
+
+
+class _Asset:
+    __slots__ = ("image", "mtime_ns", "size", "digest", "alpha_bbox", "region")
+
+    def __init__(self, image: Image.Image, mtime_ns: int, size: int, digest: str, alpha_bbox=_UNKNOWN, region=None):
+        self.image = image
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.digest = digest
+        self.alpha_bbox = alpha_bbox  # 不透明像素的范围；未计算时为 _UNKNOWN
+        self.region: Optional[Tuple[Box, Image.Image]] = region  # 预编译的 (范围, 像素) 裁剪
+
+
+def compiled_path(path: str) -> str:
+    return path + COMPILED_SUFFIX
+
+
+def read_compiled_header(compiled: str) -> Optional[dict]:
+    """读取预编译文件的头；文件不存在或格式不符时返回 None。"""
+    return read_header(compiled, COMPILED_MAGIC, COMPILED_VERSION)
+
+
+class AssetRegistry:
+    """
+    进程级底图缓存。
+    - max_bytes: 解码后像素数据的内存预算；None 表示不限
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        self._cache = ByteLRU(max_bytes=max_bytes, on_evict=self._on_evict)
+        self._lock = threading.Lock()
+        self.reloads = 0
+        self._decodes: Dict[str, int] = {}    # 文件 -> 解码次数
+        self._evictions: Dict[str, int] = {}  # 文件 -> 被淘汰次数（合成结果计入其底图）
+        self.mapped = 0                       # 从预编译文件 mmap 的次数
+        self.region_hits = 0                  # 直接使用预编译图层裁剪的次数
+        self._stale_warned = set()
+
+    def _on_evict(self, key, nbytes: int) -> None:
+        if isinstance(key, tuple):
+            key = key[1]  # ("composite", 底图, 图层)
+        self._evictions[key] = self._evictions.get(key, 0) + 1
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.abspath(path)
+
+    def _load_compiled(self, path: str, st: os.stat_result) -> Optional[_Asset]:
+        """源文件旁有未过期的预编译文件时 mmap 其像素；否则返回 None。"""
+        compiled = compiled_path(path)
+        header = read_compiled_header(compiled)
+        if header is None:
+            return None
+        digest = source_digest(path, st, header)
+        if digest != header.get("source_sha1"):
+            if compiled not in self._stale_warned:
+                self._stale_warned.add(compiled)
+                print(f"Warning: 预编译底图已过期 {compiled}，改为解码原图（请重新运行 asset_compiler.py）")
+            return None
+        w, h = header["width"], header["height"]
+        offset = header["data_offset"]
+        with open(compiled, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(mm) < offset + w * h * 4:
+            mm.close()
+            return None
+        # 只读图像直接引用映射的页面；需要修改时调用方本来就会先 copy()
+        image = Image.frombuffer("RGBA", (w, h), memoryview(mm)[offset:offset + w * h * 4], "raw", "RGBA", 0, 1)
+        bbox = header.get("alpha_bbox")
+        region = None
+        if header.get("text_region"):
+            r = tuple(header["text_region"])
+            start, n = header["text_region_offset"], (r[2] - r[0]) * (r[3] - r[1]) * 4
+            if len(mm) >= start + n:
+                pixels = Image.frombuffer("RGBA", (r[2] - r[0], r[3] - r[1]), memoryview(mm)[start:start + n], "raw", "RGBA", 0, 1)
+                region = (r, pixels)
+        self.mapped += 1
+        return _Asset(image, st.st_mtime_ns, st.st_size, digest, tuple(bbox) if bbox else None, region)
+
+    def _decode(self, path: str, st: os.stat_result) -> _Asset:
+        asset = self._load_compiled(path, st)
+        if asset is not None:
+            return asset
+        raw, digest = file_digest(path)
+        with BytesIO(raw) as bio:
+            image = Image.open(bio).convert("RGBA")
+        image.load()
+        self._decodes[path] = self._decodes.get(path, 0) + 1
+        return _Asset(image, st.st_mtime_ns, st.st_size, digest)
+
+    def get(self, path: str) -> Image.Image:
+        """
+        取得解码后的 RGBA 图像（共享对象，调用方不得修改）。
+        文件不存在时抛出 FileNotFoundError。
+        """
+        key = self._key(path)
+        st = os.stat(key)
+        asset: Optional[_Asset] = self._cache.get(key)
+        if asset is not None and asset.mtime_ns == st.st_mtime_ns and asset.size == st.st_size:
+            return asset.image
+
+        with self._lock:
+            asset = self._cache.peek(key)
+            if asset is not None and asset.mtime_ns == st.st_mtime_ns and asset.size == st.st_size:
+                return asset.image
+            if asset is not None:
+                # 时间戳变化：内容哈希未变则沿用旧的解码结果
+                _, digest = file_digest(key)
+                if digest == asset.digest:
+                    asset = _Asset(asset.image, st.st_mtime_ns, st.st_size, digest, asset.alpha_bbox, asset.region)
+                    self._cache.put(key, asset, self._nbytes(asset.image))
+                    return asset.image
+                self.reloads += 1
+            asset = self._decode(key, st)
+            self._cache.put(key, asset, self._nbytes(asset.image))
+            return asset.image
+
+    def digest(self, path: str) -> str:
+        """取得文件内容的 sha1（与当前缓存的解码结果对应），可用于构造结果缓存的键。"""
+        self.get(path)
+        asset: Optional[_Asset] = self._cache.peek(self._key(path))
+        if asset is None:
+            # 预算过小、解码结果未被缓存时直接计算
+            return file_digest(self._key(path))[1]
+        return asset.digest
+
+    def alpha_bbox(self, path: str) -> Optional[Tuple[int, int, int, int]]:
+        """不透明像素的范围（预编译文件中已记录，否则首次调用时计算）；完全透明时为 None。"""
+        image = self.get(path)
+        asset: Optional[_Asset] = self._cache.peek(self._key(path))
+        if asset is None or asset.image is not image:
+            return image.getchannel("A").getbbox()
+        if asset.alpha_bbox is _UNKNOWN:
+            asset.alpha_bbox = image.getchannel("A").getbbox()
+        return asset.alpha_bbox
+
+    def overlay_region(self, path: str, box: Box) -> Optional[Tuple[Box, Image.Image]]:
+        """
+        图层在 box 内的不透明部分：返回 (范围, 像素)，没有不透明像素时返回 None。
+        范围与预编译文件中的文字框裁剪相同时直接返回映射的像素（只读），否则现场裁剪。
+        """
+        bbox = self.alpha_bbox(path)
+        if bbox is None:
+            return None
+        r = (max(box[0], bbox[0]), max(box[1], bbox[1]), min(box[2], bbox[2]), min(box[3], bbox[3]))
+        if r[2] <= r[0] or r[3] <= r[1]:
+            return None
+        asset: Optional[_Asset] = self._cache.peek(self._key(path))
+        if asset is not None and asset.region is not None and asset.region[0] == r:
+            self.region_hits += 1
+            return asset.region
+        return r, self.get(path).crop(r)
+
+    def copy(self, path: str) -> Image.Image:
+        """取得可修改的工作副本。"""
+        return self.get(path).copy()
+
+    def composite(self, base_path: str, overlay_path: Optional[str]) -> Image.Image:
+        """
+        取得“底图 + 置顶图层”的合成结果（共享对象，调用方不得修改）。
+        任一源文件重新解码后，合成结果随之重建。
+        """
+        base = self.get(base_path)
+        if overlay_path is None:
+            return base
+        overlay = self.get(overlay_path)
+        key = ("composite", self._key(base_path), self._key(overlay_path))
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] is base and entry[1] is overlay:
+            return entry[2]
+        image = base.copy()
+        image.paste(overlay, (0, 0), overlay)
+        self._cache.put(key, (base, overlay, image), self._nbytes(image))
+        return image
+
+    @staticmethod
+    def _nbytes(image: Image.Image) -> int:
+        w, h = image.size
+        return w * h * len(image.getbands())
+
+    def warm_up(self, paths: Iterable[str]) -> Dict[str, bool]:
+        """提前解码给定文件；返回 {路径: 是否成功}，缺失的文件不会抛出异常。"""
+        result = {}
+        for p in dict.fromkeys(paths):
+            try:
+                self.get(p)
+                result[p] = True
+            except (OSError, ValueError) as e:
+                print(f"Warning: 预加载底图失败 {p}: {e}")
+                result[p] = False
+        return result
+
+    def pin(self, paths: Iterable[str], overlay_path: Optional[str] = None) -> Dict[str, bool]:
+        """固定给定文件（及其与图层的合成结果）使之常驻，并立即解码；返回 {路径: 是否成功}。"""
+        paths = list(dict.fromkeys(paths))
+        for p in paths:
+            self._cache.pin(self._key(p))
+            if overlay_path is not None and p != overlay_path:
+                self._cache.pin(("composite", self._key(p), self._key(overlay_path)))
+        return self.warm_up(paths)
+
+    def usage(self, paths: Iterable[str], overlay_path: Optional[str] = None) -> dict:
+        """给定文件当前的解码占用（含与图层的合成结果）、解码次数与被淘汰次数。"""
+        entries = nbytes = decodes = evictions = 0
+        for p in dict.fromkeys(paths):
+            key = self._key(p)
+            size = self._cache.nbytes(key)
+            if overlay_path is not None and p != overlay_path:
+                size += self._cache.nbytes(("composite", key, self._key(overlay_path)))
+            entries += key in self._cache
+            nbytes += size
+            decodes += self._decodes.get(key, 0)
+            evictions += self._evictions.get(key, 0)
+        return {"resident": entries, "bytes": nbytes, "decodes": decodes, "evictions": evictions}
+
+    def resize(self, max_bytes: Optional[int]) -> None:
+        self._cache.resize(max_bytes)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        s = self._cache.stats()
+        s["reloads"] = self.reloads
+        s["mapped"] = self.mapped
+        s["region_hits"] = self.region_hits
+        return s
+
+
+# 进程级共享实例
+ASSET_REGISTRY = AssetRegistry()
+
+
+def get_asset(path: str) -> Image.Image:
+    """取得共享的解码图像（只读）。"""
+    return ASSET_REGISTRY.get(path)
+
+
+def copy_asset(path: str) -> Image.Image:
+    """取得可修改的解码图像副本。"""
+    return ASSET_REGISTRY.copy(path)
+
+
+def warm_up_assets(paths: Iterable[str], max_bytes: Optional[int] = None) -> Dict[str, bool]:
+    """启动时预热底图缓存；可同时设置内存预算。"""
+    if max_bytes is not None:
+        ASSET_REGISTRY.resize(max_bytes)
+    return ASSET_REGISTRY.warm_up(paths)
+
+
+def asset_cache_stats() -> dict:
+    return ASSET_REGISTRY.stats()
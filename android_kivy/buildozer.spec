@@ -3,7 +3,7 @@ title = AnanSketchbook
 package.name = anan_sketchbook
 package.domain = org.example
 source.dir = .
-source.include_exts = py,png,jpg,jpeg,ttf,kv,md,xml,atlas
+source.include_exts = py,png,jpg,jpeg,ttf,kv,md,xml,atlas,metrics
 version = 1.0.0
 requirements = python3==3.11.6,kivy,pillow,plyer,pyjnius,android
 orientation = portrait
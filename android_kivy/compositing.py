@@ -0,0 +1,77 @@
+# filename: compositing.py
+"""
+局部合成：只在文本框 / 图片框大小的“瓦片”上绘制，再贴回底图。
+
+原流程每次都复制整张底图、在整图上绘制，再把整张置顶图层做一次 alpha 粘贴。
+实际上两次生成之间只有框内像素会变化：
+- 框外像素 = 底图 + 置顶图层，与输入无关，按 (底图, 图层) 缓存一份合成结果；
+- 框内像素 = 从原始底图裁出瓦片 → 在瓦片上绘制 → 粘贴图层对应的裁剪区域；
+- 输出只新分配框所在的一条整宽行带（RegionImage），其余行与缓存的合成底图共享，编码时直接读取。
+粘贴是逐像素运算，因此结果与整图流程逐像素一致；图层只粘贴其不透明范围与瓦片的交集（透明像素粘贴不改变结果）。
+
+返回的 StaticBand 说明输出图的前若干行与缓存的合成底图完全相同，
+编码器可据此复用这些行的压缩结果（见 png_prefix.py）。
+"""
+import os
+from typing import Callable, Optional, Tuple
+
+from PIL import Image
+
+from asset_cache import ASSET_REGISTRY
+from encoders import RegionImage, StaticBand
+from metrics import stage
+
+Box = Tuple[int, int, int, int]
+
+
+def union_box(a: Box, b: Box) -> Box:
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+def clip_box(box: Box, size: Tuple[int, int]) -> Box:
+    w, h = size
+    return (max(0, box[0]), max(0, box[1]), min(w, box[2]), min(h, box[3]))
+
+
+def composite_region(
+    base_path: str,
+    overlay_path: Optional[str],
+    box: Box,
+    draw: Callable[[Image.Image, Tuple[int, int]], None],
+    function: str = "composite_region",
+) -> Tuple[RegionImage, StaticBand]:
+    """
+    在 box 范围的瓦片上调用 draw(tile, origin) 绘制，返回 (输出图, 静态行信息)；
+    输出图只复制 box 所在的行，需要 PIL 图像时调用其 image()。
+    - base_path / overlay_path: 底图与置顶图层文件（经 asset_cache 缓存）
+    - box: 可能被修改的像素范围 (left, top, right, bottom)，会被裁剪到底图范围内
+    - draw: 绘制回调；origin 为瓦片左上角在整图中的坐标，绘制时需减去
+    - function: 阶段计时使用的函数名（见 metrics.py）
+    """
+    with stage(function, "base"):
+        base = ASSET_REGISTRY.get(base_path)
+        overlay = ASSET_REGISTRY.get(overlay_path) if overlay_path is not None else None
+        composite = ASSET_REGISTRY.composite(base_path, overlay_path)
+    key = (os.path.abspath(base_path), os.path.abspath(overlay_path) if overlay_path is not None else None)
+    box = clip_box(box, base.size)
+
+    if box[2] <= box[0] or box[3] <= box[1]:
+        # 没有可绘制的像素，直接返回合成好的底图
+        w, h = composite.size
+        return RegionImage(composite, composite.crop((0, h, w, h)), h), StaticBand(key, composite, h)
+
+    origin = (box[0], box[1])
+    with stage(function, "draw"):
+        tile = base.crop(box)
+        draw(tile, origin)
+    if overlay is not None:
+        with stage(function, "overlay"):
+            region = ASSET_REGISTRY.overlay_region(overlay_path, box)
+            if region is not None:
+                ov_box, ov_tile = region
+                tile.paste(ov_tile, (ov_box[0] - box[0], ov_box[1] - box[1]), ov_tile)
+
+    with stage(function, "composite"):
+        band = composite.crop((0, box[1], composite.size[0], box[3]))
+        band.paste(tile, (box[0], 0))
+    return RegionImage(composite, band, box[1]), StaticBand(key, composite, box[1])
@@ -21,6 +21,19 @@ BASEIMAGE_FILE = str(ASSETS_DIR / "BaseImages/base.png")
 BASE_OVERLAY_FILE = str(ASSETS_DIR / "BaseImages/base_overlay.png")
 USE_BASE_OVERLAY = True
 
+# 底图解码缓存的内存上限（字节），None 表示不限制
+ASSET_CACHE_MAX_BYTES = None
+
+# 贴入图片的缩放档位：best（全尺寸解码 + LANCZOS）/ balanced / fast，见 image_fit_paste.FIT_QUALITIES
+FIT_QUALITY = "balanced"
+
+# 自定义图片的预算：文件字节数与解码像素数上限（JPEG 按缩小解码后的尺寸计算），None 表示不限制
+UPLOAD_MAX_BYTES = 20 * 1024 * 1024
+UPLOAD_MAX_PIXELS = 5000 * 5000
+
+# 自定义图片缩放结果缓存的内存上限（字节），反复生成同一张图片时跳过解码与缩放；0 表示不缓存
+FIT_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
 # 素描本可写区域（与原项目一致）
 TEXT_BOX_TOPLEFT = (119, 450)
 IMAGE_BOX_BOTTOMRIGHT = (119 + 279, 450 + 175)
@@ -0,0 +1,170 @@
+# filename: encoders.py
+"""
+输出编码层：把合成好的图像按预设编码为字节。
+
+默认的 img.save(buf, format="PNG") 在整条流水线里占了很大一部分耗时（zlib 压缩），
+这里提供几种速度 / 体积取舍不同的预设，各入口可自行选择：
+- "png"   : 默认 PNG（压缩参数与原实现相同；给出 StaticBand 时字节流不同，见下）
+- "fast"  : 低压缩等级 PNG，编码最快，体积稍大
+- "small" : optimize + 最高压缩等级 PNG，体积最小，编码最慢
+- "webp"  : 无损 WebP
+- "jpeg"  : 有损 JPEG（丢弃透明通道），quality 可调
+- "raw"   : 未压缩的 RGBA 像素，供进程内使用（如 Kivy 预览直接上传纹理）
+
+调用方给出 StaticBand（输出图前若干行与某张缓存图像相同）时，"png" / "fast"
+会改用 png_prefix 复用这些行的压缩结果；像素不变，字节流与 Pillow 的输出不同。
+局部合成的结果以 RegionImage（缓存图像 + 被替换的一条整宽行带）传入，"png" / "fast" / "raw"
+直接按行读取，不复制整张图；其他预设需要完整图像时才合成一份。
+"""
+from io import BytesIO
+from typing import Dict, Hashable, NamedTuple, Optional, Tuple, Union
+
+from PIL import Image
+
+from png_prefix import PNG_PREFIX_ENCODER
+
+
+class EncoderPreset(NamedTuple):
+    format: str         # Pillow 的保存格式名（raw 为 "RAW"）
+    media_type: str     # HTTP Content-Type
+    extension: str      # 建议的文件扩展名
+    options: dict       # 传给 Image.save 的参数
+
+
+ENCODER_PRESETS: Dict[str, EncoderPreset] = {
+    "png": EncoderPreset("PNG", "image/png", "png", {}),
+    "fast": EncoderPreset("PNG", "image/png", "png", {"compress_level": 1}),
+    "small": EncoderPreset("PNG", "image/png", "png", {"optimize": True, "compress_level": 9}),
+    # method=0 + quality=50：比默认参数快一个数量级，体积仍明显小于 PNG；
+    # exact=True：保留完全透明像素的 RGB（默认会被改写），解码结果与其他无损预设逐像素相同
+    "webp": EncoderPreset("WEBP", "image/webp", "webp", {"lossless": True, "method": 0, "quality": 50, "exact": True}),
+    "jpeg": EncoderPreset("JPEG", "image/jpeg", "jpg", {"quality": 90}),
+    "raw": EncoderPreset("RAW", "application/octet-stream", "rgba", {}),
+}
+
+DEFAULT_ENCODER = "png"
+
+# quality 的取值范围（按保存格式）；其他格式忽略 quality
+QUALITY_RANGES: Dict[str, Tuple[int, int]] = {"JPEG": (1, 95), "WEBP": (0, 100)}
+
+# 可复用静态行压缩结果的预设及其 zlib 压缩等级
+PREFIX_REUSE_LEVELS: Dict[str, int] = {"png": 6, "fast": 1}
+
+
+class StaticBand(NamedTuple):
+    key: Hashable        # 标识 source 的来源（如底图与图层路径）
+    source: Image.Image  # 输出图的前 rows 行与它完全相同
+    rows: int
+
+
+class RegionImage:
+    """
+    写时复制的输出图：与 source（缓存的只读图像）相同，只是第 [top, top + band 高度) 行替换为 band。
+    只有 band 是新分配的像素；image() 在需要完整图像时才复制整张图。
+    """
+
+    __slots__ = ("source", "band", "top")
+
+    def __init__(self, source: Image.Image, band: Image.Image, top: int):
+        self.source = source
+        self.band = band
+        self.top = top
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.source.size
+
+    @property
+    def mode(self) -> str:
+        return self.source.mode
+
+    def image(self) -> Image.Image:
+        out = self.source.copy()
+        if self.band.size[1]:
+            out.paste(self.band, (0, self.top))
+        return out
+
+    def tobytes(self, start: int = 0) -> bytes:
+        """第 start 行及以下的原始像素（与 image().crop(...).tobytes() 相同）。"""
+        w, h = self.source.size
+        bottom = self.top + self.band.size[1]
+        parts = []
+        if start < self.top:
+            parts.append(self.source.crop((0, start, w, self.top)).tobytes())
+        if start <= self.top:
+            parts.append(self.band.tobytes())
+        elif start < bottom:
+            parts.append(self.band.crop((0, start - self.top, w, self.band.size[1])).tobytes())
+        if bottom < h:
+            parts.append(self.source.crop((0, max(start, bottom), w, h)).tobytes())
+        return b"".join(parts)
+
+
+class EncodedImage(NamedTuple):
+    data: bytes
+    encoder: str
+    media_type: str
+    width: int
+    height: int
+
+
+def get_preset(encoder: str) -> EncoderPreset:
+    preset = ENCODER_PRESETS.get(encoder)
+    if preset is None:
+        raise ValueError(f"不支持的编码预设: {encoder}（可选: {', '.join(ENCODER_PRESETS)}）")
+    return preset
+
+
+def is_lossless(encoder: str) -> bool:
+    """解码后的像素是否与编码前完全相同（只有 jpeg 是有损预设）。"""
+    return get_preset(encoder).format != "JPEG"
+
+
+def check_quality(encoder: str, quality: Optional[int]) -> None:
+    """quality 超出该预设格式的取值范围时抛出 ValueError。"""
+    bounds = QUALITY_RANGES.get(get_preset(encoder).format)
+    if quality is not None and bounds is not None and not bounds[0] <= quality <= bounds[1]:
+        raise ValueError(f"{encoder} 的 quality 必须在 {bounds[0]}-{bounds[1]} 之间")
+
+
+def encode_image(
+    img: Union[Image.Image, RegionImage],
+    encoder: str = DEFAULT_ENCODER,
+    quality: Optional[int] = None,
+    static_band: Optional[StaticBand] = None,
+) -> EncodedImage:
+    """
+    按预设编码图像。
+    - quality: 仅对 jpeg（画质 1-95）与 webp（无损模式下为压缩力度 0-100）生效
+    - static_band: 可选，输出图顶部与缓存图像相同的行，PNG 编码时复用其压缩结果
+    """
+    preset = get_preset(encoder)
+    check_quality(encoder, quality)
+    w, h = img.size
+    if preset.format == "RAW":
+        if isinstance(img, RegionImage) and img.mode == "RGBA":
+            return EncodedImage(img.tobytes(), encoder, preset.media_type, w, h)
+        if isinstance(img, RegionImage):
+            img = img.image()
+        data = (img if img.mode == "RGBA" else img.convert("RGBA")).tobytes()
+        return EncodedImage(data, encoder, preset.media_type, w, h)
+
+    level = PREFIX_REUSE_LEVELS.get(encoder)
+    if static_band is not None and level is not None and img.mode == "RGBA" and static_band.source.mode == "RGBA":
+        rows = max(0, min(static_band.rows, h))
+        below = img.tobytes(rows) if isinstance(img, RegionImage) else img.crop((0, rows, w, h)).tobytes()
+        data = PNG_PREFIX_ENCODER.encode_rows(img.size, below, static_band.key, static_band.source, rows, level)
+        return EncodedImage(data, encoder, preset.media_type, w, h)
+
+    if isinstance(img, RegionImage):
+        img = img.image()
+
+    options = dict(preset.options)
+    if quality is not None and preset.format in QUALITY_RANGES:
+        options["quality"] = quality
+    if preset.format == "JPEG" and img.mode != "RGB":
+        img = img.convert("RGB")
+
+    buf = BytesIO()
+    img.save(buf, format=preset.format, **options)
+    return EncodedImage(buf.getvalue(), encoder, preset.media_type, w, h)
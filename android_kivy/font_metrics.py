@@ -0,0 +1,410 @@
+# filename: font_metrics.py
+"""
+字体度量预计算表：排版只需要字宽（advance）、ascent / descent 与字符覆盖范围，不需要光栅化。
+
+每个进程原本都要在 draw_text_auto 中经 FreeType 逐字测量、逐字号加载字体后才能排版；
+这里用一个工具把 FONT_FILE 中 cmap 覆盖的全部字符在 1..max_size 各字号下的字宽提取到
+"<字体文件>.metrics"（放在字体旁），运行时 mmap 该文件按码位二分查表：
+字号搜索与折行不再打开 FreeType，只有最终绘制时才加载对应字号的字体。
+
+- 紧凑存储：每个字符只存一份设计字宽（hmtx，字体单位），某字号的字宽按
+  round(设计字宽 × 字号 / unitsPerEm) 整像素预测；hinting 后与预测不同的 (字号, 字符) 另存为稀疏修正。
+  DejaVuSans 约 0.5% 的条目需要修正，表从逐字号存储的 1.5 MB 降到约 56 KB，CJK 字体同理只与字符数成正比
+- 字宽以 1/64 像素为单位（26.6 定点数），查表结果与 FreeTypeFont.getlength 逐位相同（提取时逐字号逐字核对）
+- 字体含 kern 表（BASIC 布局会应用其中的字距）时只提供字宽，字对修正仍交给 FreeType；
+  没有 kern 表时提取工具还会抽样验证字宽可加，验证不通过同样按“有字距”处理
+- 只对 BASIC 布局有效；Pillow 启用 RAQM、字号超出表的范围、表中没有的字符时一律退回 FreeType
+- 文件头记录字体文件的 sha1 / 大小 / mtime，字体改变后表自动视为过期
+
+用法：
+  python font_metrics.py                  # 提取 config.FONT_FILE 的度量表
+  python font_metrics.py a.ttf --max-size 96
+  python font_metrics.py --check          # 只检查，有缺失或过期时退出码为 1
+  python font_metrics.py --clean          # 删除度量表
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+from PIL import ImageFont, features
+
+from sidecar import local_path, read_header, source_digest, source_fields, source_status, write_file
+
+# 文件格式（见 sidecar.py）：魔数 | uint32 头长度 | JSON 头 | 填充到 METRICS_ALIGN |
+# uint32 码位表 | 填充 | uint16 设计字宽 | 填充 | 修正表（按字号分段的 uint32 (码位序号, 字宽) 对）
+METRICS_SUFFIX = ".metrics"
+METRICS_MAGIC = b"SKFMET01"
+METRICS_ALIGN = 4096
+METRICS_VERSION = 2
+DEFAULT_MAX_SIZE = 64  # 与 api 默认的最大字号一致
+MEASURE_MODE = "L"     # 与 text_measure.DEFAULT_MODE 一致
+
+# 抽样验证字宽可加性用的字符
+_PROBE_CHARS = "".join(chr(c) for c in range(0x20, 0x7F)) + "，。！？、“”…—【】中文字体排版"
+
+
+def metrics_path(font_path: str) -> str:
+    return font_path + METRICS_SUFFIX
+
+
+def basic_layout() -> bool:
+    """Pillow 默认是否使用 BASIC 布局（度量表只对 BASIC 布局成立）。"""
+    return not features.check_feature("raqm")
+
+
+# ---- sfnt 解析（只读取表目录与 cmap，不依赖 fontTools） ----
+
+def _sfnt_tables(data: bytes, index: int = 0) -> Dict[bytes, Tuple[int, int]]:
+    """返回 {表标签: (偏移, 长度)}；.ttc 按 index 取其中一个字体。"""
+    base = 0
+    if data[:4] == b"ttcf":
+        (count,) = struct.unpack_from(">I", data, 8)
+        if not 0 <= index < count:
+            raise ValueError(f"字体集合中没有第 {index} 个字体")
+        (base,) = struct.unpack_from(">I", data, 12 + 4 * index)
+    (num_tables,) = struct.unpack_from(">H", data, base + 4)
+    tables = {}
+    for i in range(num_tables):
+        tag, _, offset, length = struct.unpack_from(">4sIII", data, base + 12 + 16 * i)
+        tables[tag] = (offset, length)
+    return tables
+
+
+def _cmap_format4(data: bytes, off: int, out: Dict[int, int]) -> None:
+    (seg_x2,) = struct.unpack_from(">H", data, off + 6)
+    n = seg_x2 // 2
+    ends = struct.unpack_from(f">{n}H", data, off + 14)
+    starts = struct.unpack_from(f">{n}H", data, off + 16 + seg_x2)
+    deltas = struct.unpack_from(f">{n}h", data, off + 16 + 2 * seg_x2)
+    ro_pos = off + 16 + 3 * seg_x2
+    range_offsets = struct.unpack_from(f">{n}H", data, ro_pos)
+    for i in range(n):
+        start, end, delta, ro = starts[i], ends[i], deltas[i], range_offsets[i]
+        for c in range(start, end + 1):
+            if c == 0xFFFF:
+                continue
+            if ro == 0:
+                glyph = (c + delta) & 0xFFFF
+            else:
+                (glyph,) = struct.unpack_from(">H", data, ro_pos + 2 * i + ro + 2 * (c - start))
+                if glyph:
+                    glyph = (glyph + delta) & 0xFFFF
+            if glyph:
+                out[c] = glyph
+
+
+def _cmap_format12(data: bytes, off: int, out: Dict[int, int]) -> None:
+    (n_groups,) = struct.unpack_from(">I", data, off + 12)
+    for i in range(n_groups):
+        start, end, glyph = struct.unpack_from(">III", data, off + 16 + 12 * i)
+        for c in range(start, min(end, 0x10FFFF) + 1):
+            if glyph + c - start:
+                out[c] = glyph + c - start
+
+
+def cmap_glyphs(data: bytes, index: int = 0) -> Dict[int, int]:
+    """字体 Unicode cmap：码位 -> 字形序号（映射到 .notdef 的除外）。"""
+    tables = _sfnt_tables(data, index)
+    if b"cmap" not in tables:
+        return {}
+    cmap, _ = tables[b"cmap"]
+    (n,) = struct.unpack_from(">H", data, cmap + 2)
+    out: Dict[int, int] = {}
+    for i in range(n):
+        platform, encoding, sub = struct.unpack_from(">HHI", data, cmap + 4 + 8 * i)
+        if not (platform == 0 or (platform == 3 and encoding in (1, 10))):
+            continue
+        (fmt,) = struct.unpack_from(">H", data, cmap + sub)
+        if fmt == 4:
+            _cmap_format4(data, cmap + sub, out)
+        elif fmt == 12:
+            _cmap_format12(data, cmap + sub, out)
+    return {c: g for c, g in out.items() if not 0xD800 <= c <= 0xDFFF}
+
+
+def cmap_codepoints(data: bytes, index: int = 0) -> List[int]:
+    """字体 Unicode cmap 覆盖的全部码位，升序。"""
+    return sorted(cmap_glyphs(data, index))
+
+
+def design_advances(data: bytes, glyphs: List[int], index: int = 0) -> Tuple[int, List[int]]:
+    """返回 (unitsPerEm, 各字形的 hmtx 设计字宽)；缺少 head / hhea / hmtx 表时字宽均为 0（全部靠修正表）。"""
+    tables = _sfnt_tables(data, index)
+    if not all(t in tables for t in (b"head", b"hhea", b"hmtx")):
+        return 1, [0] * len(glyphs)
+    (upem,) = struct.unpack_from(">H", data, tables[b"head"][0] + 18)
+    (n_metrics,) = struct.unpack_from(">H", data, tables[b"hhea"][0] + 34)
+    hmtx = tables[b"hmtx"][0]
+    # 序号不小于 numberOfHMetrics 的字形沿用最后一项的字宽（等宽字体的常见写法）
+    return upem, [struct.unpack_from(">H", data, hmtx + 4 * min(g, n_metrics - 1))[0] for g in glyphs]
+
+
+def predict_advance(design: int, size: int, upem: int) -> int:
+    """按设计字宽预测某字号的字宽（1/64 像素，取整到整像素）。"""
+    return (design * size * 2 + upem) // (2 * upem) * 64
+
+
+def _additive(font: ImageFont.FreeTypeFont, chars: str) -> bool:
+    """抽样检查相邻字对的宽度是否等于两字宽度之和。"""
+    adv = {ch: font.getlength(ch, MEASURE_MODE) for ch in chars}
+    return all(font.getlength(a + b, MEASURE_MODE) == adv[a] + adv[b] for a in chars for b in chars)
+
+
+# ---- 提取 ----
+
+def read_metrics_header(path: str) -> Optional[dict]:
+    """读取度量表的头；文件不存在或格式不符时返回 None。"""
+    return read_header(path, METRICS_MAGIC, METRICS_VERSION)
+
+
+def status(font_path: str, index: int = 0) -> str:
+    """"fresh"（未过期）/ "stale"（字体已改变）/ "missing"（未提取）。"""
+    header = read_metrics_header(metrics_path(font_path))
+    if header is not None and header.get("index") != index:
+        header = None
+    return source_status(font_path, header)
+
+
+def extract_metrics(font_path: str, index: int = 0, max_size: int = DEFAULT_MAX_SIZE) -> str:
+    """提取字体在 1..max_size 各字号下的度量表并写到字体旁（先写临时文件再替换）；返回输出路径。"""
+    st = os.stat(font_path)
+    with open(font_path, "rb") as f:
+        raw = f.read()
+    glyphs = cmap_glyphs(raw, index)
+    codepoints = sorted(glyphs)
+    upem, design = design_advances(raw, [glyphs[c] for c in codepoints], index)
+    kerning = b"kern" in _sfnt_tables(raw, index)
+
+    chars = [chr(c) for c in codepoints]
+    corrections = array("I")  # 按字号顺序的 (码位序号, 字宽) 对
+    correction_starts = [0]
+    ascent, descent = [], []
+    for size in range(1, max_size + 1):
+        font = ImageFont.truetype(font_path, size=size, index=index, layout_engine=ImageFont.Layout.BASIC)
+        a, d = font.getmetrics()
+        ascent.append(a)
+        descent.append(d)
+        for i, ch in enumerate(chars):
+            w = font.getlength(ch, MEASURE_MODE) * 64
+            if w != int(w) or w < 0:
+                raise ValueError(f"字宽不是 1/64 像素的非负整数倍: U+{ord(ch):04X} @ {size}")
+            if int(w) != predict_advance(design[i], size, upem):
+                corrections.extend((i, int(w)))
+        correction_starts.append(len(corrections) // 2)
+        if not kerning and size in (12, max_size) and not _additive(font, _PROBE_CHARS):
+            kerning = True
+
+    header = {
+        "version": METRICS_VERSION,
+        **source_fields(font_path, st, raw),
+        "index": index,
+        "layout": "basic",
+        "mode": MEASURE_MODE,
+        "byteorder": sys.byteorder,
+        "min_size": 1,
+        "max_size": max_size,
+        "count": len(codepoints),
+        "kerning": kerning,
+        "units_per_em": upem,
+        "ascent": ascent,
+        "descent": descent,
+        "correction_starts": correction_starts,
+    }
+    out = metrics_path(font_path)
+    sections = [
+        ("codepoints_offset", array("I", codepoints).tobytes()),
+        ("design_offset", array("H", design).tobytes()),
+        ("corrections_offset", corrections.tobytes()),
+    ]
+    write_file(out, METRICS_MAGIC, header, sections, METRICS_ALIGN)
+    return out
+
+
+# ---- 运行时加载 ----
+
+class SizeMetrics:
+    """度量表中单个字号的视图：设计字宽预测 + 该字号的修正（展开为字典）。"""
+
+    __slots__ = ("size", "ascent", "descent", "kerning", "_codepoints", "_design", "_upem", "_fixes", "_count")
+
+    def __init__(self, owner: "FontMetrics", size: int):
+        i = size - owner.min_size
+        self.size = size
+        self.ascent: int = owner.ascent[i]
+        self.descent: int = owner.descent[i]
+        self.kerning: bool = owner.kerning
+        self._codepoints = owner.codepoints
+        self._design = owner.design
+        self._upem = owner.units_per_em
+        self._count = len(owner.codepoints)
+        start, stop = owner.correction_starts[i], owner.correction_starts[i + 1]
+        pairs = owner.corrections[2 * start:2 * stop]
+        self._fixes: Dict[int, int] = dict(zip(pairs[::2], pairs[1::2]))
+
+    def getmetrics(self) -> Tuple[int, int]:
+        return self.ascent, self.descent
+
+    def advance(self, ch: str) -> Optional[float]:
+        """单字宽度（像素，与 getlength 相同）；表中没有该字符时返回 None。"""
+        cp = ord(ch)
+        i = bisect_left(self._codepoints, cp)
+        if i < self._count and self._codepoints[i] == cp:
+            w = self._fixes.get(i)
+            if w is None:
+                w = predict_advance(self._design[i], self.size, self._upem)
+            return w / 64
+        return None
+
+
+class FontMetrics:
+    """mmap 的度量表文件；codepoints / design / corrections 直接引用映射的页面。"""
+
+    def __init__(self, path: str, header: dict, mm: mmap.mmap):
+        self.path = path
+        self.kerning = bool(header["kerning"])
+        self.min_size = header["min_size"]
+        self.max_size = header["max_size"]
+        self.ascent: List[int] = header["ascent"]
+        self.descent: List[int] = header["descent"]
+        self.units_per_em: int = header["units_per_em"]
+        self.correction_starts: List[int] = header["correction_starts"]
+        n = header["count"]
+        view = memoryview(mm)
+        self.codepoints = view[header["codepoints_offset"]:header["codepoints_offset"] + 4 * n].cast("I")
+        self.design = view[header["design_offset"]:header["design_offset"] + 2 * n].cast("H")
+        fixes = header["corrections_offset"]
+        self.corrections = view[fixes:fixes + 8 * self.correction_starts[-1]].cast("I")
+        self._mmap = mm
+        self._sizes: Dict[int, SizeMetrics] = {}
+
+    def for_size(self, size: int) -> Optional[SizeMetrics]:
+        """取得某字号的视图；超出表的范围时返回 None。"""
+        if not self.min_size <= size <= self.max_size:
+            return None
+        m = self._sizes.get(size)
+        if m is None:
+            m = self._sizes.setdefault(size, SizeMetrics(self, size))
+        return m
+
+
+_LOADED: Dict[Tuple[str, int], Optional[FontMetrics]] = {}
+_LOAD_LOCK = threading.Lock()
+_stale_warned = set()
+
+
+def _open_metrics(font_path: str, index: int) -> Optional[FontMetrics]:
+    path = metrics_path(font_path)
+    header = read_metrics_header(path)
+    if header is None or header.get("index") != index or header.get("mode") != MEASURE_MODE:
+        return None
+    if header.get("byteorder") != sys.byteorder:
+        return None
+    digest = source_digest(font_path, os.stat(font_path), header)
+    if digest != header.get("source_sha1"):
+        if path not in _stale_warned:
+            _stale_warned.add(path)
+            print(f"Warning: 字体度量表已过期 {path}，改为由 FreeType 测量（请重新运行 font_metrics.py）")
+        return None
+    rows = header["max_size"] - header["min_size"] + 1
+    if len(header["correction_starts"]) != rows + 1:
+        return None
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(mm) < header["corrections_offset"] + 8 * header["correction_starts"][-1]:
+        mm.close()
+        return None
+    return FontMetrics(path, header, mm)
+
+
+def load_font_metrics(font_path: Optional[str], index: int = 0) -> Optional[FontMetrics]:
+    """
+    取得字体的度量表（每个进程每个字体只打开一次）；没有表、表已过期、
+    或 Pillow 使用 RAQM 布局时返回 None，调用方退回 FreeType。
+    """
+    if not font_path or not os.path.isfile(font_path) or not basic_layout():
+        return None
+    key = (os.path.abspath(font_path), index)
+    if key in _LOADED:
+        return _LOADED[key]
+    with _LOAD_LOCK:
+        if key not in _LOADED:
+            try:
+                _LOADED[key] = _open_metrics(key[0], index)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Warning: 无法加载字体度量表 {metrics_path(key[0])}: {e}")
+                _LOADED[key] = None
+        return _LOADED[key]
+
+
+def size_metrics(font_path: Optional[str], size: int, index: int = 0) -> Optional[SizeMetrics]:
+    """取得字体某字号的度量；不可用时返回 None。"""
+    metrics = load_font_metrics(font_path, index)
+    return metrics.for_size(size) if metrics is not None else None
+
+
+def font_metrics_stats() -> Dict[str, dict]:
+    """已加载的度量表：字体 -> 字符数、字号范围、是否含字距。"""
+    with _LOAD_LOCK:
+        return {
+            path: {"codepoints": len(m.codepoints), "sizes": [m.min_size, m.max_size], "kerning": m.kerning}
+            for (path, _), m in _LOADED.items()
+            if m is not None
+        }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="提取字体的字宽 / ascent / descent 度量表（可 mmap）")
+    parser.add_argument("fonts", nargs="*", help="字体文件（默认为 config.FONT_FILE）")
+    parser.add_argument("--index", type=int, default=0, help=".ttc 中的字体序号")
+    parser.add_argument("--max-size", type=int, default=DEFAULT_MAX_SIZE, help="提取 1..max-size 号字")
+    parser.add_argument("--check", action="store_true", help="只检查，有缺失或过期时退出码为 1")
+    parser.add_argument("--force", action="store_true", help="未过期的表也重新提取")
+    parser.add_argument("--clean", action="store_true", help="删除度量表")
+    args = parser.parse_args(argv)
+
+    fonts = args.fonts
+    if not fonts:
+        from config import FONT_FILE
+
+        fonts = [FONT_FILE]
+    outdated = 0
+    for font_path in (local_path(p) for p in fonts):
+        if not os.path.isfile(font_path):
+            if args.check:
+                # 检查模式下字体不存在同样视为未就绪，部署检查不能因此通过
+                print(f"{'missing':8s} {font_path}（字体文件不存在）")
+                outdated += 1
+            else:
+                print(f"跳过（文件不存在）: {font_path}", file=sys.stderr)
+            continue
+        if args.clean:
+            out = metrics_path(font_path)
+            if os.path.exists(out):
+                os.remove(out)
+                print(f"已删除: {out}")
+            continue
+        state = status(font_path, args.index)
+        if args.check:
+            print(f"{state:8s} {font_path}")
+            outdated += state != "fresh"
+            continue
+        if state == "fresh" and not args.force:
+            print(f"未过期: {font_path}")
+            continue
+        out = extract_metrics(font_path, args.index, args.max_size)
+        header = read_metrics_header(out)
+        print(
+            f"已提取: {font_path} -> {out} ({os.path.getsize(out) // 1024} KB, "
+            f"{header['count']} 字, 1..{header['max_size']} 号, 字距: {'有' if header['kerning'] else '无'})"
+        )
+    return 1 if outdated else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
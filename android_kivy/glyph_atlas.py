@@ -0,0 +1,171 @@
+# filename: glyph_atlas.py
+"""
+字形位图缓存：绘制文本时不再每次让 FreeType 重新光栅化。
+
+ImageDraw.text 每次调用都会把整段文字重新光栅化成灰度遮罩，再用墨色做一次遮罩填充；
+括号着色又把一行拆成多次 draw.text。这里按 (字体, 字符, 亚像素相位) 缓存单字位图，
+用 NumPy 把一个着色片段内的字形拼成该片段的遮罩（同样缓存），
+绘制时每个片段只剩一次 Image.paste(颜色, 区域, 遮罩)——与 draw.text 使用同一个填充例程。
+
+结果与 draw.text 逐像素一致（不是近似），依据 Pillow（BASIC 布局）的行为：
+- 片段内第 i 个字的笔位 P = 前面各字 advance + 字距修正（1/64 像素的整数倍），
+  字形按 start=P 的小数部分光栅化，放在 floor(P) + 位图偏移处；
+- 同一片段内字形重叠时按 a + b - DIV255(a * b) 合并；
+- 片段按原顺序逐个填充，片段之间的重叠像素与多次 draw.text 的混合顺序相同。
+未安装 NumPy、非 BASIC 布局（如 RAQM）或底图模式不是 RGB/RGBA 时，调用方应退回 draw.text。
+"""
+import itertools
+import math
+import threading
+import weakref
+from typing import Optional, Sequence, Tuple
+
+from PIL import Image, ImageFont
+
+from byte_lru import ByteLRU
+from text_measure import get_advance_table
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+# 一个着色片段：(左上角 x, y, 文本, 颜色)，坐标为底图坐标
+Run = Tuple[int, int, str, Tuple[int, ...]]
+
+_SUBPIXEL = 64  # FreeType 26.6 定点数
+
+
+class _Bitmap:
+    __slots__ = ("mask", "dx", "dy")
+
+    def __init__(self, mask, dx: int, dy: int):
+        self.mask = mask  # 灰度位图（单字为 ndarray，片段为 "L" 图像；空白时为 None）
+        self.dx = dx      # 相对笔位起点的偏移
+        self.dy = dy
+
+
+def _div255(v):
+    t = v + 128
+    return ((t >> 8) + t) >> 8
+
+
+class GlyphAtlas:
+    """
+    单字与片段位图的缓存。
+    - max_bytes: 位图数据的内存预算，超出时按 LRU 淘汰
+    """
+
+    def __init__(self, max_bytes: int = 8 * 1024 * 1024):
+        self._cache = ByteLRU(max_bytes=max_bytes)
+        # 字体对象 -> 编号；用弱引用避免 id() 复用导致串字
+        self._font_ids: "weakref.WeakKeyDictionary[ImageFont.FreeTypeFont, int]" = weakref.WeakKeyDictionary()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def supports(font, image: Image.Image) -> bool:
+        """能否在该字体 / 底图上使用缓存位图绘制。"""
+        return (
+            np is not None
+            and isinstance(font, ImageFont.FreeTypeFont)
+            and font.layout_engine == ImageFont.Layout.BASIC
+            and image.mode in ("RGB", "RGBA")
+        )
+
+    def _font_id(self, font: ImageFont.FreeTypeFont) -> int:
+        fid = self._font_ids.get(font)
+        if fid is None:
+            with self._lock:
+                fid = self._font_ids.get(font)
+                if fid is None:
+                    fid = next(self._counter)
+                    self._font_ids[font] = fid
+        return fid
+
+    def glyph(self, font: ImageFont.FreeTypeFont, ch: str, phase: int) -> _Bitmap:
+        """取得字符 ch 在亚像素相位 phase（0..63，单位 1/64 像素）下的位图。"""
+        key = (self._font_id(font), ch, phase)
+        g = self._cache.get(key)
+        if g is None:
+            core, (dx, dy) = font.getmask2(ch, "L", start=(phase / _SUBPIXEL, 0))
+            w, h = core.size
+            mask = np.asarray(Image.Image()._new(core)) if w and h else None
+            g = _Bitmap(mask, dx, dy)
+            self._cache.put(key, g, w * h + 64)
+        return g
+
+    def _segment_glyphs(self, font, text: str):
+        """依次给出片段内每个字形及其相对片段起点的整数位置 (位图, x, y)。"""
+        table = get_advance_table(font)
+        pen = 0.0
+        prev = None
+        for ch in text:
+            if prev is not None:
+                pen += table.kern(prev, ch)
+            base_x = math.floor(pen)
+            g = self.glyph(font, ch, int(round((pen - base_x) * _SUBPIXEL)))
+            if g.mask is not None:
+                yield g.mask, base_x + g.dx, g.dy
+            pen += table.advance(ch)
+            prev = ch
+
+    def segment(self, font: ImageFont.FreeTypeFont, text: str) -> _Bitmap:
+        """取得一个片段合并后的 "L" 遮罩（与 font.getmask2(text) 一致），偏移相对片段起点。"""
+        key = (self._font_id(font), text, None)
+        seg = self._cache.get(key)
+        if seg is not None:
+            return seg
+
+        placed = list(self._segment_glyphs(font, text))
+        if not placed:
+            seg = _Bitmap(None, 0, 0)
+        else:
+            left = min(gx for _, gx, _ in placed)
+            top = min(gy for _, _, gy in placed)
+            right = max(gx + m.shape[1] for m, gx, _ in placed)
+            bottom = max(gy + m.shape[0] for m, _, gy in placed)
+            canvas = np.zeros((bottom - top, right - left), dtype=np.uint16)
+            for m, gx, gy in placed:
+                h, w = m.shape
+                dst = canvas[gy - top:gy - top + h, gx - left:gx - left + w]
+                dst += m - _div255(dst * m)
+            seg = _Bitmap(Image.fromarray(canvas.astype(np.uint8), "L"), left, top)
+        self._cache.put(key, seg, (seg.mask.size[0] * seg.mask.size[1] if seg.mask else 0) + 64)
+        return seg
+
+    def draw_runs(self, image: Image.Image, font: ImageFont.FreeTypeFont, runs: Sequence[Run]) -> None:
+        """
+        在 image 上就地按顺序绘制若干着色片段（须先确认 supports()），
+        效果与逐个 draw.text((x, y), text, fill=color) 相同。
+        """
+        for x, y, text, color in runs:
+            seg = self.segment(font, text)
+            if seg.mask is None:
+                continue
+            w, h = seg.mask.size
+            x0, y0 = x + seg.dx, y + seg.dy
+            image.paste(color, (x0, y0, x0 + w, y0 + h), seg.mask)
+
+    def resize(self, max_bytes: Optional[int]) -> None:
+        self._cache.resize(max_bytes)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+def is_plain_color(color, mode: str) -> bool:
+    """是否为整数颜色元组（颜色名、RGB 底图上的 RGBA 颜色等交给 draw.text 处理）。"""
+    sizes = (3, 4) if mode == "RGBA" else (3,)
+    return isinstance(color, tuple) and len(color) in sizes and all(isinstance(c, int) for c in color)
+
+
+# 进程级共享实例
+GLYPH_ATLAS = GlyphAtlas()
+
+
+def glyph_atlas_stats() -> dict:
+    return GLYPH_ATLAS.stats()
@@ -1,49 +1,264 @@
 # filename: image_fit_paste.py
+import hashlib
 from io import BytesIO
-from typing import Tuple, Literal, Union
+from typing import Hashable, NamedTuple, Tuple, Literal, Union, Optional
 from PIL import Image
 import os
 
+from asset_cache import copy_asset, get_asset
+from byte_lru import ByteLRU
+from compositing import composite_region, union_box
+from encoders import DEFAULT_ENCODER, EncodedImage, encode_image
+from metrics import IMAGE_PIXELS, OUTPUT_BYTES, observe, stage, timed
+
 Align = Literal["left", "center", "right"]
 VAlign = Literal["top", "middle", "bottom"]
 
+
+class ContentImageError(ValueError):
+    """贴入图片无法识别或解码。"""
+
+
+class ImageBudgetError(ContentImageError):
+    """贴入图片超出字节数或像素数预算（如解压炸弹、超大 PNG）。"""
+
+
+class ImageProbe(NamedTuple):
+    """只读取文件头得到的图片信息，不解码像素。"""
+    format: Optional[str]
+    size: Tuple[int, int]
+    mode: str
+    frames: int
+    nbytes: Optional[int]  # 文件字节数；传入 PIL 图片时为 None
+
+    @property
+    def pixels(self) -> int:
+        return self.size[0] * self.size[1]
+
+    @property
+    def min_decode_pixels(self) -> int:
+        """最省的解码方式下需要解码的像素数：JPEG 最多可按 1/8 缩放解码，其余格式只能全尺寸解码（只解码第一帧）。"""
+        if self.format == "JPEG":
+            return ((self.size[0] + 7) // 8) * ((self.size[1] + 7) // 8)
+        return self.pixels
+
+
+class FitQuality(NamedTuple):
+    """
+    缩放质量档位：
+    - draft_gap: JPEG 按 DCT 缩放解码（1/2、1/4、1/8），解码尺寸至少保留目标的这么多倍；None 表示全尺寸解码
+    - reducing_gap: 先用 Image.reduce() 做整数倍缩小，保留目标的这么多倍再精细滤波；None 表示直接滤波
+    - resample: 最终滤波器
+    """
+    draft_gap: Optional[float]
+    reducing_gap: Optional[float]
+    resample: int
+
+
+FIT_QUALITIES = {
+    "best": FitQuality(None, None, Image.LANCZOS),       # 原实现：全尺寸解码 + LANCZOS
+    "balanced": FitQuality(3.0, 3.0, Image.LANCZOS),     # 与 best 肉眼几乎无法区分
+    "fast": FitQuality(1.5, 1.5, Image.BICUBIC),         # 最省 CPU 与内存
+}
+DEFAULT_FIT_QUALITY = "best"
+
+# 缩放结果缓存：同一张贴纸 / 截图反复贴入时，命中即跳过解码与缩放
+# 键为 (图片内容摘要, 模式, 原尺寸, 目标尺寸, 缩放档位, keep_alpha)，值为可直接粘贴的 (图块, 蒙版)
+# 存的是未预乘 alpha 的图块：合成沿用 Image.paste 的蒙版混合，与原流程逐像素一致；预乘后需要自行混合，
+# 舍入会与原结果不同。不透明图片的蒙版为 None，粘贴时已经跳过逐像素混合
+FIT_CACHE = ByteLRU(max_bytes=32 * 1024 * 1024)
+
+
+def fit_cache_stats() -> dict:
+    """返回缩放结果缓存的条目数、占用字节与命中率。"""
+    return FIT_CACHE.stats()
+
+
+def _content_digest(content_image: Union[Image.Image, bytes, str], digest: Optional[str]) -> Optional[Hashable]:
+    """解码之前取得图片内容的摘要：字节取哈希，路径取文件状态；PIL 图片只能由调用方提供。"""
+    if digest is not None:
+        return digest
+    if isinstance(content_image, (bytes, bytearray)):
+        return hashlib.blake2b(content_image, digest_size=20).hexdigest()
+    if isinstance(content_image, str):
+        try:
+            st = os.stat(content_image)
+        except OSError:
+            return None
+        return (os.path.abspath(content_image), st.st_mtime_ns, st.st_size)
+    return None
+
+
+def _paste_tile(resized: Image.Image, keep_alpha: bool) -> Tuple[Image.Image, Optional[Image.Image]]:
+    """
+    准备粘贴用的 (图块, 蒙版)：keep_alpha 且有 alpha 时以图块自身为蒙版；
+    alpha 全为 255 时蒙版粘贴与直接粘贴结果相同，省去逐像素混合。
+    """
+    if keep_alpha and "A" in resized.getbands():
+        if resized.getchannel("A").getextrema() != (255, 255):
+            return resized, resized
+    return resized, None
+
+
+# 自行解码的图片中，这些模式直接缩放、最后再转 RGBA（逐通道滤波，结果与先转 RGBA 相同）；其余模式先转 RGBA
+_RESIZE_MODES = ("RGB", "RGBA", "L")
+
+
+def _open_content(content_image: Union[Image.Image, bytes, str]) -> Tuple[Image.Image, bool]:
+    """返回 (图片, 是否由本函数打开)；由本函数打开的图片尚未解码像素，可以按缩放解码。"""
+    if isinstance(content_image, Image.Image):
+        return content_image, False
+    if not isinstance(content_image, (bytes, bytearray, str)):
+        raise TypeError("content_image 必须为 PIL.Image.Image、图片字节或文件路径")
+    try:
+        fp = BytesIO(content_image) if isinstance(content_image, (bytes, bytearray)) else content_image
+        return Image.open(fp), True
+    except Image.DecompressionBombError as e:
+        raise ImageBudgetError(f"图片尺寸过大: {e}") from e
+    except Exception as e:
+        raise ContentImageError(f"无法识别的图片: {e}") from e
+
+
+def probe_image(
+    content_image: Union[Image.Image, bytes, str],
+    max_bytes: Optional[int] = None,
+    max_pixels: Optional[int] = None,
+) -> ImageProbe:
+    """
+    只读文件头，取得格式、尺寸、帧数与模式，并检查预算（不解码任何像素）：
+    - max_bytes: 文件字节数上限，在打开图片之前检查
+    - max_pixels: 像素数上限，按最省的解码方式计算（见 ImageProbe.min_decode_pixels）；
+      paste_image_auto 的 max_pixels 会在确定缩放解码尺寸后再精确检查一次
+    超出预算抛出 ImageBudgetError，无法识别抛出 ContentImageError。
+    """
+    probe, img = open_probed(content_image, max_bytes, max_pixels)
+    if img is not content_image:
+        img.close()
+    return probe
+
+
+def open_probed(
+    content_image: Union[Image.Image, bytes, str],
+    max_bytes: Optional[int] = None,
+    max_pixels: Optional[int] = None,
+) -> Tuple[ImageProbe, Image.Image]:
+    """
+    与 probe_image 相同的检查，返回 (文件头信息, 已打开但尚未解码的图片)。
+    content_image 为字节或路径时，可把该图片作为 paste_image_auto 的 opened 参数，生成时不再重新打开、解析文件头。
+    """
+    nbytes = None
+    if isinstance(content_image, (bytes, bytearray)):
+        nbytes = len(content_image)
+    elif isinstance(content_image, str):
+        try:
+            nbytes = os.path.getsize(content_image)
+        except OSError as e:
+            raise ContentImageError(f"无法读取图片: {e}") from e
+    if max_bytes is not None and nbytes is not None and nbytes > max_bytes:
+        raise ImageBudgetError(f"图片文件过大: {nbytes} 字节，上限 {max_bytes} 字节")
+
+    img, owned = _open_content(content_image)
+    try:
+        try:
+            # GIF 等多帧格式的帧数通过遍历数据块得到，不解码像素
+            probe = ImageProbe(img.format, img.size, img.mode, getattr(img, "n_frames", 1), nbytes)
+        except Exception as e:
+            raise ContentImageError(f"无法识别的图片: {e}") from e
+        if max_pixels is not None and probe.min_decode_pixels > max_pixels:
+            w, h = probe.size
+            raise ImageBudgetError(f"图片尺寸过大: {w}×{h}，像素上限 {max_pixels}")
+    except BaseException:
+        if owned:
+            img.close()
+        raise
+    return probe, img
+
+
+def _fit_content(
+    img: Image.Image,
+    owned: bool,
+    size: Tuple[int, int],
+    quality: FitQuality,
+    max_pixels: Optional[int] = None,
+) -> Image.Image:
+    """
+    把贴入图片缩放到 size。
+    owned（由 _open_content 打开、尚未解码）时可以按缩放解码 JPEG，结果统一为 RGBA；
+    多帧图片只解码第一帧；max_pixels 按缩放解码后的尺寸检查，超出时不解码直接抛出 ImageBudgetError。
+    调用方传入的图片保持原有行为（不转换模式，不修改原图）。
+    """
+    if owned:
+        try:
+            if quality.draft_gap is not None and img.format == "JPEG":
+                w, h = size
+                img.draft(None, (int(w * quality.draft_gap), int(h * quality.draft_gap)))
+        except Exception as e:
+            raise ContentImageError(f"无法解码的图片: {e}") from e
+        if max_pixels is not None and img.width * img.height > max_pixels:
+            raise ImageBudgetError(f"图片解码尺寸过大: {img.width}×{img.height}，像素上限 {max_pixels}")
+        try:
+            with stage("paste_image_auto", "decode"):
+                img.load()
+        except Exception as e:
+            raise ContentImageError(f"无法解码的图片: {e}") from e
+        if img.mode not in _RESIZE_MODES:
+            img = img.convert("RGBA")
+
+    resized = img.resize(size, quality.resample, reducing_gap=quality.reducing_gap)
+    return resized.convert("RGBA") if owned and resized.mode != "RGBA" else resized
+
+
+@timed("paste_image_auto")
 def paste_image_auto(
     image_source: Union[str, Image.Image],
     top_left: Tuple[int, int],
     bottom_right: Tuple[int, int],
-    content_image: Image.Image,
+    content_image: Union[Image.Image, bytes, str],
     align: Align = "center",
     valign: VAlign = "middle",
     padding: int = 0,
     allow_upscale: bool = False,
     keep_alpha: bool = True,
     image_overlay: Union[str, Image.Image,None]=None,
-) -> bytes:
+    region_only: bool = True,
+    encoder: str = DEFAULT_ENCODER,
+    quality: Optional[int] = None,
+    encoded: bool = False,
+    fit_quality: str = DEFAULT_FIT_QUALITY,
+    max_pixels: Optional[int] = None,
+    content_digest: Optional[str] = None,
+    opened: Optional[Image.Image] = None,
+) -> Union[bytes, EncodedImage]:
     """
     在指定矩形内放置一张图片（content_image），按比例缩放至“最大但不超过”该矩形。
     - base_image: 底图（会被复制，原图不改）
     - top_left / bottom_right: 指定矩形区域（左上/右下坐标）
-    - content_image: 待放入的图片（PIL.Image.Image）
+    - content_image: 待放入的图片（PIL.Image.Image），也可以是图片字节或文件路径；
+      后两者只读取文件头取尺寸，JPEG 可按目标尺寸缩放解码，省去全尺寸解码与 RGBA 转换
     - align / valign: 水平/垂直对齐方式
     - padding: 矩形内边距（像素），四边统一
     - allow_upscale: 是否允许放大（默认只缩小不放大）
     - keep_alpha: True 时保留透明通道并用其作为粘贴蒙版
+    - region_only: 底图与图层均为文件路径时，只在粘贴区域的瓦片上合成（像素与整图流程逐像素一致）
+    - encoder / quality: 输出编码预设，见 encoders.py（默认 PNG）
+    - encoded: True 时返回 EncodedImage（含宽高与 MIME 类型），调用方无需再解码取尺寸
+    - fit_quality: 缩放质量档位 "best" / "balanced" / "fast"，见 FIT_QUALITIES
+    - max_pixels: 图片字节或路径的解码像素上限（按缩放解码后的尺寸），超出时抛出 ImageBudgetError
+    - content_digest: 调用方已算好的图片内容摘要（如上传内容的哈希），用作缩放缓存的键；
+      图片字节与路径未提供时自行计算，PIL 图片未提供时不缓存
+    - opened: content_image 为字节或路径时，open_probed 已打开（尚未解码）的同一张图片；
+      传入后不再重新打开，图片归本函数所有（用完即关闭）
 
-    返回：最终 PNG 的 bytes。
+    返回：按 encoder 编码后的 bytes（默认 PNG）。
     """
-    if not isinstance(content_image, Image.Image):
-        raise TypeError("content_image 必须为 PIL.Image.Image")
-
-    if isinstance(image_source, Image.Image):
-        img = image_source.copy()
+    fit = FIT_QUALITIES.get(fit_quality)
+    if fit is None:
+        raise ValueError(f"不支持的缩放档位: {fit_quality}（可选: {', '.join(FIT_QUALITIES)}）")
+    content_image_src = content_image
+    if opened is not None and not isinstance(content_image, Image.Image):
+        content_image, owned = opened, True
     else:
-        img = Image.open(image_source).convert("RGBA")
-
-    if image_overlay is not None:
-        if isinstance(image_overlay, Image.Image):
-            img_overlay = image_overlay.copy()
-        else:
-            img_overlay = Image.open(image_overlay).convert("RGBA") if os.path.isfile(image_overlay) else None
+        content_image, owned = _open_content(content_image)
 
     x1, y1 = top_left
     x2, y2 = bottom_right
@@ -57,6 +272,7 @@ def paste_image_auto(
     cw, ch = content_image.size
     if cw <= 0 or ch <= 0:
         raise ValueError("content_image 尺寸无效。")
+    observe(IMAGE_PIXELS, cw * ch)
 
     # 计算缩放比例（contain：不超过区域，并保持纵横比）
     scale_w = region_w / cw
@@ -70,8 +286,24 @@ def paste_image_auto(
     new_w = max(1, int(round(cw * scale)))
     new_h = max(1, int(round(ch * scale)))
 
-    # 选择高质量插值
-    resized = content_image.resize((new_w, new_h), Image.LANCZOS)
+    # 解码（可按比例缩放解码）+ 整数倍预缩小 + 高质量插值；相同图片与目标尺寸直接复用缓存
+    digest = _content_digest(content_image_src, content_digest)
+    cache_key = None if digest is None else (digest, content_image.mode, (cw, ch), (new_w, new_h), fit_quality, keep_alpha)
+    cached = None if cache_key is None else FIT_CACHE.get(cache_key)
+    if cached is not None:
+        if owned:
+            content_image.close()
+        resized, mask = cached
+    else:
+        try:
+            with stage("paste_image_auto", "resize"):
+                resized, mask = _paste_tile(_fit_content(content_image, owned, (new_w, new_h), fit, max_pixels), keep_alpha)
+        finally:
+            # 缩放结果是新图像，本函数打开的原图（及其解码出的像素）此后不再需要
+            if owned:
+                content_image.close()
+        if cache_key is not None:
+            FIT_CACHE.put(cache_key, (resized, mask), new_w * new_h * len(resized.getbands()))
 
     # 计算粘贴坐标（考虑对齐与 padding）
     if align == "left":
@@ -88,20 +320,51 @@ def paste_image_auto(
     else:  # "bottom"
         py = y2 - padding - new_h
 
-    # 处理透明度：若 keep_alpha=True 且有 alpha，则用 alpha 作为 mask 粘贴
-    if keep_alpha and ("A" in resized.getbands()):
-        img.paste(resized, (px, py), resized)
-    else:
-        # 没有 alpha 就直接粘贴（会覆盖底图该区域）
-        img.paste(resized, (px, py))
+    def _draw(tile: Image.Image, origin: Tuple[int, int]) -> None:
+        pos = (px - origin[0], py - origin[1])
+        # 处理透明度：若 keep_alpha=True 且有 alpha，则用 alpha 作为 mask 粘贴（见 _paste_tile）
+        if mask is not None:
+            tile.paste(resized, pos, mask)
+        else:
+            # 没有 alpha 就直接粘贴（会覆盖底图该区域）
+            tile.paste(resized, pos)
+
+    # 局部合成（见 compositing.py）
+    if region_only and isinstance(image_source, str) and not isinstance(image_overlay, Image.Image):
+        overlay_path = image_overlay
+        if image_overlay is not None and not os.path.isfile(image_overlay):
+            print("Warning: overlay image is not exist.")
+            overlay_path = None
+        box = union_box((x1, y1, x2, y2), (px, py, px + new_w, py + new_h))
+        img, band = composite_region(image_source, overlay_path, box, _draw, function="paste_image_auto")
+        with stage("paste_image_auto", "encode"):
+            result = encode_image(img, encoder, quality, static_band=band)
+        observe(OUTPUT_BYTES, len(result.data), result.encoder)
+        return result if encoded else result.data
+
+    with stage("paste_image_auto", "base"):
+        if isinstance(image_source, Image.Image):
+            img = image_source.copy()
+        else:
+            img = copy_asset(image_source)
+
+        if image_overlay is not None:
+            if isinstance(image_overlay, Image.Image):
+                img_overlay = image_overlay.copy()
+            else:
+                img_overlay = get_asset(image_overlay) if os.path.isfile(image_overlay) else None
+
+    with stage("paste_image_auto", "draw"):
+        _draw(img, (0, 0))
 
     # 覆盖置顶图层（如果有）
     if image_overlay is not None and img_overlay is not None:
-        img.paste(img_overlay, (0, 0), img_overlay)
+        with stage("paste_image_auto", "overlay"):
+            img.paste(img_overlay, (0, 0), img_overlay)
     elif image_overlay is not None and img_overlay is None:
         print("Warning: overlay image is not exist.")
 
-    # 输出 PNG bytes
-    buf = BytesIO()
-    img.save(buf, format="PNG")
-    return buf.getvalue()
+    with stage("paste_image_auto", "encode"):
+        result = encode_image(img, encoder, quality)
+    observe(OUTPUT_BYTES, len(result.data), result.encoder)
+    return result if encoded else result.data
@@ -22,15 +22,13 @@
   - 增加差分按钮滚动容器
 """
 
-from io import BytesIO
 import json
-import re
 from pathlib import Path
 
 from kivy.app import App
 from kivy.lang import Builder
 from kivy.uix.boxlayout import BoxLayout
-from kivy.core.image import Image as CoreImage
+from kivy.graphics.texture import Texture
 from kivy.core.text import LabelBase
 from kivy.properties import StringProperty, BooleanProperty
 from kivy.uix.textinput import TextInput
@@ -50,16 +48,27 @@ from config_mobile import (
     IMAGE_BOX_BOTTOMRIGHT,
     BASE_OVERLAY_FILE,
     USE_BASE_OVERLAY,
+    ASSET_CACHE_MAX_BYTES,
+    FIT_QUALITY,
+    UPLOAD_MAX_BYTES,
+    UPLOAD_MAX_PIXELS,
+    FIT_CACHE_MAX_BYTES,
 )
 
+from asset_cache import get_asset, warm_up_assets
+from encoders import encode_image
 from text_fit_draw import draw_text_auto
-from image_fit_paste import paste_image_auto
+from image_fit_paste import FIT_CACHE, ContentImageError, paste_image_auto, probe_image
+from keyword_matcher import KeywordMatcher
 
 try:
     from plyer import filechooser
 except Exception:
     filechooser = None
 
+# 底图切换关键词：启动时编译一次
+BASE_MATCHER = KeywordMatcher(BASEIMAGE_MAPPING)
+
 KV = """
 <Root>:
     orientation: 'vertical'
@@ -179,8 +188,11 @@ class Root(BoxLayout):
     preview_source = StringProperty("")
     custom_image_hint = StringProperty("(当前未选择自定义图片，使用文字生成)")
     active = BooleanProperty(True)
-    _last_png = b""
-    _custom_image = None  # PIL Image or None
+    _last_raw = None  # (RGBA 像素, (宽, 高))，预览直接使用未压缩像素
+    _png_cache = b""
+    _custom_image = None  # 自定义图片的文件路径 or None（贴入时按目标尺寸解码）
+    _custom_base = None  # 替换底图模式下解码好的 RGBA 图片（按需加载）
+    _custom_probe = None  # 自定义图片的文件头信息（格式、尺寸、帧数）
     app_font = StringProperty("AppFont")  # 注册字体的内部名称
 
     def __init__(self, **kwargs):
@@ -284,23 +296,8 @@ class Root(BoxLayout):
         self.custom_image_hint = f"(自定义图做底图：{state})"
 
     def _pick_base_image(self, text: str) -> tuple[str, str]:
-        """解析文本中的底图标记，支持 '#开心#' 或 '##开心##' 等格式。"""
-        base = BASEIMAGE_FILE
-        cleaned = text or ""
-        tokens = re.findall(r"#+([^#]+)#+", cleaned)
-        norm = [t.strip() for t in tokens if t.strip()]
-        chosen = None
-        for k, v in BASEIMAGE_MAPPING.items():
-            inner = k.strip('#').strip()
-            if inner in norm or k in cleaned:
-                chosen = (k, v)
-                break
-        if chosen:
-            _, base = chosen
-            cleaned = re.sub(r"#+([^#]+)#+", "", cleaned)
-            for k in BASEIMAGE_MAPPING.keys():
-                cleaned = cleaned.replace(k, "")
-            cleaned = cleaned.strip()
+        """解析文本中的底图标记，支持 '#开心#' 或 '##开心##' 等格式（规则见 keyword_matcher.py）。"""
+        base, cleaned, _ = BASE_MATCHER.pick(text or "", BASEIMAGE_FILE)
         return base, cleaned
 
     def on_generate(self):
@@ -314,8 +311,16 @@ class Root(BoxLayout):
 
         try:
             if self._custom_image is not None and getattr(self, 'replace_base', False):
-                png = draw_text_auto(
-                    image_source=self._custom_image,
+                if self._custom_base is None:
+                    # 作为底图时只能全尺寸解码，按原始像素数检查预算
+                    if UPLOAD_MAX_PIXELS is not None and self._custom_probe.pixels > UPLOAD_MAX_PIXELS:
+                        print("自定义图片过大，无法作为底图。")
+                        return
+                    from PIL import Image as PILImage
+                    self._custom_base = PILImage.open(self._custom_image).convert("RGBA")
+                size = self._custom_base.size
+                raw = draw_text_auto(
+                    image_source=self._custom_base,
                     image_overlay=overlay,
                     top_left=TEXT_BOX_TOPLEFT,
                     bottom_right=IMAGE_BOX_BOTTOMRIGHT,
@@ -323,9 +328,11 @@ class Root(BoxLayout):
                     color=(0, 0, 0),
                     max_font_height=64,
                     font_path=FONT_FILE,
+                    encoder="raw",
                 )
             elif self._custom_image is not None:
-                png = paste_image_auto(
+                size = get_asset(base_image_file).size
+                raw = paste_image_auto(
                     image_source=base_image_file,
                     image_overlay=overlay,
                     top_left=TEXT_BOX_TOPLEFT,
@@ -336,9 +343,13 @@ class Root(BoxLayout):
                     padding=12,
                     allow_upscale=True,
                     keep_alpha=True,
+                    encoder="raw",
+                    fit_quality=FIT_QUALITY,
+                    max_pixels=UPLOAD_MAX_PIXELS,
                 )
             else:
-                png = draw_text_auto(
+                size = get_asset(base_image_file).size
+                raw = draw_text_auto(
                     image_source=base_image_file,
                     image_overlay=overlay,
                     top_left=TEXT_BOX_TOPLEFT,
@@ -347,16 +358,29 @@ class Root(BoxLayout):
                     color=(0, 0, 0),
                     max_font_height=64,
                     font_path=FONT_FILE,
+                    encoder="raw",
                 )
         except Exception as e:
             from kivy.logger import Logger
             Logger.exception(f"生成失败: {e}")
             return
 
-        self._last_png = png
-        data = BytesIO(png)
-        ci = CoreImage(data, ext="png")
-        self.ids.preview.texture = ci.texture
+        # 预览直接上传 RGBA 像素，省去 PNG 编码与解码；保存/分享时再按需编码
+        self._last_raw = (raw, size)
+        self._png_cache = b""
+        tex = Texture.create(size=size, colorfmt="rgba")
+        tex.blit_buffer(raw, colorfmt="rgba", bufferfmt="ubyte")
+        tex.flip_vertical()
+        self.ids.preview.texture = tex
+
+    @property
+    def _last_png(self) -> bytes:
+        """最近一次生成结果的 PNG 字节（首次访问时编码）。"""
+        if not self._png_cache and self._last_raw is not None:
+            from PIL import Image as PILImage
+            raw, size = self._last_raw
+            self._png_cache = encode_image(PILImage.frombytes("RGBA", size, raw), "png").data
+        return self._png_cache
 
     def on_save(self):
         if not self._last_png:
@@ -484,9 +508,15 @@ class Root(BoxLayout):
                 if not selection:
                     return
                 path = selection[0]
-                from PIL import Image as PILImage
-                img = PILImage.open(path).convert("RGBA")
-                self._custom_image = img
+                # 只读文件头校验格式与预算，像素留到生成时按目标尺寸解码
+                try:
+                    probe = probe_image(path, max_bytes=UPLOAD_MAX_BYTES, max_pixels=UPLOAD_MAX_PIXELS)
+                except ContentImageError as e:
+                    self.custom_image_hint = f"(无法使用该图片：{e})"
+                    return
+                self._custom_image = path
+                self._custom_base = None
+                self._custom_probe = probe
                 self.custom_image_hint = f"(已选择自定义图片：{Path(path).name})"
             except Exception as e:
                 from kivy.logger import Logger
@@ -501,6 +531,8 @@ class Root(BoxLayout):
 
     def on_clear_image(self):
         self._custom_image = None
+        self._custom_base = None
+        self._custom_probe = None
         self.custom_image_hint = "(当前未选择自定义图片，使用文字生成)"
 
     def _request_runtime_permissions(self):
@@ -627,6 +659,15 @@ class Root(BoxLayout):
 class AnanOfflineApp(App):
     def build(self):
         Builder.load_string(KV)
+        # 后台预先解码底图，避免首次生成时卡住 UI
+        import threading
+        threading.Thread(
+            target=warm_up_assets,
+            args=([BASEIMAGE_FILE, *BASEIMAGE_MAPPING.values(), BASE_OVERLAY_FILE],),
+            kwargs={"max_bytes": ASSET_CACHE_MAX_BYTES},
+            daemon=True,
+        ).start()
+        FIT_CACHE.resize(FIT_CACHE_MAX_BYTES)
         return Root()
 
 
@@ -0,0 +1,101 @@
+# filename: sidecar.py
+"""
+源文件旁的预处理文件（asset_compiler 的 "<图片>.rgba"、font_metrics 的 "<字体>.metrics"）共用的读写函数。
+
+文件格式：魔数 | uint32 头长度 | JSON 头 | 填充 | 各数据段（偏移记录在头中，按页对齐以便 mmap）
+头中记录源文件的 sha1 / 大小 / mtime：大小与 mtime 未变时直接信任记录的哈希，否则重新计算比对，
+源文件内容改变后预处理文件即视为过期。
+"""
+import hashlib
+import json
+import os
+import struct
+from typing import Optional, Sequence, Tuple
+
+PAGE = 4096
+
+
+def local_path(path: Optional[str]) -> Optional[str]:
+    """config.py 中的路径使用 Windows 分隔符；在其他系统上找不到时换成本地分隔符。"""
+    if path and not os.path.exists(path):
+        alt = path.replace("\\", "/")
+        if os.path.exists(alt):
+            return alt
+    return path
+
+
+def file_digest(path: str) -> Tuple[bytes, str]:
+    """读取整个文件，返回 (内容, sha1)。"""
+    with open(path, "rb") as f:
+        raw = f.read()
+    return raw, hashlib.sha1(raw).hexdigest()
+
+
+def source_fields(path: str, st: os.stat_result, raw: bytes) -> dict:
+    """写入头中的源文件信息。"""
+    return {
+        "source": os.path.basename(path),
+        "source_size": st.st_size,
+        "source_mtime_ns": st.st_mtime_ns,
+        "source_sha1": hashlib.sha1(raw).hexdigest(),
+    }
+
+
+def read_header(path: str, magic: bytes, version: int) -> Optional[dict]:
+    """读取文件头；文件不存在、魔数或版本不符时返回 None。"""
+    try:
+        with open(path, "rb") as f:
+            prefix = f.read(len(magic) + 4)
+            if len(prefix) < len(magic) + 4 or not prefix.startswith(magic):
+                return None
+            (length,) = struct.unpack("<I", prefix[len(magic):])
+            header = json.loads(f.read(length).decode("utf-8"))
+    except (OSError, ValueError):
+        return None
+    return header if header.get("version") == version else None
+
+
+def source_digest(path: str, st: os.stat_result, header: dict) -> str:
+    """源文件的 sha1：大小与 mtime 和生成时相同则直接信任头中记录的哈希，否则重新计算。"""
+    if header.get("source_size") == st.st_size and header.get("source_mtime_ns") == st.st_mtime_ns:
+        return header["source_sha1"]
+    return file_digest(path)[1]
+
+
+def source_status(path: str, header: Optional[dict]) -> str:
+    """"fresh"（未过期）/ "stale"（源文件已改变）/ "missing"（头为 None，即未生成）。"""
+    if header is None:
+        return "missing"
+    digest = source_digest(path, os.stat(path), header)
+    return "fresh" if digest == header.get("source_sha1") else "stale"
+
+
+def write_file(out: str, magic: bytes, header: dict, sections: Sequence[Tuple[str, bytes]], align: int = PAGE) -> None:
+    """
+    写出预处理文件：sections 为 (偏移字段名, 数据) 列表，各段按 align 对齐，偏移写入 header 对应字段。
+    先写临时文件再替换，正在映射旧文件的进程不受影响。
+    """
+    prefix_len = len(magic) + 4
+    for name, _ in sections:
+        header[name] = 0
+    # 偏移本身也写在头里：按当前头长度（为偏移的位数留出余量）计算
+    end = prefix_len + len(json.dumps(header, ensure_ascii=False).encode("utf-8")) + 16 * len(sections)
+    for name, data in sections:
+        header[name] = -(-end // align) * align
+        end = header[name] + len(data)
+    body = json.dumps(header, ensure_ascii=False).encode("utf-8")
+
+    tmp = f"{out}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(magic + struct.pack("<I", len(body)) + body)
+            pos = prefix_len + len(body)
+            for name, data in sections:
+                f.write(b"\0" * (header[name] - pos))
+                f.write(data)
+                pos = header[name] + len(data)
+        os.replace(tmp, out)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
@@ -1,193 +1,326 @@
 # filename: text_fit_draw.py
-from io import BytesIO
+from array import array
 from typing import Tuple, Union, Literal , Optional ,List
 from PIL import Image, ImageDraw, ImageFont
 import os
+import sys
+
+from asset_cache import copy_asset, get_asset
+from byte_lru import ByteLRU
+from compositing import composite_region, union_box
+from encoders import DEFAULT_ENCODER, EncodedImage, encode_image
+from font_cache import get_font
+from glyph_atlas import GLYPH_ATLAS, is_plain_color
+from metrics import FONT_SEARCH_LAYOUTS, OUTPUT_BYTES, TEXT_CHARS, observe, stage, timed
+from size_solver import solve_font_size
+from text_measure import get_size_table
 
 Align = Literal["left", "center", "right"]
 VAlign = Literal["top", "middle", "bottom"]
 
-def draw_text_auto(
-    image_source: Union[str, Image.Image],
+OPEN_BRACKETS = ("[", "【")
+CLOSE_BRACKETS = ("]", "】")
+
+
+class LayoutPlan:
+    """
+    一次排版的结果（与颜色、对齐方式无关，可缓存复用）：
+    - size / line_h / block_h: 字号、行高、文本块总高
+    - lines / line_widths: 折行结果与每行宽度
+    - seg_*: 按行展开的着色片段（文本、是否处于括号内、宽度），seg_counts 为每行片段数
+    """
+
+    __slots__ = (
+        "font_path", "top_left", "bottom_right", "size", "line_h", "block_h",
+        "lines", "line_widths", "seg_texts", "seg_bracket", "seg_widths", "seg_counts",
+    )
+
+    def __init__(self, font_path, top_left, bottom_right, size, line_h, block_h,
+                 lines, line_widths, seg_texts, seg_bracket, seg_widths, seg_counts):
+        self.font_path = font_path
+        self.top_left = top_left
+        self.bottom_right = bottom_right
+        self.size = size
+        self.line_h = line_h
+        self.block_h = block_h
+        self.lines: Tuple[str, ...] = lines
+        self.line_widths: array = line_widths
+        self.seg_texts: Tuple[str, ...] = seg_texts
+        self.seg_bracket: bytes = seg_bracket
+        self.seg_widths: array = seg_widths
+        self.seg_counts: array = seg_counts
+
+    @property
+    def font(self) -> ImageFont.FreeTypeFont:
+        return get_font(self.font_path, self.size)
+
+    def nbytes(self) -> int:
+        """估算占用内存，用于排版缓存的字节预算。"""
+        return (
+            sys.getsizeof(self)
+            + sum(sys.getsizeof(s) for s in self.lines) + sys.getsizeof(self.lines)
+            + sum(sys.getsizeof(s) for s in self.seg_texts) + sys.getsizeof(self.seg_texts)
+            + sys.getsizeof(self.line_widths) + sys.getsizeof(self.seg_bracket)
+            + sys.getsizeof(self.seg_widths) + sys.getsizeof(self.seg_counts)
+        )
+
+
+# 进程级排版缓存：相同文本/区域/字体/参数直接复用排版结果
+LAYOUT_CACHE = ByteLRU(max_bytes=8 * 1024 * 1024)
+
+
+def layout_cache_stats() -> dict:
+    """返回排版缓存的条目数、占用字节与命中率。"""
+    return LAYOUT_CACHE.stats()
+
+
+def parse_color_segments(s: str, in_bracket: bool) -> Tuple[List[Tuple[str, bool]], bool]:
+    """
+    将一行文本切分为着色片段，返回 ([(片段, 是否括号色)], 行末是否仍在括号内)。
+    中括号本身及括号内文字使用括号色，支持跨行延续。
+    """
+    segs: List[Tuple[str, bool]] = []
+    buf = ""
+    for ch in s:
+        if ch in OPEN_BRACKETS:
+            if buf:
+                segs.append((buf, in_bracket))
+                buf = ""
+            segs.append((ch, True))
+            in_bracket = True
+        elif ch in CLOSE_BRACKETS:
+            if buf:
+                segs.append((buf, True))
+                buf = ""
+            segs.append((ch, True))
+            in_bracket = False
+        else:
+            buf += ch
+    if buf:
+        segs.append((buf, in_bracket))
+    return segs, in_bracket
+
+
+def layout_text(
+    text: str,
     top_left: Tuple[int, int],
     bottom_right: Tuple[int, int],
-    text: str,
-    color: Tuple[int, int, int] = (0, 0, 0),
     max_font_height: Optional[int] = None,
     font_path: Optional[str] = None,
-    align: Align = "center",
-    valign: VAlign = "middle",
     line_spacing: float = 0.15,
-    bracket_color: Tuple[int, int, int] = (128, 0, 128),  # 中括号及内部内容颜色
-    image_overlay: Union[str, Image.Image, None]=None,
-) -> bytes:
+) -> LayoutPlan:
     """
-    在指定矩形内自适应字号绘制文本；
-    中括号及括号内文字使用 bracket_color。
+    计算在指定矩形内的排版（字号、折行、行宽、着色片段）。
+    结果按 (text, 区域, 字体, max_font_height, line_spacing) 缓存。
     """
-
-    # --- 1. 打开图像 ---
-    if isinstance(image_source, Image.Image):
-        img = image_source.copy()
-    else:
-        img = Image.open(image_source).convert("RGBA")
-    draw = ImageDraw.Draw(img)
-
-    if image_overlay is not None:
-        if isinstance(image_overlay, Image.Image):
-            img_overlay = image_overlay.copy()
-        else:
-            img_overlay = Image.open(image_overlay).convert("RGBA") if os.path.isfile(image_overlay) else None
-
     x1, y1 = top_left
     x2, y2 = bottom_right
     if not (x2 > x1 and y2 > y1):
         raise ValueError("无效的文字区域。")
     region_w, region_h = x2 - x1, y2 - y1
 
-    # --- 2. 字体加载 ---
-    def _load_font(size: int) -> ImageFont.FreeTypeFont:
-        if font_path and os.path.exists(font_path):
-            return ImageFont.truetype(font_path, size=size)
-        try:
-            return ImageFont.truetype("DejaVuSans.ttf", size=size)
-        except Exception:
-            return ImageFont.load_default()
-
-    # --- 3. 文本包行 ---
-    def wrap_lines(txt: str, font: ImageFont.FreeTypeFont, max_w: int) -> List[str]:
-        lines: list[str] = []
-        for para in txt.splitlines() or [""]:
-            has_space = (" " in para)
-            units = para.split(" ") if has_space else list(para)
-            buf = ""
-
-            def unit_join(a: str, b: str) -> str:
-                if not a:
-                    return b
-                return (a + " " + b) if has_space else (a + b)
-
-            for u in units:
-                trial = unit_join(buf, u)
-                w = draw.textlength(trial, font=font)
-                if w <= max_w:
-                    buf = trial
-                else:
-                    if buf:
-                        lines.append(buf)
-                    if has_space and len(u) > 1:
-                        tmp = ""
-                        for ch in u:
-                            if draw.textlength(tmp + ch, font=font) <= max_w:
-                                tmp += ch
-                            else:
-                                if tmp:
-                                    lines.append(tmp)
-                                tmp = ch
-                        buf = tmp
-                    else:
-                        if draw.textlength(u, font=font) <= max_w:
-                            buf = u
-                        else:
-                            lines.append(u)
-                            buf = ""
-            if buf != "":
-                lines.append(buf)
-            if para == "" and (not lines or lines[-1] != ""):
-                lines.append("")
-        return lines
-
-    # --- 4. 测量 ---
-    def measure_block(lines: List[str], font: ImageFont.FreeTypeFont) -> Tuple[int, int, int]:
-        ascent, descent = font.getmetrics()
-        line_h = int((ascent + descent) * (1 + line_spacing))
-        max_w = 0
-        for ln in lines:
-            max_w = max(max_w, int(draw.textlength(ln, font=font)))
-        total_h = max(line_h * max(1, len(lines)), 1)
-        return max_w, total_h, line_h
-
-    # --- 5. 搜索最大字号 ---
-    hi = min(region_h, max_font_height) if max_font_height else region_h
-    lo, best_size, best_lines, best_line_h, best_block_h = 1, 0, [], 0, 0
-
-    while lo <= hi:
-        mid = (lo + hi) // 2
-        font = _load_font(mid)
-        lines = wrap_lines(text, font, region_w)
-        w, h, lh = measure_block(lines, font)
-        if w <= region_w and h <= region_h:
-            best_size, best_lines, best_line_h, best_block_h = mid, lines, lh, h
-            lo = mid + 1
-        else:
-            hi = mid - 1
+    font_key = os.path.abspath(font_path) if font_path and os.path.exists(font_path) else None
+    key = (text, tuple(top_left), tuple(bottom_right), font_key, max_font_height, line_spacing)
+    plan = LAYOUT_CACHE.get(key)
+    if plan is not None:
+        return plan
+
+    # 搜索最大字号（见 size_solver.py）
+    solution = solve_font_size(text, font_path, region_w, region_h, max_font_height, line_spacing)
+    observe(FONT_SEARCH_LAYOUTS, solution.exact_layouts)
+    table = get_size_table(font_path, solution.size)
+
+    seg_texts: List[str] = []
+    seg_bracket = bytearray()
+    seg_widths = array("i")
+    seg_counts = array("i")
+    in_bracket = False
+    for ln in solution.lines:
+        segments, in_bracket = parse_color_segments(ln, in_bracket)
+        for seg_text, is_bracket in segments:
+            seg_texts.append(seg_text)
+            seg_bracket.append(is_bracket)
+            seg_widths.append(int(table.width(seg_text)))
+        seg_counts.append(len(segments))
+
+    plan = LayoutPlan(
+        font_path=font_key,
+        top_left=tuple(top_left),
+        bottom_right=tuple(bottom_right),
+        size=solution.size,
+        line_h=solution.line_h,
+        block_h=solution.block_h,
+        lines=tuple(solution.lines),
+        line_widths=array("i", solution.line_widths),
+        seg_texts=tuple(seg_texts),
+        seg_bracket=bytes(seg_bracket),
+        seg_widths=seg_widths,
+        seg_counts=seg_counts,
+    )
+    LAYOUT_CACHE.put(key, plan, plan.nbytes())
+    return plan
 
-    if best_size == 0:
-        font = _load_font(1)
-        best_lines = wrap_lines(text, font, region_w)
-        _, best_block_h, best_line_h = 0, 1, 1
-        best_size = 1
-    else:
-        font = _load_font(best_size)
-
-    # --- 6. 解析着色片段 ---
-    def parse_color_segments(s: str,in_bracket: bool) -> Tuple[List[Tuple[str, Tuple[int, int, int]]],bool]:
-        segs: list[tuple[str, Tuple[int, int, int]]] = []
-        buf = ""
-        for ch in s:
-            if ch == "[" or ch == "【":
-                if buf:
-                    segs.append((buf, bracket_color if in_bracket else color))
-                    buf = ""
-                segs.append((ch, bracket_color))
-                in_bracket = True
-            elif ch == "]" or ch == "】":
-                if buf:
-                    segs.append((buf, bracket_color))
-                    buf = ""
-                segs.append((ch, bracket_color))
-                in_bracket = False
-            else:
-                buf += ch
-        if buf:
-            segs.append((buf, bracket_color if in_bracket else color))
-        return segs,in_bracket
 
-    # --- 7. 垂直对齐 ---
+def _placements(plan: LayoutPlan, align: Align, valign: VAlign):
+    """依次给出每个着色片段的绘制位置 (x, y, 片段下标)，超出区域高度后停止。"""
+    x1, y1 = plan.top_left
+    x2, y2 = plan.bottom_right
+    region_w, region_h = x2 - x1, y2 - y1
+
+    # 垂直对齐
     if valign == "top":
         y_start = y1
     elif valign == "middle":
-        y_start = y1 + (region_h - best_block_h) // 2
+        y_start = y1 + (region_h - plan.block_h) // 2
     else:
-        y_start = y2 - best_block_h
+        y_start = y2 - plan.block_h
 
-    # --- 8. 绘制 ---
     y = y_start
-    in_bracket = False
-    for ln in best_lines:
-        line_w = int(draw.textlength(ln, font=font))
+    seg = 0
+    for line_w, n_segs in zip(plan.line_widths, plan.seg_counts):
         if align == "left":
             x = x1
         elif align == "center":
             x = x1 + (region_w - line_w) // 2
         else:
             x = x2 - line_w
-        segments,in_bracket = parse_color_segments(ln,in_bracket)
-        for seg_text, seg_color in segments:
-            if seg_text:
-                draw.text((x, y), seg_text, font=font, fill=seg_color)
-                x += int(draw.textlength(seg_text, font=font))
-        y += best_line_h
+        for k in range(seg, seg + n_segs):
+            yield x, y, k
+            x += plan.seg_widths[k]
+        seg += n_segs
+        y += plan.line_h
         if y - y_start > region_h:
             break
 
+
+def text_bounds(plan: LayoutPlan, align: Align = "center", valign: VAlign = "middle") -> Tuple[int, int, int, int]:
+    """
+    返回绘制时会触及的像素范围 (left, top, right, bottom)，至少包含文本框本身。
+    字形可能超出文本框（如 1 号字仍放不下时），局部合成据此确定瓦片大小。
+    """
+    x1, y1 = plan.top_left
+    x2, y2 = plan.bottom_right
+    font = plan.font
+    for x, y, k in _placements(plan, align, valign):
+        left, top, right, bottom = font.getbbox(plan.seg_texts[k])
+        # 留出少量余量，抵消抗锯齿边缘的取整差异
+        x1 = min(x1, x + left - 2)
+        y1 = min(y1, y + top - 2)
+        x2 = max(x2, x + right + 2)
+        y2 = max(y2, y + bottom + 2)
+    return x1, y1, x2, y2
+
+
+def render(
+    plan: LayoutPlan,
+    base: Image.Image,
+    color: Tuple[int, int, int] = (0, 0, 0),
+    align: Align = "center",
+    valign: VAlign = "middle",
+    bracket_color: Tuple[int, int, int] = (128, 0, 128),
+    origin: Tuple[int, int] = (0, 0),
+) -> Image.Image:
+    """
+    按排版结果在 base 上就地绘制文本，返回 base。
+    origin 为 base 左上角在整图中的坐标（在局部瓦片上绘制时使用）。
+    """
+    font = plan.font
+    ox, oy = origin
+    if (
+        GLYPH_ATLAS.supports(font, base)
+        and is_plain_color(color, base.mode)
+        and is_plain_color(bracket_color, base.mode)
+    ):
+        # 复用缓存的片段位图，每个片段一次遮罩填充（逐像素一致，见 glyph_atlas.py）
+        runs = [
+            (x - ox, y - oy, plan.seg_texts[k], bracket_color if plan.seg_bracket[k] else color)
+            for x, y, k in _placements(plan, align, valign)
+        ]
+        GLYPH_ATLAS.draw_runs(base, font, runs)
+        return base
+
+    draw = ImageDraw.Draw(base)
+    for x, y, k in _placements(plan, align, valign):
+        draw.text((x - ox, y - oy), plan.seg_texts[k], font=font,
+                  fill=bracket_color if plan.seg_bracket[k] else color)
+    return base
+
+
+@timed("draw_text_auto")
+def draw_text_auto(
+    image_source: Union[str, Image.Image],
+    top_left: Tuple[int, int],
+    bottom_right: Tuple[int, int],
+    text: str,
+    color: Tuple[int, int, int] = (0, 0, 0),
+    max_font_height: Optional[int] = None,
+    font_path: Optional[str] = None,
+    align: Align = "center",
+    valign: VAlign = "middle",
+    line_spacing: float = 0.15,
+    bracket_color: Tuple[int, int, int] = (128, 0, 128),  # 中括号及内部内容颜色
+    image_overlay: Union[str, Image.Image, None]=None,
+    region_only: bool = True,
+    encoder: str = DEFAULT_ENCODER,
+    quality: Optional[int] = None,
+    encoded: bool = False,
+) -> Union[bytes, EncodedImage]:
+    """
+    在指定矩形内自适应字号绘制文本；
+    中括号及括号内文字使用 bracket_color。
+    region_only: 底图与图层均为文件路径时，只在文本区域的瓦片上绘制与合成（像素与整图流程逐像素一致）。
+    encoder / quality: 输出编码预设，见 encoders.py（默认 PNG；局部合成时复用静态行的压缩结果，
+        解码后的像素与原实现一致，PNG 字节流与 Pillow 的输出不同）。
+    encoded: True 时返回 EncodedImage（含宽高与 MIME 类型），调用方无需再解码取尺寸。
+    """
+
+    observe(TEXT_CHARS, len(text))
+
+    # --- 1. 排版（带缓存，见 layout_text） ---
+    with stage("draw_text_auto", "layout"):
+        plan = layout_text(text, top_left, bottom_right, max_font_height, font_path, line_spacing)
+
+    def _draw(tile: Image.Image, origin: Tuple[int, int]) -> None:
+        render(plan, tile, color=color, align=align, valign=valign, bracket_color=bracket_color, origin=origin)
+
+    # --- 2. 局部合成（见 compositing.py） ---
+    if region_only and isinstance(image_source, str) and not isinstance(image_overlay, Image.Image):
+        overlay_path = image_overlay
+        if image_overlay is not None and not os.path.isfile(image_overlay):
+            print("Warning: overlay image is not exist.")
+            overlay_path = None
+        with stage("draw_text_auto", "bounds"):
+            box = union_box((*top_left, *bottom_right), text_bounds(plan, align, valign))
+        img, band = composite_region(image_source, overlay_path, box, _draw, function="draw_text_auto")
+        with stage("draw_text_auto", "encode"):
+            result = encode_image(img, encoder, quality, static_band=band)
+        observe(OUTPUT_BYTES, len(result.data), result.encoder)
+        return result if encoded else result.data
+
+    # --- 3. 整图绘制 ---
+    with stage("draw_text_auto", "base"):
+        if isinstance(image_source, Image.Image):
+            img = image_source.copy()
+        else:
+            img = copy_asset(image_source)
+
+        if image_overlay is not None:
+            if isinstance(image_overlay, Image.Image):
+                img_overlay = image_overlay.copy()
+            else:
+                img_overlay = get_asset(image_overlay) if os.path.isfile(image_overlay) else None
+
+    with stage("draw_text_auto", "draw"):
+        _draw(img, (0, 0))
+
     # 覆盖置顶图层（如果有）
     if image_overlay is not None and img_overlay is not None:
-        img.paste(img_overlay, (0, 0), img_overlay)
+        with stage("draw_text_auto", "overlay"):
+            img.paste(img_overlay, (0, 0), img_overlay)
     elif image_overlay is not None and img_overlay is None:
         print("Warning: overlay image is not exist.")
 
-    # --- 9. 输出 PNG ---
-    buf = BytesIO()
-    img.save(buf, format="PNG")
-    return buf.getvalue()
+    with stage("draw_text_auto", "encode"):
+        result = encode_image(img, encoder, quality)
+    observe(OUTPUT_BYTES, len(result.data), result.encoder)
+    return result if encoded else result.data
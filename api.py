@@ -1,21 +1,38 @@
 """
 FastAPI 后端服务：将现有的文字/图片绘制能力通过 HTTP 暴露为接口，便于移动端调用。
 
-- POST /generate  按文本或图片生成素描本图片，返回 base64 PNG
+- POST /generate  按文本或图片生成素描本图片，返回 base64 图片（PNG / WebP / JPEG，可选编码预设）
+- POST /generate/batch   批量生成，并行渲染，按完成顺序以 NDJSON 流式返回
+- POST /generate/upload  multipart 上传图片，直接返回图片字节（宽高等元数据在响应头）
+- POST /generate/raw     请求体为原始图片字节（参数在查询字符串），直接返回图片字节
 - GET  /bases      列出可用的底图映射（来自 config.BASEIMAGE_MAPPING）
+- GET  /stats      渲染线程池的排队深度、等待时间，结果缓存各层的命中统计，在途合并次数
+- GET  /metrics    Prometheus 文本格式：各渲染阶段耗时直方图、各缓存命中率、排队深度等
 
 说明：
 - 该服务不依赖 Windows 特定能力（不使用键盘/剪贴板/Win32），可跨平台运行。
 - 默认遵循 config.py 中的坐标、字体、覆盖层、底图等配置。
+- 渲染在专用线程池中执行（config.RENDER_WORKERS / RENDER_QUEUE_SIZE），队列满时返回 503 + Retry-After。
+- 生成结果按输入内容缓存（见 result_cache.py），响应带强 ETag；
+  请求头 If-None-Match 与之匹配时直接返回 304，不做渲染；
+  正在渲染中的相同请求会等待同一次渲染的结果（见 single_flight.py）。
 """
 from __future__ import annotations
 
+import asyncio
 import base64
-from io import BytesIO
-from typing import Optional
+import binascii
+import hashlib
+import json
+from contextlib import asynccontextmanager
+from typing import List, Literal, NamedTuple, Optional, Tuple
+from urllib.parse import quote
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, File, Form, Header, HTTPException, Query, Request, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from PIL import Image
 
@@ -27,12 +44,80 @@ from config import (
     IMAGE_BOX_BOTTOMRIGHT,
     BASE_OVERLAY_FILE,
     USE_BASE_OVERLAY,
+    ASSET_CACHE_MAX_BYTES,
+    PACKS_DIR,
+    RENDER_WORKERS,
+    RENDER_QUEUE_SIZE,
+    BATCH_MAX_ITEMS,
+    RESULT_CACHE_MAX_BYTES,
+    RESULT_CACHE_DIR,
+    RESULT_CACHE_DISK_MAX_BYTES,
+    METRICS_ENABLED,
+    FIT_QUALITY,
+    UPLOAD_MAX_BYTES,
+    UPLOAD_MAX_PIXELS,
+    FIT_CACHE_MAX_BYTES,
 )
-from text_fit_draw import draw_text_auto
-from image_fit_paste import paste_image_auto
+import metrics
+from asset_cache import ASSET_REGISTRY, asset_cache_stats
+from encoders import DEFAULT_ENCODER, EncodedImage, check_quality, get_preset
+from font_metrics import font_metrics_stats, load_font_metrics
+from glyph_atlas import glyph_atlas_stats
+from text_fit_draw import draw_text_auto, layout_cache_stats
+from image_fit_paste import (
+    FIT_CACHE,
+    ContentImageError,
+    ImageBudgetError,
+    fit_cache_stats,
+    paste_image_auto,
+    open_probed,
+)
+from render_pool import PoolFullError, RenderPool
+from packs import Box, Pack, PackRegistry, default_pack
+from result_cache import CachedResult, ResultCache, file_signature, render_key
+from single_flight import SingleFlight
+
+# 渲染各阶段计时（关闭时几乎没有开销）
+metrics.enable(METRICS_ENABLED)
+
+# 渲染线程池：限制并发渲染数与排队长度
+RENDER_POOL = RenderPool(workers=RENDER_WORKERS, max_queue=RENDER_QUEUE_SIZE)
+
+# 生成结果缓存：内存层 + 可选的磁盘层
+RESULT_CACHE = ResultCache(
+    memory_bytes=RESULT_CACHE_MAX_BYTES,
+    disk_dir=RESULT_CACHE_DIR,
+    disk_bytes=RESULT_CACHE_DISK_MAX_BYTES,
+)
+
+# 贴入图片缩放结果缓存：同一张图片反复贴入时跳过解码与缩放
+FIT_CACHE.resize(FIT_CACHE_MAX_BYTES)
+
+# 角色包：config 中的底图构成默认包，PACKS_DIR 下的 pack.json 各为一个包（只读清单，底图按需解码）
+PACKS = PackRegistry()
+PACKS.add(default_pack(BASEIMAGE_MAPPING, BASEIMAGE_FILE, BASE_OVERLAY_FILE, (TEXT_BOX_TOPLEFT, IMAGE_BOX_BOTTOMRIGHT)))
+if PACKS_DIR:
+    PACKS.load_dir(PACKS_DIR, (TEXT_BOX_TOPLEFT, IMAGE_BOX_BOTTOMRIGHT))
 
+# 在途合并：相同缓存键的并发请求只渲染一次
+RENDER_FLIGHTS = SingleFlight()
 
-app = FastAPI(title="Anan Sketchbook API", version="1.0.0")
+# 浏览器端跨域读取时需要暴露的自定义响应头
+METADATA_HEADERS = ["X-Image-Width", "X-Image-Height", "X-Used-Base", "X-Encoder", "ETag"]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动时预先解码各角色包固定（pin）的底图与置顶图层，避免首个请求承担解码开销；
+    # 默认包固定全部底图，其余底图在第一次使用时解码
+    ASSET_REGISTRY.resize(ASSET_CACHE_MAX_BYTES)
+    PACKS.warm_up()
+    load_font_metrics(FONT_FILE)  # 有预计算度量表时映射之，排版不再等待 FreeType
+    yield
+    RENDER_POOL.shutdown(wait=False)
+
+
+app = FastAPI(title="Anan Sketchbook API", version="1.0.0", lifespan=lifespan)
 
 # CORS：默认允许所有来源，开发联调更方便；生产环境建议收紧
 app.add_middleware(
@@ -41,15 +126,24 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=METADATA_HEADERS,
 )
 
 
+# 与 encoders.ENCODER_PRESETS 一一对应；raw 为未压缩的 RGBA 像素，宽高见响应的 width / height（或 X-Image-* 头）
+EncoderName = Literal["png", "fast", "small", "webp", "jpeg", "raw"]
+
+
 class GenerateRequest(BaseModel):
     text: Optional[str] = Field(None, description="要绘制的文本；若提供，则按自适应字号绘制")
     image_base64: Optional[str] = Field(
         None,
         description="要贴入的图片，base64（data URL 或纯 base64 都可）。若提供，则按 contain 规则贴入",
     )
+    pack: Optional[str] = Field(
+        None,
+        description="可选：角色包名（见 GET /bases）；留空使用默认包",
+    )
     base_key: Optional[str] = Field(
         None,
         description="可选：指定底图映射键（例如 '#开心#'）；若留空，将使用默认底图，且会在 text 中自动识别切换关键词",
@@ -58,6 +152,16 @@ class GenerateRequest(BaseModel):
         None,
         description="是否叠加遮挡层；默认遵循 config.USE_BASE_OVERLAY",
     )
+    encoder: EncoderName = Field(
+        DEFAULT_ENCODER,
+        description="输出编码预设：png 默认 / fast 快速 PNG / small 高压缩 PNG / webp 无损 WebP / jpeg 有损 JPEG / raw 未压缩 RGBA 像素",
+    )
+    quality: Optional[int] = Field(
+        None,
+        ge=0,
+        le=100,
+        description="可选：jpeg 画质（1-95）或 webp 压缩力度（0-100）；超出所选编码的范围时返回 422，其他编码忽略",
+    )
 
 
 class GenerateResponse(BaseModel):
@@ -65,6 +169,8 @@ class GenerateResponse(BaseModel):
     width: int
     height: int
     used_base: str
+    format: str = Field(DEFAULT_ENCODER, description="实际使用的编码预设")
+    media_type: str = Field("image/png", description="图片的 MIME 类型")
 
 
 def _strip_data_url(b64: str) -> str:
@@ -79,79 +185,465 @@ def list_bases():
     return {
         "default": BASEIMAGE_FILE,
         "mapping": BASEIMAGE_MAPPING,
+        "packs": {name: list(PACKS.get(name).bases) for name in PACKS.names()},
     }
 
 
-@app.post("/generate", response_model=GenerateResponse)
-def generate(req: GenerateRequest):
-    text = (req.text or "").strip()
-    image_b64 = req.image_base64
+@app.get("/stats")
+def stats():
+    return {
+        "render_pool": RENDER_POOL.stats(),
+        "result_cache": RESULT_CACHE.stats(),
+        "single_flight": RENDER_FLIGHTS.stats(),
+        "packs": PACKS.stats(),
+        "font_metrics": font_metrics_stats(),
+    }
 
-    if not text and not image_b64:
-        raise HTTPException(status_code=400, detail="必须提供 text 或 image_base64 之一")
 
-    # 选择底图
-    base_image_file = BASEIMAGE_FILE
-    if req.base_key and req.base_key in BASEIMAGE_MAPPING:
-        base_image_file = BASEIMAGE_MAPPING[req.base_key]
-    else:
-        # 若未显式指定 base_key，则在文本中识别切换关键词（同 main.py 逻辑）
-        for keyword, img_file in BASEIMAGE_MAPPING.items():
-            if keyword in text:
-                base_image_file = img_file
-                text = text.replace(keyword, "").strip()
-                break
+def _metrics_lines() -> List[str]:
+    """把各组件的运行统计转为 Prometheus 指标行（抓取时现算）。"""
+    result_cache = RESULT_CACHE.stats()
+    caches = {
+        "result_memory": result_cache["memory"],
+        "result_disk": result_cache["disk"],
+        "asset": asset_cache_stats(),
+        "layout": layout_cache_stats(),
+        "glyph": glyph_atlas_stats(),
+        "fit": fit_cache_stats(),
+    }
+    caches = {name: st for name, st in caches.items() if st is not None}
+    pool = RENDER_POOL.stats()
+    flights = RENDER_FLIGHTS.stats()
+
+    def per_cache(field):
+        return [({"cache": name}, st[field]) for name, st in caches.items()]
+
+    lines: List[str] = []
+    lines += metrics.gauge_lines("sketchbook_cache_hits_total", "Cache hits.", per_cache("hits"), "counter")
+    lines += metrics.gauge_lines("sketchbook_cache_misses_total", "Cache misses.", per_cache("misses"), "counter")
+    lines += metrics.gauge_lines("sketchbook_cache_hit_ratio", "Cache hit ratio since start.", per_cache("hit_rate"))
+    lines += metrics.gauge_lines("sketchbook_cache_bytes", "Bytes held by the cache.", per_cache("bytes"))
+    lines += metrics.gauge_lines("sketchbook_cache_entries", "Entries held by the cache.", per_cache("entries"))
+    lines += metrics.gauge_lines("sketchbook_render_pool_workers", "Render threads.", [({}, pool["workers"])])
+    lines += metrics.gauge_lines("sketchbook_render_pool_running", "Renders in progress.", [({}, pool["running"])])
+    lines += metrics.gauge_lines("sketchbook_render_pool_queue_depth", "Renders waiting for a thread.",
+                                 [({}, pool["queue_depth"])])
+    lines += metrics.gauge_lines(
+        "sketchbook_render_pool_tasks_total", "Render pool tasks by outcome.",
+        [({"outcome": k}, pool[k]) for k in ("completed", "failed", "rejected")], "counter",
+    )
+    lines += metrics.gauge_lines(
+        "sketchbook_single_flight_calls_total", "Render calls by whether they were coalesced.",
+        [({"outcome": k}, flights[k]) for k in ("executed", "coalesced")], "counter",
+    )
+    return lines
 
-    overlay_file = BASE_OVERLAY_FILE if (req.use_overlay if req.use_overlay is not None else USE_BASE_OVERLAY) else None
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render_prometheus(_metrics_lines()), media_type="text/plain; version=0.0.4")
+
+
+def _check_upload_size(nbytes: Optional[int]) -> None:
+    """读取 / 解码上传内容之前按声明或估算的字节数检查预算。"""
+    if UPLOAD_MAX_BYTES is not None and nbytes is not None and nbytes > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"图片文件过大: 上限 {UPLOAD_MAX_BYTES} 字节")
+
+
+def _check_quality(encoder: str, quality: Optional[int]) -> None:
+    try:
+        check_quality(encoder, quality)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+def _probe_upload(raw: bytes) -> Image.Image:
+    """
+    只读文件头检查格式与预算；解码像素之前拒绝解压炸弹和超大图片。
+    返回已打开、尚未解码的图片，渲染时直接使用，不再重新解析文件头。
+    """
     try:
-        if image_b64:
-            # 图片贴入模式
-            raw = base64.b64decode(_strip_data_url(image_b64))
-            with BytesIO(raw) as bio:
-                content_img = Image.open(bio).convert("RGBA")
-            png_bytes = paste_image_auto(
-                image_source=base_image_file,
-                image_overlay=overlay_file,
-                top_left=TEXT_BOX_TOPLEFT,
-                bottom_right=IMAGE_BOX_BOTTOMRIGHT,
-                content_image=content_img,
+        return open_probed(raw, max_bytes=UPLOAD_MAX_BYTES, max_pixels=UPLOAD_MAX_PIXELS)[1]
+    except ImageBudgetError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ContentImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _decode_base64(b64: str) -> bytes:
+    _check_upload_size(len(b64) * 3 // 4)
+    try:
+        return base64.b64decode(_strip_data_url(b64))
+    except (binascii.Error, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"无效的 base64 图片: {e}")
+
+
+def _get_pack(name: Optional[str]) -> Pack:
+    try:
+        return PACKS.get(name)
+    except KeyError:
+        raise HTTPException(status_code=400, detail=f"未知的角色包: {name}（可选: {', '.join(PACKS.names())}）")
+
+
+def _pick_base(text: str, base_key: Optional[str], pack: Pack) -> Tuple[str, str]:
+    """选择底图，返回 (底图路径, 去掉切换关键词后的文本)。"""
+    # 若未显式指定 base_key，则在文本中识别切换关键词（与 main.py、安卓端规则相同，见 keyword_matcher.py）
+    return pack.pick(text, base_key)
+
+
+def _asset_digest(path: Optional[str]) -> Optional[str]:
+    if not path:
+        return None
+    try:
+        return ASSET_REGISTRY.digest(path)
+    except OSError:
+        return None  # 文件不存在：渲染时按原逻辑报错或跳过图层
+
+
+class _Job(NamedTuple):
+    """一次生成所需的全部输入；key 为这些输入的内容哈希，同时用作 ETag。"""
+    key: str
+    text: str
+    raw: Optional[bytes]
+    raw_digest: Optional[str]  # 贴入图片的 sha256，同时用作缩放结果缓存的键
+    opened: Optional[Image.Image]  # 检查文件头时打开的贴入图片（未解码；基于内存中的字节，不占文件句柄）
+    base_file: str
+    overlay_file: Optional[str]
+    encoder: str
+    quality: Optional[int]
+    box: Box  # 文字 / 图片区域 (左上, 右下)，来自角色包
+
+
+def _make_job(
+    text: str,
+    raw: Optional[bytes],
+    base_key: Optional[str],
+    use_overlay: Optional[bool],
+    encoder: str,
+    quality: Optional[int],
+    pack_name: Optional[str] = None,
+) -> _Job:
+    """
+    确定底图与图层并计算缓存键（不做渲染）。包含切换关键词扫描、上传图片的文件头检查、
+    sha256 与底图摘要，路由中经 run_in_threadpool 调用，不占用事件循环。
+    """
+    pack = _get_pack(pack_name)
+    base_file, text = _pick_base(text, base_key, pack)
+    overlay_file = pack.overlay if (use_overlay if use_overlay is not None else USE_BASE_OVERLAY) else None
+    is_image = raw is not None
+    opened = _probe_upload(raw) if is_image else None
+    raw_digest = hashlib.sha256(raw).hexdigest() if is_image else None
+    key = render_key(
+        mode="image" if is_image else "text",
+        text="" if is_image else text,
+        image=raw_digest,
+        base=(base_file, _asset_digest(base_file)),
+        overlay=(overlay_file, _asset_digest(overlay_file)) if overlay_file else None,
+        font=None if is_image else file_signature(FONT_FILE),
+        fit=FIT_QUALITY if is_image else None,
+        box=pack.text_box,
+        encoder=encoder,
+        quality=quality,
+    )
+    return _Job(key, text, raw, raw_digest, opened, base_file, overlay_file, encoder, quality, pack.text_box)
+
+
+def _render(job: _Job) -> EncodedImage:
+    """按文本或图片生成素描本图片。"""
+    try:
+        if job.raw is not None:
+            # 图片贴入模式：直接传入原始字节，由 paste_image_auto 按目标尺寸缩放解码
+            return paste_image_auto(
+                image_source=job.base_file,
+                image_overlay=job.overlay_file,
+                top_left=job.box[0],
+                bottom_right=job.box[1],
+                content_image=job.raw,
                 align="center",
                 valign="middle",
                 padding=12,
                 allow_upscale=True,
                 keep_alpha=True,
+                encoder=job.encoder,
+                quality=job.quality,
+                encoded=True,
+                fit_quality=FIT_QUALITY,
+                max_pixels=UPLOAD_MAX_PIXELS,
+                content_digest=job.raw_digest,
+                opened=job.opened,
             )
-        else:
-            # 文本绘制模式
-            png_bytes = draw_text_auto(
-                image_source=base_image_file,
-                image_overlay=overlay_file,
-                top_left=TEXT_BOX_TOPLEFT,
-                bottom_right=IMAGE_BOX_BOTTOMRIGHT,
-                text=text,
-                color=(0, 0, 0),
-                max_font_height=64,
-                font_path=FONT_FILE,
-            )
+        # 文本绘制模式
+        return draw_text_auto(
+            image_source=job.base_file,
+            image_overlay=job.overlay_file,
+            top_left=job.box[0],
+            bottom_right=job.box[1],
+            text=job.text,
+            color=(0, 0, 0),
+            max_font_height=64,
+            font_path=FONT_FILE,
+            encoder=job.encoder,
+            quality=job.quality,
+            encoded=True,
+        )
+    except ImageBudgetError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ContentImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"生成失败: {e}")
 
-    # 返回 base64
-    with BytesIO(png_bytes) as bio:
-        img = Image.open(BytesIO(png_bytes))
-        w, h = img.size
+
+def _render_cached(job: _Job) -> CachedResult:
+    """在渲染线程中执行：先查磁盘层，未命中再渲染并写入缓存。"""
+    cached = RESULT_CACHE.get_disk(job.key)
+    if cached is not None and job.opened is not None:
+        job.opened.close()
+    if cached is None:
+        cached = CachedResult(_render(job), {"used_base": job.base_file})
+        RESULT_CACHE.put(job.key, cached)
+    return cached
+
+
+async def _produce(job: _Job) -> CachedResult:
+    """
+    内存层命中时直接返回（不占用渲染线程），否则交给渲染线程池；队列已满时抛出 PoolFullError。
+    相同缓存键的并发请求（包括同一批次内的重复条目）合并为一次渲染。
+    """
+    cached = RESULT_CACHE.get_memory(job.key)
+    if cached is None:
+        cached = await RENDER_FLIGHTS.do_async(job.key, RENDER_POOL.run, _render_cached, job)
+    return cached
+
+
+async def _produce_or_503(job: _Job) -> CachedResult:
+    try:
+        return await _produce(job)
+    except PoolFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 使用弱比较（忽略 W/ 前缀）。"""
+    if not if_none_match:
+        return False
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def _not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+
+def _to_generate_response(cached: CachedResult) -> GenerateResponse:
+    # 返回 base64；宽高直接取自渲染结果
+    result = cached.image
+    with metrics.stage("generate", "base64"):
+        image_base64 = f"data:{result.media_type};base64," + base64.b64encode(result.data).decode("utf-8")
     return GenerateResponse(
-        image_base64="data:image/png;base64," + base64.b64encode(png_bytes).decode("utf-8"),
-        width=w,
-        height=h,
-        used_base=base_image_file,
+        image_base64=image_base64,
+        width=result.width,
+        height=result.height,
+        used_base=cached.meta["used_base"],
+        format=result.encoder,
+        media_type=result.media_type,
+    )
+
+
+def _json_body(cached: CachedResult) -> dict:
+    """批量接口中单个条目的响应字段（含 base64 编码，在线程中执行）。"""
+    return jsonable_encoder(_to_generate_response(cached))
+
+
+def _json_job(req: GenerateRequest) -> _Job:
+    """/generate 的输入解析：base64 解码 + _make_job（在线程中执行）。"""
+    text = (req.text or "").strip()
+    if not text and not req.image_base64:
+        raise HTTPException(status_code=400, detail="必须提供 text 或 image_base64 之一")
+    _check_quality(req.encoder, req.quality)
+    raw = _decode_base64(req.image_base64) if req.image_base64 else None
+    return _make_job(text, raw, req.base_key, req.use_overlay, req.encoder, req.quality, req.pack)
+
+
+def _json_etag(job: _Job) -> str:
+    # JSON 与二进制响应的字节不同，使用不同的 ETag
+    return f'"{job.key}.json"'
+
+
+@app.post("/generate", response_model=GenerateResponse)
+async def generate(req: GenerateRequest, response: Response, if_none_match: Optional[str] = Header(None)):
+    # 事件循环只负责解析与调度：输入解码、哈希与输出的 base64 编码都在线程中执行
+    job = await run_in_threadpool(_json_job, req)
+    etag = _json_etag(job)
+    if _etag_matches(if_none_match, etag):
+        return _not_modified(etag)
+    cached = await _produce_or_503(job)
+    response.headers["ETag"] = etag
+    return await run_in_threadpool(_to_generate_response, cached)
+
+
+# ---- 批量接口 ----
+
+class BatchRequest(BaseModel):
+    items: List[GenerateRequest] = Field(..., description=f"要生成的请求列表（1-{BATCH_MAX_ITEMS} 项），字段同 /generate")
+
+
+async def _batch_item(index: int, req: GenerateRequest, limit: asyncio.Semaphore) -> dict:
+    """渲染单个条目；任何错误都转为该条目的错误结果，不影响整批。"""
+    async with limit:
+        try:
+            job = await run_in_threadpool(_json_job, req)
+            cached = await _produce(job)
+            return {"index": index, "ok": True, "etag": _json_etag(job), **(await run_in_threadpool(_json_body, cached))}
+        except PoolFullError as e:
+            return {"index": index, "ok": False, "status": 503, "error": str(e), "retry_after": e.retry_after}
+        except HTTPException as e:
+            return {"index": index, "ok": False, "status": e.status_code, "error": e.detail}
+        except Exception as e:
+            return {"index": index, "ok": False, "status": 500, "error": f"生成失败: {e}"}
+
+
+@app.post("/generate/batch")
+async def generate_batch(batch: BatchRequest):
+    """
+    并行渲染多个请求，每完成一项就输出一行 JSON（application/x-ndjson）：
+    成功为 {"index", "ok": true, "etag", ...GenerateResponse 字段}（etag 与单独请求 /generate 时相同），
+    失败为 {"index", "ok": false, "status", "error"}（队列已满时另有 retry_after）。
+    """
+    if not 1 <= len(batch.items) <= BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=422, detail=f"items 数量必须在 1-{BATCH_MAX_ITEMS} 之间")
+
+    # 单个批次最多同时占用全部渲染线程，剩余条目在批次内部等待，不挤占共享队列
+    limit = asyncio.Semaphore(RENDER_POOL.workers)
+    tasks = [asyncio.ensure_future(_batch_item(i, item, limit)) for i, item in enumerate(batch.items)]
+
+    async def stream():
+        try:
+            for fut in asyncio.as_completed(tasks):
+                yield json.dumps(await fut, ensure_ascii=False) + "\n"
+        finally:
+            # 客户端断开时取消尚未开始的条目
+            for t in tasks:
+                t.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+# ---- 二进制接口：上传原始图片字节，直接返回图片字节，元数据放在响应头 ----
+
+# Accept 协商：未显式指定 encoder 时，按 Accept 中出现的顺序选择
+_ACCEPT_ENCODERS = {"image/png": "png", "image/webp": "webp", "image/jpeg": "jpeg"}
+
+
+def _negotiate_encoder(encoder: Optional[str], accept: Optional[str]) -> str:
+    if encoder:
+        return encoder
+    for part in (accept or "").split(","):
+        media = part.split(";", 1)[0].strip().lower()
+        if media in _ACCEPT_ENCODERS:
+            return _ACCEPT_ENCODERS[media]
+    return DEFAULT_ENCODER
+
+
+def _binary_response(cached: CachedResult, etag: str) -> Response:
+    result = cached.image
+    return Response(
+        content=result.data,
+        media_type=result.media_type,
+        headers={
+            "ETag": etag,
+            "X-Image-Width": str(result.width),
+            "X-Image-Height": str(result.height),
+            # 底图路径可能含中文，按 URL 编码放入响应头
+            "X-Used-Base": quote(cached.meta["used_base"]),
+            "X-Encoder": result.encoder,
+            "Content-Disposition": f'inline; filename="sketchbook.{get_preset(result.encoder).extension}"',
+        },
+    )
+
+
+async def _generate_binary(
+    text: Optional[str],
+    raw: Optional[bytes],
+    base_key: Optional[str],
+    use_overlay: Optional[bool],
+    encoder: str,
+    quality: Optional[int],
+    if_none_match: Optional[str],
+    pack: Optional[str] = None,
+) -> Response:
+    text = (text or "").strip()
+    if not text and not raw:
+        raise HTTPException(status_code=400, detail="必须提供 text 或图片内容之一")
+    _check_quality(encoder, quality)
+
+    job = await run_in_threadpool(_make_job, text, raw or None, base_key, use_overlay, encoder, quality, pack)
+    etag = f'"{job.key}"'
+    if _etag_matches(if_none_match, etag):
+        return _not_modified(etag)
+    return _binary_response(await _produce_or_503(job), etag)
+
+
+_BINARY_RESPONSES = {
+    200: {"content": {"image/png": {}, "image/webp": {}, "image/jpeg": {}, "application/octet-stream": {}}}
+}
+
+
+@app.post("/generate/upload", response_class=Response, responses=_BINARY_RESPONSES)
+async def generate_upload(
+    text: Optional[str] = Form(None),
+    image: Optional[UploadFile] = File(None),
+    pack: Optional[str] = Form(None),
+    base_key: Optional[str] = Form(None),
+    use_overlay: Optional[bool] = Form(None),
+    encoder: Optional[EncoderName] = Form(None),
+    quality: Optional[int] = Form(None, ge=0, le=100),
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+):
+    """multipart/form-data 上传：image 为图片文件，其余字段同 /generate。"""
+    if image is not None:
+        _check_upload_size(image.size)
+    raw = await image.read() if image is not None else None
+    return await _generate_binary(
+        text, raw, base_key, use_overlay, _negotiate_encoder(encoder, accept), quality, if_none_match, pack
+    )
+
+
+async def _read_body(request: Request) -> bytes:
+    """逐块读取请求体，累计超过 UPLOAD_MAX_BYTES 时立即中止（不依赖客户端声明的 Content-Length）。"""
+    length = request.headers.get("content-length")
+    _check_upload_size(int(length) if length and length.isdigit() else None)
+    chunks = []
+    total = 0
+    async for chunk in request.stream():
+        total += len(chunk)
+        _check_upload_size(total)
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+@app.post("/generate/raw", response_class=Response, responses=_BINARY_RESPONSES)
+async def generate_raw(
+    request: Request,
+    text: Optional[str] = Query(None),
+    pack: Optional[str] = Query(None),
+    base_key: Optional[str] = Query(None),
+    use_overlay: Optional[bool] = Query(None),
+    encoder: Optional[EncoderName] = Query(None),
+    quality: Optional[int] = Query(None, ge=0, le=100),
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+):
+    """请求体为原始图片字节（如 Content-Type: image/png），参数放在查询字符串；纯文本模式时请求体为空。"""
+    raw = await _read_body(request)
+    return await _generate_binary(
+        text, raw or None, base_key, use_overlay, _negotiate_encoder(encoder, accept), quality, if_none_match, pack
     )
 
 
 @app.get("/")
 def root():
-    return {"ok": True, "service": "Anan Sketchbook API", "endpoints": ["GET /bases", "POST /generate"]}
+    return {"ok": True, "service": "Anan Sketchbook API", "endpoints": ["GET /bases", "GET /stats", "GET /metrics", "POST /generate", "POST /generate/batch", "POST /generate/upload", "POST /generate/raw"]}
 
 
 # 允许 `python api.py` 直接启动开发服务器
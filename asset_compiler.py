@@ -0,0 +1,162 @@
+# filename: asset_compiler.py
+"""
+底图预编译：把底图与置顶图层转换为预先解码、按页对齐的 RGBA 原始像素文件（"<文件名>.rgba"，放在源文件旁）。
+
+运行时 asset_cache 发现未过期的预编译文件时直接 mmap 其像素，不再 inflate PNG：
+冷启动的进程无需解码即可开始渲染，多个 worker 通过系统页缓存共享同一份像素。
+文件头记录源文件的 sha1 / 大小 / mtime，源文件改变后预编译文件自动视为过期（退回解码原图）；
+同时记录不透明像素的范围（alpha_bbox），局部合成时图层只需粘贴该范围与文字框的交集；
+置顶图层还会附带这块交集的像素（text_region），合成时直接引用映射的页面，不再每次裁剪。
+文字框改变后该裁剪结果只是不再命中（退回裁剪），不影响正确性。
+
+用法：
+  python asset_compiler.py                 # 编译 config 中的全部底图、置顶图层及 PACKS_DIR 下的角色包
+  python asset_compiler.py a.png b.png     # 只编译指定文件
+  python asset_compiler.py ov.png --text-box 119,450,398,625   # 指定文件并附带该文字框的图层裁剪
+  python asset_compiler.py --check         # 只检查，有缺失或过期时退出码为 1（可用于部署前检查）
+  python asset_compiler.py --clean         # 删除预编译文件
+"""
+import argparse
+import os
+import sys
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+from asset_cache import (
+    COMPILED_ALIGN,
+    COMPILED_MAGIC,
+    COMPILED_VERSION,
+    compiled_path,
+    read_compiled_header,
+)
+from sidecar import local_path, source_fields, source_status, write_file
+
+
+Box = Tuple[int, int, int, int]
+
+
+def default_sources() -> Dict[str, Optional[Box]]:
+    """
+    config 中的底图与置顶图层，以及 PACKS_DIR 下各角色包引用的图片；
+    返回 {路径: 文字框}，只有置顶图层带文字框（用于预先裁剪），其余为 None。
+    """
+    from config import BASEIMAGE_FILE, BASEIMAGE_MAPPING, BASE_OVERLAY_FILE, PACKS_DIR, TEXT_BOX_TOPLEFT, IMAGE_BOX_BOTTOMRIGHT
+
+    sources: Dict[str, Optional[Box]] = {}
+    for p in (BASEIMAGE_FILE, *BASEIMAGE_MAPPING.values()):
+        sources.setdefault(local_path(p), None)
+    sources[local_path(BASE_OVERLAY_FILE)] = (*TEXT_BOX_TOPLEFT, *IMAGE_BOX_BOTTOMRIGHT)
+    if PACKS_DIR:
+        from packs import PackRegistry
+
+        registry = PackRegistry()
+        registry.load_dir(local_path(PACKS_DIR), (TEXT_BOX_TOPLEFT, IMAGE_BOX_BOTTOMRIGHT))
+        for name in registry.names():
+            pack = registry.get(name)
+            for p in pack.files():
+                sources.setdefault(local_path(p), None)
+            if pack.overlay:
+                sources[local_path(pack.overlay)] = (*pack.text_box[0], *pack.text_box[1])
+    return sources
+
+
+def _parse_box(value: str) -> Box:
+    try:
+        box = tuple(int(v) for v in value.split(","))
+    except ValueError:
+        box = ()
+    if len(box) != 4 or box[2] <= box[0] or box[3] <= box[1]:
+        raise argparse.ArgumentTypeError(f"文字框应为 left,top,right,bottom: {value}")
+    return box
+
+
+def status(src: str) -> str:
+    """"fresh"（未过期）/ "stale"（源文件已改变）/ "missing"（未编译）。"""
+    return source_status(src, read_compiled_header(compiled_path(src)))
+
+
+def compile_asset(src: str, text_box: Optional[Box] = None) -> str:
+    """
+    解码 src 并写出预编译文件（先写临时文件再替换，正在映射旧文件的进程不受影响）；返回输出路径。
+    给出 text_box 时附带文字框与不透明范围交集的像素（置顶图层用）。
+    """
+    st = os.stat(src)
+    with open(src, "rb") as f:
+        raw = f.read()
+    with BytesIO(raw) as bio:
+        image = Image.open(bio).convert("RGBA")
+    w, h = image.size
+    alpha_bbox = image.getchannel("A").getbbox()
+    region = None
+    if text_box is not None and alpha_bbox is not None:
+        region = (
+            max(text_box[0], alpha_bbox[0]),
+            max(text_box[1], alpha_bbox[1]),
+            min(text_box[2], alpha_bbox[2]),
+            min(text_box[3], alpha_bbox[3]),
+        )
+        if region[2] <= region[0] or region[3] <= region[1]:
+            region = None
+    header = {
+        "version": COMPILED_VERSION,
+        "width": w,
+        "height": h,
+        "mode": "RGBA",
+        **source_fields(src, st, raw),
+        "alpha_bbox": alpha_bbox,
+        "text_region": region,
+    }
+    sections = [("data_offset", image.tobytes())]
+    if region is not None:
+        sections.append(("text_region_offset", image.crop(region).tobytes()))
+    out = compiled_path(src)
+    write_file(out, COMPILED_MAGIC, header, sections, COMPILED_ALIGN)
+    return out
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="底图预编译为可 mmap 的 RGBA 原始像素文件")
+    parser.add_argument("paths", nargs="*", help="要编译的图片（默认为 config 中的全部底图与图层）")
+    parser.add_argument("--check", action="store_true", help="只检查，有缺失或过期时退出码为 1")
+    parser.add_argument("--force", action="store_true", help="未过期的文件也重新编译")
+    parser.add_argument("--clean", action="store_true", help="删除预编译文件")
+    parser.add_argument("--text-box", type=_parse_box, help="与指定文件一起使用：附带该文字框的图层裁剪（left,top,right,bottom）")
+    args = parser.parse_args(argv)
+
+    if args.paths:
+        sources = {local_path(p): args.text_box for p in args.paths}
+    else:
+        sources = default_sources()
+    outdated = 0
+    for src, text_box in sources.items():
+        if not os.path.isfile(src):
+            if args.check:
+                # 检查模式下源文件不存在同样视为未就绪，部署检查不能因此通过
+                print(f"{'missing':8s} {src}（源文件不存在）")
+                outdated += 1
+            else:
+                print(f"跳过（文件不存在）: {src}", file=sys.stderr)
+            continue
+        if args.clean:
+            out = compiled_path(src)
+            if os.path.exists(out):
+                os.remove(out)
+                print(f"已删除: {out}")
+            continue
+        state = status(src)
+        if args.check:
+            print(f"{state:8s} {src}")
+            outdated += state != "fresh"
+            continue
+        if state == "fresh" and not args.force:
+            print(f"未过期: {src}")
+            continue
+        out = compile_asset(src, text_box)
+        print(f"已编译: {src} -> {out} ({os.path.getsize(out) // 1024} KB)")
+    return 1 if outdated else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
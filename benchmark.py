@@ -0,0 +1,316 @@
+# filename: benchmark.py
+"""
+渲染核心（draw_text_auto / paste_image_auto）的基准测试。
+
+使用固定的合成语料（不依赖网络或随机数，每次运行输入完全相同）：
+- 文本：短 / 长中文、带空格的英文、无空格长串、大量【】括号、多段落
+- 图片：从 16×16 到 8000×6000 的合成图
+每个用例默认在独立子进程中运行，以便分别统计峰值内存；
+输出 p50 / p95 延迟、吞吐量与峰值常驻内存（JSON）。
+
+用法：
+  python benchmark.py                                  # 运行全部用例，JSON 输出到标准输出
+  python benchmark.py --cases text_ --output now.json  # 只运行名字匹配的用例
+  python benchmark.py --save-baseline base.json        # 保存基线
+  python benchmark.py --baseline base.json --threshold 0.15
+      # 与基线比较，任一用例的 p50 变慢超过 15% 时以退出码 1 结束
+升级 Pillow 或修改渲染代码前后各运行一次即可比较。
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import PIL
+from PIL import Image
+
+from config import (
+    FONT_FILE,
+    BASEIMAGE_FILE,
+    BASE_OVERLAY_FILE,
+    USE_BASE_OVERLAY,
+    TEXT_BOX_TOPLEFT,
+    IMAGE_BOX_BOTTOMRIGHT,
+)
+from sidecar import local_path
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except Exception:
+    psutil = None
+
+
+class Case(NamedTuple):
+    name: str
+    kind: str          # "text" 或 "image"
+    payload: Callable  # 返回文本或图片（在计时之外构造）
+    iterations: int    # 默认迭代次数（--iterations 可覆盖）
+
+
+def _text(s: str) -> Callable[[], str]:
+    return lambda: s
+
+
+def _synthetic_image(w: int, h: int, mode: str = "RGB") -> Callable[[], Image.Image]:
+    """确定性的合成图片：渐变通道组合，含高频细节，避免编码/缩放走捷径。"""
+
+    def make() -> Image.Image:
+        r = Image.linear_gradient("L").resize((w, h))
+        g = Image.radial_gradient("L").resize((w, h))
+        b = Image.linear_gradient("L").rotate(90).resize((w, h))
+        # 叠加细网格纹理
+        tile = Image.linear_gradient("L").resize((7, 5))
+        pattern = Image.new("L", (w, h))
+        for y in range(0, h, 5 * 64):
+            for x in range(0, w, 7 * 64):
+                pattern.paste(tile.resize((7 * 64, 5 * 64), Image.NEAREST), (x, y))
+        r = Image.blend(r, pattern, 0.5)
+        img = Image.merge("RGB", (r, g, b))
+        if mode == "RGBA":
+            img.putalpha(g)
+        return img
+
+    return make
+
+
+CASES: List[Case] = [
+    Case("text_cjk_short", "text", _text("你好"), 200),
+    Case("text_cjk_long", "text", _text("安安今天也在努力地画画，" * 20), 60),
+    Case("text_latin_spaces", "text", _text("The quick brown fox jumps over the lazy dog. " * 8), 60),
+    Case("text_no_space_long", "text", _text("Supercalifragilisticexpialidocious" * 12), 60),
+    Case("text_brackets_heavy", "text", _text("【重点】普通【强调[内容]】" * 15), 60),
+    Case("text_multi_paragraph", "text", _text("第一段文字。\n\n第二段 with English words.\n【第三段】\n" * 5), 60),
+    Case("image_tiny_16", "image", _synthetic_image(16, 16), 100),
+    Case("image_small_640", "image", _synthetic_image(640, 480), 60),
+    Case("image_rgba_1280", "image", _synthetic_image(1280, 960, "RGBA"), 30),
+    Case("image_large_3000", "image", _synthetic_image(3000, 2000), 10),
+    Case("image_huge_8000", "image", _synthetic_image(8000, 6000), 5),
+]
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 单位为 KB，macOS 为字节
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return round(getattr(info, "peak_wset", info.rss) / (1024 * 1024), 1)
+    return None
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    # 线性插值，样本较少时也稳定
+    pos = (len(ordered) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def run_case(case: Case, args) -> dict:
+    """在当前进程中运行一个用例并返回统计结果。"""
+    from text_fit_draw import draw_text_auto
+    from image_fit_paste import paste_image_auto
+
+    base = local_path(args.base)
+    overlay = local_path(args.overlay) if args.overlay else None
+    font = local_path(args.font)
+    payload = case.payload()
+
+    if case.kind == "text":
+        def once():
+            return draw_text_auto(
+                image_source=base, image_overlay=overlay,
+                top_left=TEXT_BOX_TOPLEFT, bottom_right=IMAGE_BOX_BOTTOMRIGHT,
+                text=payload, color=(0, 0, 0), max_font_height=64, font_path=font,
+                encoder=args.encoder,
+            )
+    else:
+        def once():
+            return paste_image_auto(
+                image_source=base, image_overlay=overlay,
+                top_left=TEXT_BOX_TOPLEFT, bottom_right=IMAGE_BOX_BOTTOMRIGHT,
+                content_image=payload, align="center", valign="middle", padding=12,
+                allow_upscale=True, keep_alpha=True, encoder=args.encoder,
+            )
+
+    iterations = args.iterations or case.iterations
+    rss_before = _peak_rss_mb()
+    for _ in range(args.warmup):
+        once()
+    gc.collect()
+    samples = []
+    out_bytes = 0
+    total_start = time.perf_counter()
+    for _ in range(iterations):
+        if args.cold:
+            _clear_caches()
+        start = time.perf_counter()
+        out_bytes = len(once())
+        samples.append(time.perf_counter() - start)
+    total = time.perf_counter() - total_start
+
+    return {
+        "kind": case.kind,
+        "iterations": iterations,
+        "p50_ms": round(_percentile(samples, 0.50) * 1000, 3),
+        "p95_ms": round(_percentile(samples, 0.95) * 1000, 3),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+        "min_ms": round(min(samples) * 1000, 3),
+        "throughput_per_s": round(iterations / total, 2),
+        "output_bytes": out_bytes,
+        "rss_before_mb": rss_before,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _clear_caches() -> None:
+    """冷启动模式：清空与输入相关的排版、字形、缩放缓存（底图解码与 PNG 前缀只与底图有关，保留）。"""
+    from text_fit_draw import LAYOUT_CACHE
+    from glyph_atlas import GLYPH_ATLAS
+    from image_fit_paste import FIT_CACHE
+
+    LAYOUT_CACHE.clear()
+    GLYPH_ATLAS.clear()
+    FIT_CACHE.clear()
+
+
+def _child_argv(case: Case, args) -> List[str]:
+    argv = [sys.executable, os.path.abspath(__file__), "--child", case.name,
+            "--encoder", args.encoder, "--warmup", str(args.warmup), "--base", args.base, "--font", args.font]
+    if args.overlay:
+        argv += ["--overlay", args.overlay]
+    if args.iterations:
+        argv += ["--iterations", str(args.iterations)]
+    if args.cold:
+        argv.append("--cold")
+    return argv
+
+
+def run_suite(args) -> dict:
+    pattern = re.compile(args.cases) if args.cases else None
+    results: Dict[str, dict] = {}
+    for case in CASES:
+        if pattern is not None and not pattern.search(case.name):
+            continue
+        print(f"running {case.name} ...", file=sys.stderr)
+        if args.no_isolate:
+            results[case.name] = run_case(case, args)
+            continue
+        proc = subprocess.run(_child_argv(case, args), capture_output=True, text=True)
+        if proc.returncode != 0:
+            results[case.name] = {"kind": case.kind, "error": proc.stderr.strip().splitlines()[-1:]}
+            continue
+        results[case.name] = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except Exception:
+        numpy_version = None
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "numpy": numpy_version,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "encoder": args.encoder,
+            "mode": "cold" if args.cold else "warm",
+            "isolated": not args.no_isolate,
+        },
+        "cases": results,
+    }
+
+
+def compare(current: dict, baseline: dict, metric: str, threshold: float) -> List[str]:
+    """返回超过阈值的用例说明；空列表表示全部通过。"""
+    failures = []
+    for name, now in current["cases"].items():
+        before = baseline.get("cases", {}).get(name)
+        if before is None or metric not in before or metric not in now:
+            continue
+        ratio = now[metric] / before[metric] if before[metric] else 1.0
+        now["baseline_" + metric] = before[metric]
+        now["change"] = round(ratio - 1, 4)
+        if ratio > 1 + threshold:
+            failures.append(f"{name}: {metric} {before[metric]} -> {now[metric]} ms (+{(ratio - 1) * 100:.1f}%)")
+    return failures
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="渲染核心基准测试")
+    parser.add_argument("--cases", help="只运行名字匹配该正则的用例")
+    parser.add_argument("--list", action="store_true", help="列出全部用例")
+    parser.add_argument("--iterations", type=int, default=None, help="覆盖每个用例的默认迭代次数")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--encoder", default="png")
+    parser.add_argument("--cold", action="store_true", help="每次迭代前清空排版、字形与缩放缓存")
+    parser.add_argument("--base", default=BASEIMAGE_FILE)
+    parser.add_argument("--overlay", default=BASE_OVERLAY_FILE if USE_BASE_OVERLAY else None)
+    parser.add_argument("--font", default=FONT_FILE)
+    parser.add_argument("--no-isolate", action="store_true", help="所有用例在同一进程中运行（峰值内存不再分用例统计）")
+    parser.add_argument("--output", help="结果 JSON 写入该文件（默认输出到标准输出）")
+    parser.add_argument("--save-baseline", help="将结果另存为基线文件")
+    parser.add_argument("--baseline", help="与该基线比较")
+    parser.add_argument("--metric", default="p50_ms", choices=["p50_ms", "p95_ms", "mean_ms"])
+    parser.add_argument("--threshold", type=float, default=0.10, help="允许的变慢比例，默认 0.10（10%%）")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for case in CASES:
+            print(f"{case.name:24s} {case.kind:6s} x{case.iterations}")
+        return 0
+
+    if args.child:
+        case = next(c for c in CASES if c.name == args.child)
+        print(json.dumps(run_case(case, args)))
+        return 0
+
+    if not os.path.isfile(local_path(args.font) or ""):
+        print(f"找不到字体文件 {args.font}，请用 --font 指定。", file=sys.stderr)
+        return 2
+
+    report = run_suite(args)
+    failures = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        failures = compare(report, baseline, args.metric, args.threshold)
+        report["comparison"] = {"baseline": args.baseline, "metric": args.metric,
+                                "threshold": args.threshold, "failures": failures}
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+    errors = [name for name, r in report["cases"].items() if "error" in r]
+    for line in failures:
+        print("REGRESSION " + line, file=sys.stderr)
+    for name in errors:
+        print(f"ERROR {name}: {report['cases'][name]['error']}", file=sys.stderr)
+    return 1 if failures or errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
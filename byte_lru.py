@@ -0,0 +1,154 @@
+# filename: byte_lru.py
+"""
+按字节预算淘汰的线程安全 LRU 缓存，供排版、底图、结果等各级缓存复用。
+每个条目在放入时给出其估算占用字节数，超出预算时从最久未使用的一端淘汰。
+固定（pin）的键计入占用但不会被淘汰，用于常驻最常用的底图。
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Set, Tuple
+
+
+class ByteLRU:
+    """
+    - max_bytes: 字节预算；None 表示不限
+    - max_entries: 条目数上限；None 表示不限
+    - on_evict: 条目被淘汰时调用 on_evict(key, nbytes)（持锁调用，不得再访问本缓存）
+    单个条目超过预算时不会被缓存。
+    """
+
+    def __init__(
+        self,
+        max_bytes: Optional[int] = None,
+        max_entries: Optional[int] = None,
+        on_evict: Optional[Callable[[Hashable, int], None]] = None,
+    ):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+        self._items: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._pinned: Set[Hashable] = set()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._items
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """读取但不更新命中统计与 LRU 顺序。"""
+        item = self._items.get(key)
+        return default if item is None else item[0]
+
+    def nbytes(self, key: Hashable) -> int:
+        """条目的占用字节数；不存在时为 0。"""
+        item = self._items.get(key)
+        return 0 if item is None else item[1]
+
+    def pin(self, key: Hashable) -> None:
+        """固定键：之后放入的该键条目不会被淘汰（键可以尚未放入）。"""
+        with self._lock:
+            self._pinned.add(key)
+
+    def unpin(self, key: Hashable) -> None:
+        with self._lock:
+            self._pinned.discard(key)
+            self._evict_locked()
+
+    def put(self, key: Hashable, value: Any, nbytes: int) -> bool:
+        """放入条目；返回是否真正缓存（超出预算的单个条目会被拒绝）。"""
+        if self.max_bytes is not None and nbytes > self.max_bytes:
+            return False
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._items[key] = (value, nbytes)
+            self.bytes += nbytes
+            self._evict_locked()
+        return True
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return default
+            self.bytes -= item[1]
+            return item[0]
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Tuple[Any, int]]) -> Any:
+        """未命中时调用 factory() -> (value, nbytes) 生成并放入。"""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        value, nbytes = factory()
+        self.put(key, value, nbytes)
+        return value
+
+    def _over_budget_locked(self) -> bool:
+        return (self.max_bytes is not None and self.bytes > self.max_bytes) or (
+            self.max_entries is not None and len(self._items) > self.max_entries
+        )
+
+    def _evict_locked(self) -> None:
+        if not self._pinned:
+            while self._items and self._over_budget_locked():
+                key, (_, nbytes) = self._items.popitem(last=False)
+                self._evicted_locked(key, nbytes)
+            return
+        # 有固定的键时跳过它们；只剩固定条目时即使超出预算也停止
+        for key in list(self._items):
+            if not self._over_budget_locked():
+                break
+            if key in self._pinned:
+                continue
+            _, nbytes = self._items.pop(key)
+            self._evicted_locked(key, nbytes)
+
+    def _evicted_locked(self, key: Hashable, nbytes: int) -> None:
+        self.bytes -= nbytes
+        self.evictions += 1
+        if self.on_evict is not None:
+            self.on_evict(key, nbytes)
+
+    def resize(self, max_bytes: Optional[int]) -> None:
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict_locked()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "pinned": len(self._pinned),
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+_MISSING = object()
@@ -80,10 +80,73 @@ IMAGE_BOX_BOTTOMRIGHT= (119+279, 450+175)
 # 此值为字符串, 代表相对main的相对路径
 BASE_OVERLAY_FILE= "BaseImages\\base_overlay.png"
 
+# 底图解码缓存的内存上限（字节）, 底图与置顶图层只解码一次并常驻内存
+# 此值为整数或 None, None 表示不限制（默认 6 张底图约占用十余 MB）
+ASSET_CACHE_MAX_BYTES= None
+
+# 角色包目录, 其下每个子目录包含一个 pack.json, 列出该角色的底图、置顶图层与文字区域（格式见 packs.py）
+# API 请求可用 pack 字段选择角色包; 包中的底图在第一次使用时才解码, 只有 pin 中的底图常驻
+# 角色包较多时请同时设置 ASSET_CACHE_MAX_BYTES, 超出上限时淘汰最久未使用的底图
+# 此值为字符串或 None, None 表示只使用上面配置的底图（即默认包 "default"）
+PACKS_DIR= None
+
+# API 服务的渲染线程数, 同时最多有这么多个请求在渲染
+# 此值为整数或 None, None 表示使用 CPU 核数
+RENDER_WORKERS= None
+
+# API 服务的渲染排队上限, 排队已满时新请求会立即收到 503 并带 Retry-After
+# 此值为整数, 0 表示不排队
+RENDER_QUEUE_SIZE= 32
+
+# API 批量接口 /generate/batch 单次最多的条目数
+# 此值为正整数
+BATCH_MAX_ITEMS= 64
+
+# 多进程服务 (server.py) 的 worker 进程数, 各进程共享已解码的底图
+# 此值为整数或 None, None 表示使用 CPU 核数
+SERVER_WORKERS= None
+
+# API 生成结果缓存的内存上限（字节）, 相同输入直接返回已生成的图片
+# 此值为整数, 0 表示不使用内存缓存
+RESULT_CACHE_MAX_BYTES= 64 * 1024 * 1024
+
+# API 生成结果的磁盘缓存目录, 重启后仍可命中, 多进程服务的各 worker 可共用
+# 此值为字符串或 None, None 表示不使用磁盘缓存
+RESULT_CACHE_DIR= None
+
+# 磁盘缓存的容量上限（字节）, 超出时删除最久未使用的文件
+# 此值为整数
+RESULT_CACHE_DISK_MAX_BYTES= 512 * 1024 * 1024
+
+# API 是否记录各渲染阶段的耗时（底图、排版、绘制、图层、编码等）, 由 /metrics 输出
+# 此值为布尔值, True 或 False, 关闭后 /metrics 仍输出缓存与队列指标
+METRICS_ENABLED= True
+
+# 贴入图片的缩放质量档位, 大图（如手机照片）缩小到图片框时使用
+# 可选: "best" 全尺寸解码后精细缩放(最慢) / "balanced" JPEG 按比例解码并整数倍预缩小, 效果与 best 几乎无法区分 / "fast" 最快
+# 此值为字符串
+FIT_QUALITY= "balanced"
+
+# 上传图片的预算, 在解码任何像素之前只读取文件头检查, 超出时 API 返回 413
+# UPLOAD_MAX_BYTES 为文件字节数上限; UPLOAD_MAX_PIXELS 为解码像素数上限（JPEG 按缩小解码后的尺寸计算）
+# 此值为整数, 设为 None 表示不限制
+UPLOAD_MAX_BYTES= 20 * 1024 * 1024
+UPLOAD_MAX_PIXELS= 5000 * 5000
+
+# 贴入图片缩放结果缓存的内存上限（字节）, 同一张贴纸 / 截图反复贴入时跳过解码与缩放
+# 此值为整数, 设为 0 表示不缓存
+FIT_CACHE_MAX_BYTES= 32 * 1024 * 1024
+
 # 是否启用底图的置顶图层, 用于表现遮挡
 # 此值为布尔值, True 或 False
 USE_BASE_OVERLAY= True
 
+# 桌面端生成图片的编码预设; 剪贴板中写入的是位图, 只能使用无损预设
+# 可选: "raw" 直接使用 RGBA 像素(默认, 不经过压缩与解压, 最快) / "png" 默认 PNG / "fast" 低压缩 PNG / "small" 高压缩 PNG / "webp" 无损 WebP
+# 有损的 "jpeg" 会改变剪贴板中的画面, 启动时会被拒绝
+# 此值为字符串
+OUTPUT_ENCODER= "raw"
+
 # 是否自动黏贴生成的图片(如果为否则保留图片在剪贴板, 可以手动黏贴)
 # 此值为布尔值, True 或 False
 AUTO_PASTE_IMAGE= True
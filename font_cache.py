@@ -0,0 +1,108 @@
+# filename: font_cache.py
+"""
+进程级字体缓存：按 (字体路径, 字号, face index) 复用 ImageFont 对象。
+
+draw_text_auto 在二分搜索字号时会对同一字体反复加载不同字号，
+每次 ImageFont.truetype 都要重新打开并解析字体文件（大号中文字体尤其慢）。
+这里用一个有界 LRU 缓存统一管理，api.py / main.py / android_kivy/main.py
+经由 draw_text_auto 共享同一个进程级实例。
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple, Union
+
+from PIL import ImageFont
+
+# 指定字体不存在时的后备字体（与原 _load_font 的行为一致）
+FALLBACK_FONT = "DejaVuSans.ttf"
+
+Font = Union[ImageFont.FreeTypeFont, ImageFont.ImageFont]
+FontKey = Tuple[Optional[str], int, int]
+
+
+class FontRegistry:
+    """
+    线程安全的 LRU 字体缓存。
+    - max_entries: 最多缓存的字体对象数量（每个字号单独计一项）
+    """
+
+    def __init__(self, max_entries: int = 256):
+        if max_entries <= 0:
+            raise ValueError("max_entries 必须为正数。")
+        self.max_entries = max_entries
+        self._fonts: "OrderedDict[FontKey, Font]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _resolve(font_path: Optional[str]) -> Optional[str]:
+        """把调用方给的路径规范化为缓存键；不存在时返回 None 表示使用后备字体。"""
+        if font_path and os.path.exists(font_path):
+            return os.path.abspath(font_path)
+        return None
+
+    @staticmethod
+    def _open(path: Optional[str], size: int, index: int) -> Font:
+        if path is not None:
+            return ImageFont.truetype(path, size=size, index=index)
+        try:
+            return ImageFont.truetype(FALLBACK_FONT, size=size, index=index)
+        except Exception:
+            return ImageFont.load_default()
+
+    def get(self, font_path: Optional[str], size: int, index: int = 0) -> Font:
+        """取得指定字号的字体；未命中时加载并放入缓存。"""
+        key: FontKey = (self._resolve(font_path), size, index)
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self._fonts.move_to_end(key)
+                self.hits += 1
+                return font
+            self.misses += 1
+
+        # 在锁外解析字体文件，避免阻塞其他线程的命中路径
+        font = self._open(key[0], size, index)
+
+        with self._lock:
+            existing = self._fonts.get(key)
+            if existing is not None:
+                # 并发加载了同一项，以先放入的为准
+                self._fonts.move_to_end(key)
+                return existing
+            self._fonts[key] = font
+            while len(self._fonts) > self.max_entries:
+                self._fonts.popitem(last=False)
+                self.evictions += 1
+        return font
+
+    def clear(self) -> None:
+        with self._lock:
+            self._fonts.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._fonts),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# 进程级共享实例
+FONT_REGISTRY = FontRegistry()
+
+
+def get_font(font_path: Optional[str], size: int, index: int = 0) -> Font:
+    """从进程级缓存中取得字体。"""
+    return FONT_REGISTRY.get(font_path, size, index)
+
+
+def font_cache_stats() -> Dict[str, int]:
+    """返回进程级字体缓存的命中/未命中统计。"""
+    return FONT_REGISTRY.stats()
@@ -0,0 +1,96 @@
+# filename: keyword_matcher.py
+"""
+底图切换关键词的匹配（桌面端、API、安卓端共用同一套规则）。
+
+映射表（BASEIMAGE_MAPPING）中的 "#名字#" 键不进正则：线性扫描文本中的 "#" 连续段，
+相邻两段之间的文字即候选名字，查 dict 判断是否为切换指令；其余键编译成一个字面量正则。
+耗时与文本长度成线性关系（包括大段连续 "#" 的输入），与表情数量无关。
+
+规则：
+- 形如 "#名字#" 的键，文本中写成两侧 # 数量相同的 "#名字#"、"##名字##" 都算，名字两侧的空白忽略；
+  其他形式的键按原样匹配
+- 文本中最靠前的指令决定底图；所有能识别的指令都会从文本中移除，移除后去掉首尾空白
+- 不在映射表中的 "#...#" 原样保留；没有任何指令时返回默认值，文本不变
+"""
+import re
+from typing import Dict, List, Mapping, Optional, Tuple
+
+_HASH_KEY = re.compile(r"^(#+)([^#]+)\1$")
+_HASH_RUN = re.compile(r"#+")
+
+
+class KeywordMatcher:
+    def __init__(self, mapping: Mapping[str, str]):
+        self._names: Dict[str, str] = {}     # "#名字#" 中的名字 -> 原始键
+        literals: List[str] = []
+        for key in mapping:
+            m = _HASH_KEY.match(key)
+            if m and m.group(2).strip():
+                self._names.setdefault(m.group(2).strip(), key)
+            else:
+                literals.append(key)
+        self._mapping = dict(mapping)
+        # 零宽前瞻：每个位置都尝试匹配（最长的键优先），重叠的候选由 find() 取舍
+        self._literals: Optional[re.Pattern] = None
+        if literals:
+            alternatives = "|".join(re.escape(k) for k in sorted(literals, key=len, reverse=True))
+            self._literals = re.compile("(?=(" + alternatives + "))")
+
+    def _hash_spans(self, text: str) -> List[Tuple[int, int, int, str]]:
+        """
+        "#名字#" 形式的候选 [(最早起点, 左侧 "#" 段的终点, 右侧 "#" 段的起点, 映射键)]，按位置排序。
+        起点落在某段 "#" 内时，左侧取从起点到该段末尾的 m 个 "#"，名字为到下一段 "#" 之间的文字（不含换行），
+        要求下一段至少有 m 个 "#"；因此同一对相邻段只需查一次名字，可行的起点是一个连续区间。
+        """
+        spans = []
+        runs = [m.span() for m in _HASH_RUN.finditer(text)]
+        for (s1, e1), (s2, e2) in zip(runs, runs[1:]):
+            name = text[e1:s2]
+            if "\n" in name:
+                continue
+            key = self._names.get(name.strip())
+            if key is not None:
+                spans.append((max(s1, e1 - (e2 - s2)), e1, s2, key))
+        return spans
+
+    def find(self, text: str) -> List[Tuple[int, int, str]]:
+        """返回文本中互不重叠的切换指令 [(起点, 终点, 映射键)]，按位置排序；同一位置字面量键优先。"""
+        literals = []
+        if self._literals is not None:
+            literals = [(m.start(), m.start() + len(m.group(1)), m.group(1)) for m in self._literals.finditer(text)]
+        spans = self._hash_spans(text) if self._names else []
+
+        found: List[Tuple[int, int, str]] = []
+        last_end = 0
+        li = hi = 0
+        while True:
+            while li < len(literals) and literals[li][0] < last_end:
+                li += 1
+            while hi < len(spans) and spans[hi][1] <= last_end:
+                hi += 1
+            hash_start = max(spans[hi][0], last_end) if hi < len(spans) else None
+            if li < len(literals) and (hash_start is None or literals[li][0] <= hash_start):
+                match = literals[li]
+            elif hash_start is not None:
+                _, open_end, close, key = spans[hi]
+                # 右侧取与左侧相同数量的 "#"
+                match = (hash_start, close + open_end - hash_start, key)
+            else:
+                break
+            found.append(match)
+            last_end = match[1]
+        return found
+
+    def pick(self, text: str, default: str) -> Tuple[str, str, Optional[str]]:
+        """返回 (底图, 移除指令后的文本, 命中的映射键)；没有指令时为 (default, text, None)。"""
+        found = self.find(text)
+        if not found:
+            return default, text, None
+        parts = []
+        pos = 0
+        for start, end, _ in found:
+            parts.append(text[pos:start])
+            pos = end
+        parts.append(text[pos:])
+        key = found[0][2]
+        return self._mapping[key], "".join(parts).strip(), key
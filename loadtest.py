@@ -0,0 +1,291 @@
+# filename: loadtest.py
+"""
+api.py 的 HTTP 压测：按并发级别扫描，找出吞吐量不再增长、尾延迟开始飙升的拐点。
+
+三种目标：
+- inproc（默认）：在本进程内通过 ASGI 直接调用 api.app（含 lifespan 预热），无需网络与端口
+- uvicorn：在本机启动 `uvicorn api:app` 子进程（--server-workers > 1 时改用 server.py 多进程）
+- --url：压测已经在运行的服务
+
+请求组合（--mix，名称=权重，逗号分隔）：
+- text-hot / text-cold：固定的几句文本（命中结果缓存）/ 每次不同的文本（必须渲染）
+- image-hot / image-cold：固定的贴入图片 / 每次改动一个像素的图片
+--bases 时文本请求轮流使用 config.BASEIMAGE_MAPPING 中的各个底图。
+
+每个并发级别为闭环压测：N 个并发客户端各自连续发请求，持续 --duration 秒。
+输出每级的吞吐量、p50 / p95 / p99 延迟、错误率与状态码分布（JSON），并给出拐点。
+
+用法：
+  python loadtest.py --levels 1,2,4,8,16,32 --duration 10 --mix text-hot=3,text-cold=1,image-cold=1
+  python loadtest.py --target uvicorn --server-workers 4 --output load.json
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+try:
+    import httpx
+except Exception:
+    httpx = None
+
+from config import BASEIMAGE_MAPPING
+
+HOT_TEXTS = [
+    "你好",
+    "今天也要加油【安安】",
+    "The quick brown fox jumps over the lazy dog.",
+    "【重点】别忘了带伞",
+    "第一行\n第二行\n第三行",
+    "哈哈哈哈哈哈哈哈哈哈哈哈",
+    "See you tomorrow!",
+    "我在画画，不要打扰我",
+]
+
+
+def _png_bytes(seed: int, size: Tuple[int, int] = (320, 240)) -> bytes:
+    """确定性的合成图片；seed 不同时有一个像素不同（结果缓存键随之不同）。"""
+    img = Image.merge("RGB", (
+        Image.linear_gradient("L").resize(size),
+        Image.radial_gradient("L").resize(size),
+        Image.linear_gradient("L").rotate(90).resize(size),
+    ))
+    img.putpixel((seed % size[0], (seed // size[0]) % size[1]), (seed % 256, 0, 255))
+    buf = BytesIO()
+    img.save(buf, "PNG", compress_level=1)
+    return buf.getvalue()
+
+
+class RequestMix:
+    """按权重生成请求体（JSON，发往 /generate）。"""
+
+    KINDS = ("text-hot", "text-cold", "image-hot", "image-cold")
+
+    def __init__(self, weights: Dict[str, float], use_bases: bool, seed: int = 0):
+        unknown = set(weights) - set(self.KINDS)
+        if unknown:
+            raise ValueError(f"未知的请求类型: {', '.join(sorted(unknown))}（可选: {', '.join(self.KINDS)}）")
+        self.kinds = [k for k in weights if weights[k] > 0]
+        self.weights = [weights[k] for k in self.kinds]
+        self.bases = list(BASEIMAGE_MAPPING) if use_bases else [None]
+        self._rng = random.Random(seed)
+        self._counter = itertools.count()
+        # 每次运行使用不同的前缀，保证 cold 请求不会命中上一次运行留下的磁盘缓存
+        self._run_id = f"{os.getpid()}-{int(time.time())}"
+        self._hot_image = base64.b64encode(_png_bytes(0)).decode()
+
+    def next(self) -> Tuple[str, dict]:
+        kind = self._rng.choices(self.kinds, self.weights)[0]
+        n = next(self._counter)
+        body: dict = {"base_key": self.bases[n % len(self.bases)]}
+        if kind == "text-hot":
+            body["text"] = HOT_TEXTS[n % len(HOT_TEXTS)]
+        elif kind == "text-cold":
+            body["text"] = f"压测 {self._run_id} 第 {n} 条【{n % 97}】"
+        elif kind == "image-hot":
+            body["image_base64"] = self._hot_image
+        else:
+            body["image_base64"] = base64.b64encode(_png_bytes(n + 1)).decode()
+        return kind, body
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_level(client, mix: RequestMix, concurrency: int, duration: float) -> dict:
+    """以给定并发数闭环压测 duration 秒。"""
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    by_kind: Dict[str, List[float]] = {}
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            kind, body = mix.next()
+            start = time.perf_counter()
+            try:
+                resp = await client.post("/generate", json=body)
+                status = str(resp.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - start
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == "200":
+                latencies.append(elapsed)
+                by_kind.setdefault(kind, []).append(elapsed)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+
+    total = sum(statuses.values())
+    ok = statuses.get("200", 0)
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "throughput_rps": round(ok / wall, 2),
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+        "error_rate": round((total - ok) / total, 4) if total else 0.0,
+        "statuses": statuses,
+        "p50_ms_by_kind": {k: round(_percentile(v, 0.50) * 1000, 2) for k, v in sorted(by_kind.items())},
+    }
+
+
+def find_knee(levels: List[dict], min_gain: float = 0.10) -> Optional[int]:
+    """拐点：再提高并发后吞吐量增幅不足 min_gain（或出现错误）之前的最后一个并发级别。"""
+    for prev, cur in zip(levels, levels[1:]):
+        if prev["throughput_rps"] <= 0:
+            return prev["concurrency"]
+        gain = cur["throughput_rps"] / prev["throughput_rps"] - 1
+        if gain < min_gain or cur["error_rate"] > 0:
+            return prev["concurrency"]
+    return levels[-1]["concurrency"] if levels else None
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_server(workers: int, port: int) -> subprocess.Popen:
+    here = os.path.dirname(os.path.abspath(__file__))
+    if workers > 1:
+        argv = [sys.executable, os.path.join(here, "server.py"), "--host", "127.0.0.1", "--port", str(port),
+                "--workers", str(workers), "--log-level", "warning"]
+    else:
+        argv = [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(port),
+                "--log-level", "warning"]
+    return subprocess.Popen(argv, cwd=here)
+
+
+async def _wait_until_up(client, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get("/")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError("服务未在规定时间内启动")
+        await asyncio.sleep(0.2)
+
+
+async def sweep(args) -> dict:
+    weights = {}
+    for part in args.mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    levels = [int(x) for x in args.levels.split(",")]
+    mix = RequestMix(weights, args.bases, seed=args.seed)
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+
+    server = None
+    lifespan = None
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=timeout, limits=limits)
+    elif args.target == "uvicorn":
+        port = args.port or _free_port()
+        server = _start_server(args.server_workers, port)
+        client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=timeout, limits=limits)
+    else:
+        import api
+
+        lifespan = api.lifespan(api.app)
+        await lifespan.__aenter__()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://inproc",
+                                   timeout=timeout)
+
+    results = []
+    try:
+        await _wait_until_up(client)
+        if args.warmup:
+            await run_level(client, mix, 1, args.warmup)
+        for concurrency in levels:
+            level = await run_level(client, mix, concurrency, args.duration)
+            results.append(level)
+            print(
+                f"c={concurrency:<4d} {level['throughput_rps']:>8.1f} req/s  p50 {level['p50_ms']:>8.1f} ms  "
+                f"p95 {level['p95_ms']:>8.1f} ms  p99 {level['p99_ms']:>8.1f} ms  err {level['error_rate']:.2%}",
+                file=sys.stderr,
+            )
+        stats = None
+        try:
+            stats = (await client.get("/stats")).json()
+        except Exception:
+            pass
+    finally:
+        await client.aclose()
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    return {
+        "target": args.url or args.target,
+        "server_workers": args.server_workers if args.target == "uvicorn" and not args.url else None,
+        "mix": weights,
+        "bases": args.bases,
+        "duration_s": args.duration,
+        "levels": results,
+        "knee_concurrency": find_knee(results),
+        "server_stats": stats,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="api.py 并发压测")
+    parser.add_argument("--target", choices=["inproc", "uvicorn"], default="inproc")
+    parser.add_argument("--url", help="压测已运行的服务，如 http://127.0.0.1:8000")
+    parser.add_argument("--port", type=int, default=None, help="--target uvicorn 时使用的端口（默认随机）")
+    parser.add_argument("--server-workers", type=int, default=1, help="--target uvicorn 时的进程数，>1 时使用 server.py")
+    parser.add_argument("--levels", default="1,2,4,8,16,32", help="并发级别，逗号分隔")
+    parser.add_argument("--duration", type=float, default=10.0, help="每个并发级别的持续秒数")
+    parser.add_argument("--warmup", type=float, default=2.0, help="正式开始前以并发 1 预热的秒数")
+    parser.add_argument("--mix", default="text-hot=1,text-cold=1", help="请求组合，如 text-hot=3,image-cold=1")
+    parser.add_argument("--bases", action="store_true", help="文本请求轮流使用各个底图")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="结果 JSON 写入该文件（默认输出到标准输出）")
+    args = parser.parse_args(argv)
+
+    if httpx is None:
+        print("需要 httpx：pip install httpx", file=sys.stderr)
+        return 2
+
+    report = asyncio.run(sweep(args))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    print(f"拐点并发数: {report['knee_concurrency']}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,10 +9,14 @@ import win32gui
 import win32process
 import psutil
 from typing import Optional, Tuple
-from config import DELAY, FONT_FILE,BASEIMAGE_MAPPING,BASEIMAGE_FILE, AUTO_SEND_IMAGE, AUTO_PASTE_IMAGE, BLOCK_HOTKEY, HOTKEY, SEND_HOTKEY,PASTE_HOTKEY,CUT_HOTKEY,SELECT_ALL_HOTKEY,TEXT_BOX_TOPLEFT,IMAGE_BOX_BOTTOMRIGHT,BASE_OVERLAY_FILE,USE_BASE_OVERLAY, ALLOWED_PROCESSES
+from config import DELAY, FONT_FILE,BASEIMAGE_MAPPING,BASEIMAGE_FILE, AUTO_SEND_IMAGE, AUTO_PASTE_IMAGE, BLOCK_HOTKEY, HOTKEY, SEND_HOTKEY,PASTE_HOTKEY,CUT_HOTKEY,SELECT_ALL_HOTKEY,TEXT_BOX_TOPLEFT,IMAGE_BOX_BOTTOMRIGHT,BASE_OVERLAY_FILE,USE_BASE_OVERLAY, ALLOWED_PROCESSES, ASSET_CACHE_MAX_BYTES, OUTPUT_ENCODER, FIT_QUALITY, FIT_CACHE_MAX_BYTES
+
+from asset_cache import warm_up_assets
+from encoders import EncodedImage, is_lossless
 
 from text_fit_draw import draw_text_auto
-from image_fit_paste import paste_image_auto
+from image_fit_paste import FIT_CACHE, paste_image_auto
+from keyword_matcher import KeywordMatcher
 current_image_file = BASEIMAGE_FILE
 
 def get_foreground_window_process_name():
@@ -28,9 +32,12 @@ def get_foreground_window_process_name():
         print(f"无法获取当前进程名称: {e}")
         return None
 
-def copy_png_bytes_to_clipboard(png_bytes: bytes):
-    # 打开 PNG 字节为 Image
-    image = Image.open(io.BytesIO(png_bytes))
+def copy_image_to_clipboard(result: EncodedImage):
+    # raw 预设直接引用 RGBA 像素；其他预设需要先解码
+    if result.encoder == "raw":
+        image = Image.frombuffer("RGBA", (result.width, result.height), result.data, "raw", "RGBA", 0, 1)
+    else:
+        image = Image.open(io.BytesIO(result.data))
     # 转换成 BMP 字节流（去掉 BMP 文件头的前 14 个字节）
     with io.BytesIO() as output:
         image.convert("RGB").save(output, "BMP")
@@ -64,9 +71,9 @@ def cut_all_and_get_text() -> Tuple[str, object]:
 
     return new_clip, old_clip
 
-def try_get_image() -> Optional[Image.Image]:
+def try_get_image() -> Optional[bytes]:
     """
-    尝试从剪贴板获取图像，如果没有图像则返回 None。
+    尝试从剪贴板获取图像，返回 BMP 文件字节（尚未解码），如果没有图像则返回 None。
     仅支持 Windows。
     """
     try:
@@ -79,8 +86,7 @@ def try_get_image() -> Optional[Image.Image]:
                 # DIB 格式缺少 BMP 文件头，需要手动加上
                 # BMP 文件头是 14 字节，包含 "BM" 标识和文件大小信息
                 header = b'BM' + (len(bmp_data) + 14).to_bytes(4, 'little') + b'\x00\x00\x00\x00\x36\x00\x00\x00'
-                image = Image.open(io.BytesIO(header + bmp_data))
-                return image
+                return header + bmp_data
     except Exception as e:
         print("无法从剪贴板获取图像：", e)
     finally:
@@ -90,6 +96,9 @@ def try_get_image() -> Optional[Image.Image]:
             pass
     return None
 
+# 底图切换关键词，规则见 keyword_matcher.py
+BASE_MATCHER = KeywordMatcher(BASEIMAGE_MAPPING)
+
 def Start():
     global  current_image_file#保存上次使用差分
     # 检查是否设置了允许的进程列表，如果设置了，则检查当前进程是否在允许列表中
@@ -111,13 +120,14 @@ def Start():
         print("no text or image")
         return
     
-    png_bytes=None
+    result=None
 
     if image is not None:
         print("Get image")
 
+        # 传入未解码的字节：paste_image_auto 对字节取摘要，同一张图片反复贴入时命中缩放缓存，跳过解码与缩放
         try:
-            png_bytes = paste_image_auto(
+            result = paste_image_auto(
                 image_source=current_image_file,
                 image_overlay= BASE_OVERLAY_FILE if USE_BASE_OVERLAY else None,
                 top_left=TEXT_BOX_TOPLEFT,
@@ -128,6 +138,9 @@ def Start():
                 padding=12,
                 allow_upscale=True, 
                 keep_alpha=True,      # 使用内容图 alpha 作为蒙版
+                encoder=OUTPUT_ENCODER,
+                encoded=True,
+                fit_quality=FIT_QUALITY,
                 )
         except Exception as e:
             print("Generate image failed:", e)
@@ -137,14 +150,12 @@ def Start():
         print("Get text: "+text)
         
      # 查找发送内容是否包含更换差分指令#差分名#，如果有则更换差分并移除关键字
-        for keyword, img_file in BASEIMAGE_MAPPING.items():
-            if keyword in text:
-                current_image_file = img_file
-                text = text.replace(keyword, "").strip()
-                print(f"检测到关键词 '{keyword}'，使用底图: {current_image_file}")
-                break
+        img_file, text, keyword = BASE_MATCHER.pick(text, current_image_file)
+        if keyword is not None:
+            current_image_file = img_file
+            print(f"检测到关键词 '{keyword}'，使用底图: {current_image_file}")
         try:
-            png_bytes = draw_text_auto(
+            result = draw_text_auto(
                 image_source=current_image_file,
                 image_overlay= BASE_OVERLAY_FILE if USE_BASE_OVERLAY else None,
                 top_left=TEXT_BOX_TOPLEFT,
@@ -153,16 +164,18 @@ def Start():
                 color=(0, 0, 0),
                 max_font_height=64,        # 例如限制最大字号高度为 64 像素
                 font_path=FONT_FILE,
+                encoder=OUTPUT_ENCODER,
+                encoded=True,
                 )
         except Exception as e:
             print("Generate image failed:", e)
             return
         
-    if png_bytes is None:
+    if result is None:
         print("Generate image failed!")
         return
     
-    copy_png_bytes_to_clipboard(png_bytes)
+    copy_image_to_clipboard(result)
     
     if AUTO_PASTE_IMAGE:
         keyboard.send(PASTE_HOTKEY)
@@ -180,6 +193,14 @@ def Start():
 
     
 
+# 剪贴板中是位图，有损编码会改变画面
+if not is_lossless(OUTPUT_ENCODER):
+    raise SystemExit(f"OUTPUT_ENCODER 不能使用有损预设 {OUTPUT_ENCODER!r}，请改用 raw / png / fast / small / webp")
+
+# 预先解码底图与置顶图层，避免第一次按下热键时卡顿
+warm_up_assets([BASEIMAGE_FILE, *BASEIMAGE_MAPPING.values(), BASE_OVERLAY_FILE], max_bytes=ASSET_CACHE_MAX_BYTES)
+FIT_CACHE.resize(FIT_CACHE_MAX_BYTES)
+
 # 绑定 Ctrl+Alt+H 作为全局热键
 ok=keyboard.add_hotkey(HOTKEY, Start, suppress=BLOCK_HOTKEY or HOTKEY==SEND_HOTKEY)
 
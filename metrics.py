@@ -0,0 +1,197 @@
+# filename: metrics.py
+"""
+渲染热路径的计时与计数（Prometheus 文本格式输出）。
+
+draw_text_auto / paste_image_auto 内部按阶段计时：
+- base: 取底图（含解码缓存的检查）      - layout: 排版与字号搜索
+- bounds: 局部合成时计算文字外接框
+- resize: 贴入图片的解码与缩放           - decode: 其中贴入图片的解码部分
+- draw: 在瓦片 / 整图上绘制              - overlay: 叠加置顶图层
+- composite: 瓦片贴回合成底图            - encode: 编码输出
+- base64: API 返回前的 base64 编码
+另记录字号搜索的真实排版次数、文本长度、贴入图片像素数与输出字节数。
+
+默认关闭：关闭时 stage() 返回一个共享的空上下文管理器，每个阶段只多一次函数调用与一次全局变量读取。
+用 enable() 打开（API 按 config.METRICS_ENABLED 打开），render_prometheus() 输出全部指标。
+"""
+import bisect
+import functools
+import math
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+_enabled = False
+
+
+def enable(flag: bool = True) -> None:
+    global _enabled
+    _enabled = bool(flag)
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Sequence[float], labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        # 标签值 -> [各桶计数（不累计）..., +Inf 桶, 总和]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[i] += 1
+            row[-1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, row in items:
+            cumulative = 0
+            for bound, n in zip((*self.buckets, math.inf), row[:-1]):
+                cumulative += n
+                le = 'le="%s"' % _fmt(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_fmt(row[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+_SECONDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+STAGE_SECONDS = Histogram(
+    "sketchbook_render_stage_seconds", "Time spent in each render stage.", _SECONDS, ("function", "stage")
+)
+RENDER_SECONDS = Histogram(
+    "sketchbook_render_seconds", "Total time of draw_text_auto / paste_image_auto.", _SECONDS, ("function",)
+)
+FONT_SEARCH_LAYOUTS = Histogram(
+    "sketchbook_font_search_layouts", "Exact layouts performed by one font size search (layout cache misses only).",
+    (1, 2, 3, 4, 6, 8, 12, 16),
+)
+TEXT_CHARS = Histogram("sketchbook_text_chars", "Length of rendered text in characters.", (4, 16, 64, 256, 1024, 4096))
+IMAGE_PIXELS = Histogram(
+    "sketchbook_content_image_pixels", "Pixel count of pasted content images before resizing.",
+    (1e4, 1e5, 1e6, 4e6, 16e6, 64e6),
+)
+OUTPUT_BYTES = Histogram(
+    "sketchbook_output_bytes", "Size of encoded output images.", (16e3, 64e3, 256e3, 512e3, 1e6, 4e6), ("encoder",)
+)
+
+REGISTRY = [STAGE_SECONDS, RENDER_SECONDS, FONT_SEARCH_LAYOUTS, TEXT_CHARS, IMAGE_PIXELS, OUTPUT_BYTES]
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ("function", "name", "start")
+
+    def __init__(self, function: str, name: str):
+        self.function = function
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        if self.name is None:
+            RENDER_SECONDS.observe(elapsed, self.function)
+        else:
+            STAGE_SECONDS.observe(elapsed, self.function, self.name)
+        return False
+
+
+def stage(function: str, name: str):
+    """对一个阶段计时：with stage("draw_text_auto", "encode"): ...；关闭时开销可忽略。"""
+    return _Stage(function, name) if _enabled else _NULL_STAGE
+
+
+def timed(function: str):
+    """装饰器：对整个函数调用计时（记入 sketchbook_render_seconds）。"""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Stage(function, None):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def observe(histogram: Histogram, value: float, *labels: str) -> None:
+    """仅在打开时记录一次观测值。"""
+    if _enabled:
+        histogram.observe(value, *labels)
+
+
+def gauge_lines(name: str, help: str, samples: Iterable[Tuple[Dict[str, str], float]], kind: str = "gauge") -> List[str]:
+    """把外部统计（缓存命中数、队列深度等）格式化为 Prometheus 文本；samples 为 (标签, 值) 序列。"""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        if value is None:
+            continue
+        lines.append(f"{name}{_labels(list(labels), list(labels.values()))} {_fmt(value)}")
+    return lines
+
+
+def render_prometheus(extra: Optional[Iterable[str]] = None) -> str:
+    """输出全部已注册指标（及调用方提供的额外行）的 Prometheus 文本格式。"""
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    if extra:
+        lines += list(extra)
+    return "\n".join(lines) + "\n"
+
+
+def reset() -> None:
+    for metric in REGISTRY:
+        metric.clear()
@@ -0,0 +1,187 @@
+# filename: packs.py
+"""
+角色包：多个角色 × 多个差分表情时，每个角色一个目录，目录下的 pack.json 列出底图、置顶图层与文字区域：
+
+    {
+      "name": "anan",
+      "bases": {"#普通#": "base.png", "#开心#": "开心.png"},
+      "default": "#普通#",
+      "overlay": "base_overlay.png",
+      "text_box": [[119, 450], [398, 625]],
+      "pin": ["#普通#"]
+    }
+
+- 路径相对于 pack.json 所在目录；overlay、pin 可省略，default 省略时取 bases 的第一项，
+  text_box 省略时使用 config 中的文字区域
+- 加载包只读取清单，不解码任何图片；底图在第一次使用时解码，放入 asset_cache 按字节预算淘汰的缓存
+  （config.ASSET_CACHE_MAX_BYTES），pin 中的底图在预热时解码并常驻，不会被淘汰
+- stats() 按包给出已解码的文件数、占用字节、解码次数与被淘汰次数
+- config 中的 BASEIMAGE_MAPPING 等配置构成默认包 "default"，原有用法不变
+"""
+import glob
+import json
+import os
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+from asset_cache import ASSET_REGISTRY, AssetRegistry
+from keyword_matcher import KeywordMatcher
+
+Box = Tuple[Tuple[int, int], Tuple[int, int]]
+
+MANIFEST_NAME = "pack.json"
+DEFAULT_PACK = "default"
+
+
+class PackError(ValueError):
+    """角色包清单无效。"""
+
+
+class Pack:
+    def __init__(
+        self,
+        name: str,
+        bases: Mapping[str, str],
+        default: str,
+        overlay: Optional[str],
+        text_box: Box,
+        pin: Sequence[str] = (),
+    ):
+        if not bases:
+            raise PackError(f"角色包 {name} 没有底图")
+        self.name = name
+        self.bases = dict(bases)            # 切换关键词 -> 底图路径
+        self.default = default              # 默认底图路径
+        self.overlay = overlay
+        self.text_box = text_box
+        self.pinned = list(dict.fromkeys(pin))
+        self.matcher = KeywordMatcher(self.bases)
+
+    def pick(self, text: str, base_key: Optional[str] = None) -> Tuple[str, str]:
+        """选择底图，返回 (底图路径, 去掉切换关键词后的文本)；base_key 为本包的关键词时直接使用。"""
+        if base_key and base_key in self.bases:
+            return self.bases[base_key], text
+        base_file, text, _ = self.matcher.pick(text, self.default)
+        return base_file, text
+
+    def files(self) -> List[str]:
+        """本包引用的全部图片文件（底图与图层）。"""
+        files = [self.default, *self.bases.values()]
+        if self.overlay:
+            files.append(self.overlay)
+        return list(dict.fromkeys(files))
+
+
+def _box(value, name: str) -> Box:
+    try:
+        (x1, y1), (x2, y2) = value
+        box = ((int(x1), int(y1)), (int(x2), int(y2)))
+    except (TypeError, ValueError) as e:
+        raise PackError(f"角色包 {name} 的 text_box 应为 [[x1, y1], [x2, y2]]") from e
+    if not (box[1][0] > box[0][0] and box[1][1] > box[0][1]):
+        raise PackError(f"角色包 {name} 的 text_box 无效: {value}")
+    return box
+
+
+def load_pack(path: str, default_box: Box) -> Pack:
+    """读取一个角色包清单（pack.json 或其所在目录），只解析清单，不打开图片。"""
+    if os.path.isdir(path):
+        path = os.path.join(path, MANIFEST_NAME)
+    root = os.path.dirname(os.path.abspath(path))
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise PackError(f"无法读取角色包清单 {path}: {e}") from e
+
+    name = str(manifest.get("name") or os.path.basename(root))
+    raw_bases = manifest.get("bases")
+    if not isinstance(raw_bases, dict) or not raw_bases:
+        raise PackError(f"角色包 {name} 的 bases 应为非空的 {{关键词: 文件}} 映射")
+    bases = {str(k): os.path.join(root, str(v)) for k, v in raw_bases.items()}
+
+    default = manifest.get("default", next(iter(raw_bases)))
+    if default in bases:
+        default_file = bases[default]
+    else:
+        default_file = os.path.join(root, str(default))
+
+    overlay = manifest.get("overlay")
+    pin = manifest.get("pin", [])
+    unknown = [k for k in pin if k not in bases]
+    if unknown:
+        raise PackError(f"角色包 {name} 的 pin 中有未知关键词: {', '.join(unknown)}")
+
+    return Pack(
+        name=name,
+        bases=bases,
+        default=default_file,
+        overlay=os.path.join(root, str(overlay)) if overlay else None,
+        text_box=_box(manifest["text_box"], name) if "text_box" in manifest else default_box,
+        pin=[bases[k] for k in pin],
+    )
+
+
+class PackRegistry:
+    """已加载的角色包；底图的解码与淘汰交给 AssetRegistry。"""
+
+    def __init__(self, assets: AssetRegistry = ASSET_REGISTRY):
+        self._assets = assets
+        self._packs: Dict[str, Pack] = {}
+
+    def add(self, pack: Pack) -> None:
+        if pack.name in self._packs:
+            raise PackError(f"角色包重名: {pack.name}")
+        self._packs[pack.name] = pack
+
+    def load_dir(self, packs_dir: str, default_box: Box) -> List[str]:
+        """加载 packs_dir/*/pack.json；返回加载的包名。单个包无效时打印警告并跳过。"""
+        loaded = []
+        for manifest in sorted(glob.glob(os.path.join(packs_dir, "*", MANIFEST_NAME))):
+            try:
+                pack = load_pack(manifest, default_box)
+                self.add(pack)
+            except PackError as e:
+                print(f"Warning: 跳过角色包 {manifest}: {e}")
+                continue
+            loaded.append(pack.name)
+        return loaded
+
+    def get(self, name: Optional[str]) -> Pack:
+        """按名字取包；name 为空时取默认包。不存在时抛出 KeyError。"""
+        return self._packs[name or DEFAULT_PACK]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._packs
+
+    def names(self) -> List[str]:
+        return list(self._packs)
+
+    def warm_up(self) -> Dict[str, bool]:
+        """解码并固定各包 pin 中的底图及其图层；其余底图在第一次使用时再解码。"""
+        result = {}
+        for pack in self._packs.values():
+            if pack.pinned and pack.overlay:
+                result.update(self._assets.pin([pack.overlay]))
+            result.update(self._assets.pin(pack.pinned, pack.overlay))
+        return result
+
+    def stats(self) -> Dict[str, dict]:
+        stats = {}
+        for name, pack in self._packs.items():
+            s = self._assets.usage(pack.files(), pack.overlay)
+            s["files"] = len(pack.files())
+            s["pinned"] = len(pack.pinned)
+            stats[name] = s
+        return stats
+
+
+def default_pack(
+    mapping: Mapping[str, str],
+    default_file: str,
+    overlay_file: Optional[str],
+    text_box: Box,
+    pin_all: bool = True,
+) -> Pack:
+    """由 config 中的 BASEIMAGE_MAPPING 等配置构成的默认包；pin_all 时全部常驻（与原先启动即解码全部底图一致）。"""
+    files = list(dict.fromkeys([default_file, *mapping.values()]))
+    return Pack(DEFAULT_PACK, mapping, default_file, overlay_file, text_box, pin=files if pin_all else ())
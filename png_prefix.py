@@ -0,0 +1,174 @@
+# filename: png_prefix.py
+"""
+复用静态区域压缩结果的 PNG 编码器。
+
+每张输出图的前若干行（文本框 / 图片框上方）都原样来自“底图 + 置顶图层”，
+普通 PNG 编码却每次都要重新过滤、重新 deflate 这些行。这里按
+(底图, 图层, 行数, 压缩等级) 缓存这段静态行的 deflate 数据（以 Z_FULL_FLUSH 结尾，
+之后的数据不会再引用它），每次只过滤并压缩框以下的行，再拼接出完整的 zlib 流：
+
+    zlib 头 | 静态行 deflate（缓存） | 动态行 deflate | adler32
+
+输出是合法的 PNG，解码后的像素与原图完全一致（字节流与 Pillow 的输出不同）。
+行过滤：安装了 NumPy 时按行自适应选择 None/Sub/Up/Average/Paeth，否则统一使用 None。
+"""
+import struct
+import threading
+import zlib
+from typing import Hashable, Optional
+
+from PIL import Image
+
+from byte_lru import ByteLRU
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+BPP = 4  # RGBA8
+
+
+def _chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+
+def _zlib_header(level: int) -> bytes:
+    """生成 deflate / 32K 窗口的 zlib 头，FLEVEL 仅作提示。"""
+    cmf = 0x78
+    flevel = 0 if level < 2 else 1 if level < 6 else 2 if level == 6 else 3
+    flg = flevel << 6
+    flg += 31 - ((cmf << 8) + flg) % 31
+    return bytes((cmf, flg))
+
+
+def filter_rows(raw: bytes, width: int, start: int, stop: int, prev_row: Optional[bytes]) -> bytes:
+    """
+    对 RGBA 像素的第 [start, stop) 行做 PNG 行过滤，返回带过滤类型字节的数据。
+    - raw: 这些行的像素（紧密排列）
+    - prev_row: 第 start-1 行的像素（start 为 0 时为 None）
+    """
+    stride = width * BPP
+    n = stop - start
+    if n <= 0:
+        return b""
+    if np is None:
+        return b"".join(b"\x00" + raw[i * stride:(i + 1) * stride] for i in range(n))
+
+    cur = np.frombuffer(raw, dtype=np.uint8).reshape(n, stride).astype(np.int16)
+    up = np.zeros_like(cur)
+    if n > 1:
+        up[1:] = cur[:-1]
+    if prev_row is not None:
+        up[0] = np.frombuffer(prev_row, dtype=np.uint8)
+    left = np.zeros_like(cur)
+    left[:, BPP:] = cur[:, :-BPP]
+    upleft = np.zeros_like(cur)
+    upleft[:, BPP:] = up[:, :-BPP]
+
+    # Paeth 预测
+    p = left + up - upleft
+    pa = np.abs(p - left)
+    pb = np.abs(p - up)
+    pc = np.abs(p - upleft)
+    paeth = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, upleft))
+
+    candidates = np.stack([
+        cur,
+        cur - left,
+        cur - up,
+        cur - ((left + up) >> 1),
+        cur - paeth,
+    ]).astype(np.uint8)
+    # 常用启发式：每行选“按有符号字节看绝对值之和”最小的过滤方式
+    scores = np.abs(candidates.view(np.int8).astype(np.int32)).sum(axis=2)
+    best = scores.argmin(axis=0)
+    out = np.empty((n, stride + 1), dtype=np.uint8)
+    out[:, 0] = best
+    out[:, 1:] = candidates[best, np.arange(n)]
+    return out.tobytes()
+
+
+class _Prefix:
+    __slots__ = ("source", "rows", "level", "deflated", "adler")
+
+    def __init__(self, source, rows, level, deflated, adler):
+        self.source = source
+        self.rows = rows
+        self.level = level
+        self.deflated = deflated
+        self.adler = adler
+
+
+class PngPrefixEncoder:
+    """
+    - max_bytes: 静态段压缩数据的缓存预算
+    """
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024):
+        self._cache = ByteLRU(max_bytes=max_bytes)
+        self._lock = threading.Lock()
+
+    def _prefix(self, key: Hashable, source: Image.Image, rows: int, level: int) -> _Prefix:
+        cache_key = (key, rows, level)
+        entry: Optional[_Prefix] = self._cache.get(cache_key)
+        if entry is not None and entry.source is source:
+            return entry
+        with self._lock:
+            entry = self._cache.peek(cache_key)
+            if entry is not None and entry.source is source:
+                return entry
+            width = source.size[0]
+            raw = source.crop((0, 0, width, rows)).tobytes()
+            filtered = filter_rows(raw, width, 0, rows, None)
+            comp = zlib.compressobj(level, zlib.DEFLATED, -15)
+            deflated = comp.compress(filtered) + comp.flush(zlib.Z_FULL_FLUSH)
+            entry = _Prefix(source, rows, level, deflated, zlib.adler32(filtered))
+            self._cache.put(cache_key, entry, len(deflated))
+            return entry
+
+    def encode(self, img: Image.Image, key: Hashable, source: Image.Image, rows: int, level: int = 6) -> bytes:
+        """
+        编码 img。调用方保证 img 的前 rows 行与 source 完全相同（均为 RGBA）。
+        key 标识 source 的来源（如底图与图层路径），用于查找缓存的静态段。
+        """
+        if img.mode != "RGBA":
+            raise ValueError("静态段复用要求 RGBA 且宽度一致的图像。")
+        width, height = img.size
+        rows = max(0, min(rows, height))
+        return self.encode_rows(img.size, img.crop((0, rows, width, height)).tobytes(), key, source, rows, level)
+
+    def encode_rows(
+        self, size, raw: bytes, key: Hashable, source: Image.Image, rows: int, level: int = 6
+    ) -> bytes:
+        """
+        与 encode 相同，但只给出第 rows 行及以下的原始 RGBA 像素 raw（前 rows 行即 source 的前 rows 行），
+        调用方无需拼出完整图像。
+        """
+        width, height = size
+        if source.mode != "RGBA" or width != source.size[0] or len(raw) != (height - rows) * width * BPP:
+            raise ValueError("静态段复用要求 RGBA 且宽度一致的图像。")
+
+        if rows > 0:
+            prefix = self._prefix(key, source, rows, level)
+            deflated_prefix, adler = prefix.deflated, prefix.adler
+            prev_row = source.crop((0, rows - 1, width, rows)).tobytes()
+        else:
+            deflated_prefix, adler, prev_row = b"", 1, None
+
+        filtered = filter_rows(raw, width, rows, height, prev_row)
+        comp = zlib.compressobj(level, zlib.DEFLATED, -15)
+        body = comp.compress(filtered) + comp.flush(zlib.Z_FINISH)
+        adler = zlib.adler32(filtered, adler)
+
+        idat = _zlib_header(level) + deflated_prefix + body + struct.pack(">I", adler & 0xFFFFFFFF)
+        ihdr = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+        return PNG_SIGNATURE + _chunk(b"IHDR", ihdr) + _chunk(b"IDAT", idat) + _chunk(b"IEND", b"")
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+# 进程级共享实例
+PNG_PREFIX_ENCODER = PngPrefixEncoder()
@@ -0,0 +1,150 @@
+# filename: render_pool.py
+"""
+渲染线程池 + 有界排队（背压）。
+
+同步的 FastAPI 路由会被放进 Starlette 默认的线程池，数量无上限、也没有排队策略，
+突发请求时所有请求一起抢 CPU，延迟一起飙升。这里用一个固定大小的专用线程池执行渲染：
+- 同时最多 workers 个渲染在跑，另有最多 max_queue 个在排队；
+- 再来的请求立即被拒绝（PoolFullError），由调用方返回 503 + Retry-After；
+- 统计排队深度、排队等待时间与渲染耗时，供 /stats 查看。
+Pillow 的解码 / 缩放 / 压缩大多会释放 GIL，线程池在多核上仍有收益。
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Optional, Tuple
+
+
+class PoolFullError(RuntimeError):
+    """渲染队列已满；retry_after 为建议的重试等待秒数。"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"渲染队列已满，请 {retry_after} 秒后重试。")
+        self.retry_after = retry_after
+
+
+def _percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class RenderPool:
+    """
+    - workers: 渲染线程数；None 表示 CPU 核数
+    - max_queue: 排队上限（不含正在渲染的请求）
+    - window: 统计等待 / 渲染耗时所用的最近样本数
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_queue: int = 32, window: int = 256):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers <= 0:
+            raise ValueError("workers 必须为正数。")
+        if max_queue < 0:
+            raise ValueError("max_queue 不能为负数。")
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.running = 0
+        self.queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._waits: Deque[float] = deque(maxlen=window)
+        self._services: Deque[float] = deque(maxlen=window)
+
+    def _retry_after(self) -> int:
+        """按最近的平均渲染耗时估算排到队首所需的秒数（至少 1 秒）。"""
+        service = sum(self._services) / len(self._services) if self._services else 0.0
+        return max(1, math.ceil(service * (self.queued + 1) / self.workers))
+
+    def _admit(self) -> Tuple[ThreadPoolExecutor, float]:
+        with self._lock:
+            if self.running + self.queued >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise PoolFullError(self._retry_after())
+            self.queued += 1
+            if self._executor is None:
+                # 首次使用或 shutdown() 之后按需（重新）创建线程
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="render")
+            return self._executor, time.perf_counter()
+
+    def _cancel(self) -> None:
+        with self._lock:
+            self.queued -= 1
+
+    def _on_done(self, future: Future) -> None:
+        # 排队中被取消的任务不会执行 _call，由这里归还排队名额
+        if future.cancelled():
+            self._cancel()
+
+    def _submit(self, fn: Callable[..., Any], args, kwargs) -> Future:
+        executor, enqueued = self._admit()
+        try:
+            future = executor.submit(self._call, enqueued, fn, args, kwargs)
+        except BaseException:
+            self._cancel()
+            raise
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _call(self, enqueued: float, fn: Callable[..., Any], args, kwargs) -> Any:
+        start = time.perf_counter()
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self._waits.append(start - enqueued)
+        ok = False
+        try:
+            result = fn(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.running -= 1
+                self._services.append(elapsed)
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """在渲染线程池中执行 fn 并等待结果；队列已满时立即抛出 PoolFullError。取消等待会一并取消尚未开始的任务。"""
+        return await asyncio.wrap_future(self._submit(fn, args, kwargs))
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        """同步代码使用的提交方式，返回 concurrent.futures.Future；队列已满时抛出 PoolFullError。"""
+        return self._submit(fn, args, kwargs)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """停止线程池；之后再提交任务时会重新创建。"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = list(self._waits)
+            services = list(self._services)
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "running": self.running,
+                "queue_depth": self.queued,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "wait_ms_avg": round(sum(waits) / len(waits) * 1000, 3) if waits else 0.0,
+                "wait_ms_p95": round(_percentile(waits, 0.95) * 1000, 3),
+                "wait_ms_max": round(max(waits) * 1000, 3) if waits else 0.0,
+                "render_ms_avg": round(sum(services) / len(services) * 1000, 3) if services else 0.0,
+            }
@@ -0,0 +1,214 @@
+# filename: result_cache.py
+"""
+按内容寻址的生成结果缓存。
+
+相同的输入（文本、底图及其内容、置顶图层、贴入图片的哈希、编码参数、字体与区域配置）
+总是生成完全相同的字节，因此可以用这些输入的哈希作为键缓存输出：
+- 内存层：按字节预算的 LRU
+- 磁盘层（可选）：每个结果一个文件，按字节上限淘汰最久未使用的文件；
+  多个进程可以共用同一目录（各进程的占用统计是近似值）
+键本身同时用作 HTTP 强 ETag：输入相同则输出逐字节相同。
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from byte_lru import ByteLRU
+from encoders import EncodedImage
+
+# 渲染流程改变输出时递增，使旧的缓存条目与 ETag 全部失效
+RENDER_VERSION = 1
+
+
+def render_key(**parts) -> str:
+    """把影响输出的全部输入规范化后取 sha256，作为缓存键。"""
+    blob = json.dumps({"v": RENDER_VERSION, **parts}, sort_keys=True, ensure_ascii=False, default=list)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def file_signature(path: Optional[str]) -> Optional[Tuple[str, int, int]]:
+    """文件的 (绝对路径, 大小, mtime)；用于字体等不经 asset_cache 管理的文件。"""
+    if not path:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return os.path.abspath(path), st.st_size, st.st_mtime_ns
+
+
+class CachedResult:
+    """缓存的生成结果：编码后的图片 + 附加元数据（如使用的底图）。"""
+
+    __slots__ = ("image", "meta")
+
+    def __init__(self, image: EncodedImage, meta: Dict[str, str]):
+        self.image = image
+        self.meta = meta
+
+    def nbytes(self) -> int:
+        return len(self.image.data) + 256
+
+    def dumps(self) -> bytes:
+        header = {
+            "encoder": self.image.encoder,
+            "media_type": self.image.media_type,
+            "width": self.image.width,
+            "height": self.image.height,
+            "meta": self.meta,
+        }
+        return json.dumps(header, ensure_ascii=False).encode("utf-8") + b"\n" + self.image.data
+
+    @classmethod
+    def loads(cls, blob: bytes) -> "CachedResult":
+        head, data = blob.split(b"\n", 1)
+        h = json.loads(head)
+        return cls(EncodedImage(data, h["encoder"], h["media_type"], h["width"], h["height"]), h["meta"])
+
+
+class _DiskTier:
+    def __init__(self, directory: str, max_bytes: int):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # 启动时按修改时间重建索引（旧 -> 新）
+        files = []
+        for name in os.listdir(directory):
+            if name.endswith(".bin"):
+                try:
+                    st = os.stat(os.path.join(directory, name))
+                except OSError:
+                    continue
+                files.append((st.st_mtime_ns, name[:-4], st.st_size))
+        files.sort()
+        self._index: "OrderedDict[str, int]" = OrderedDict((k, size) for _, k, size in files)
+        self.bytes = sum(self._index.values())
+        self._evict()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".bin")
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                blob = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+                size = self._index.pop(key, None)
+                if size is not None:
+                    self.bytes -= size
+            return None
+        with self._lock:
+            self.hits += 1
+            if key not in self._index:
+                # 其他进程写入的文件
+                self._index[key] = len(blob)
+                self.bytes += len(blob)
+            self._index.move_to_end(key)
+        return blob
+
+    def put(self, key: str, blob: bytes) -> None:
+        if len(blob) > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(blob)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Warning: 写入结果缓存失败 {path}: {e}")
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            old = self._index.pop(key, None)
+            if old is not None:
+                self.bytes -= old
+            self._index[key] = len(blob)
+            self.bytes += len(blob)
+            self._evict()
+
+    def _evict(self) -> None:
+        while self.bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._index),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+class ResultCache:
+    """
+    - memory_bytes: 内存层预算；0 表示不启用内存层
+    - disk_dir / disk_bytes: 磁盘层目录与字节上限；disk_dir 为 None 表示不启用磁盘层
+    """
+
+    def __init__(self, memory_bytes: int = 64 * 1024 * 1024, disk_dir: Optional[str] = None,
+                 disk_bytes: int = 512 * 1024 * 1024):
+        self._memory = ByteLRU(max_bytes=memory_bytes) if memory_bytes else None
+        self._disk = _DiskTier(disk_dir, disk_bytes) if disk_dir else None
+
+    def get_memory(self, key: str) -> Optional[CachedResult]:
+        """只查内存层（不做磁盘 IO，可在事件循环中调用）。"""
+        return self._memory.get(key) if self._memory is not None else None
+
+    def get_disk(self, key: str) -> Optional[CachedResult]:
+        """只查磁盘层；命中的结果会提升到内存层。"""
+        if self._disk is None:
+            return None
+        blob = self._disk.get(key)
+        if blob is None:
+            return None
+        try:
+            result = CachedResult.loads(blob)
+        except (ValueError, KeyError) as e:
+            print(f"Warning: 结果缓存文件损坏 {key}: {e}")
+            return None
+        if self._memory is not None:
+            self._memory.put(key, result, result.nbytes())
+        return result
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        """依次查内存层与磁盘层。"""
+        result = self.get_memory(key)
+        return result if result is not None else self.get_disk(key)
+
+    def put(self, key: str, result: CachedResult) -> None:
+        if self._memory is not None:
+            self._memory.put(key, result, result.nbytes())
+        if self._disk is not None:
+            self._disk.put(key, result.dumps())
+
+    def stats(self) -> dict:
+        return {
+            "memory": self._memory.stats() if self._memory is not None else None,
+            "disk": self._disk.stats() if self._disk is not None else None,
+        }
@@ -0,0 +1,257 @@
+# filename: server.py
+"""
+多进程 API 服务入口（预先 fork，仅限 Linux / macOS 等 POSIX 系统）。
+
+`python api.py` 只有一个进程，渲染受 GIL 限制只能用满一个核。这里由父进程：
+1. 预先加载字体（各字号）、解码全部底图、置顶图层及其合成结果，并导入 api；
+2. 绑定监听端口；
+3. fork 出 N 个 worker，每个 worker 在同一个监听 socket 上运行 uvicorn。
+worker 继承父进程已解码的像素数据（Pillow 的像素缓冲区在 Python 对象之外，
+引用计数不会触碰这些页面），按写时复制共享，N 个进程只占一份底图内存。
+
+信号：
+- SIGHUP：平滑重启。父进程先重新检查底图（文件有变化的会重新解码），
+  再逐个启动新 worker、待其就绪后让旧 worker 处理完手头请求退出
+- SIGTERM / SIGINT：通知所有 worker 优雅退出，超时后强制结束
+worker 意外退出时会自动补齐。修改代码后需要重启整个服务。
+
+用法：python server.py [--workers N] [--threads M] [--host 0.0.0.0] [--port 8000]
+"""
+import argparse
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from config import (
+    FONT_FILE,
+    BASEIMAGE_MAPPING,
+    BASEIMAGE_FILE,
+    BASE_OVERLAY_FILE,
+    USE_BASE_OVERLAY,
+    ASSET_CACHE_MAX_BYTES,
+    RENDER_WORKERS,
+    SERVER_WORKERS,
+)
+from asset_cache import ASSET_REGISTRY, warm_up_assets
+from font_cache import get_font
+from font_metrics import load_font_metrics
+
+# api 默认的最大字号；字号搜索只会用到不超过它的字号
+MAX_FONT_SIZE = 64
+
+
+def preload() -> None:
+    """在父进程中加载所有 worker 共用的资源。"""
+    bases = [BASEIMAGE_FILE, *BASEIMAGE_MAPPING.values()]
+    loaded = warm_up_assets([*bases, BASE_OVERLAY_FILE], max_bytes=ASSET_CACHE_MAX_BYTES)
+    if USE_BASE_OVERLAY and loaded.get(BASE_OVERLAY_FILE):
+        for base in dict.fromkeys(bases):
+            if loaded.get(base):
+                ASSET_REGISTRY.composite(base, BASE_OVERLAY_FILE)
+    load_font_metrics(FONT_FILE)  # 度量表在 fork 前映射，各 worker 共享同一份页面
+    for size in range(1, MAX_FONT_SIZE + 1):
+        get_font(FONT_FILE, size)
+    import api  # 提前导入，worker 直接继承已初始化的模块
+
+    api.PACKS.warm_up()  # 角色包固定的底图同样在 fork 前解码（或从预编译文件映射）
+
+
+class PreforkServer:
+    """
+    - workers: worker 进程数
+    - threads: 每个 worker 的渲染线程数；None 时取 config.RENDER_WORKERS，它也为 None 时
+      按 CPU 核数平分给各 worker（至少 1），避免 workers × 核数 个线程争抢 CPU
+    - graceful_timeout: 等待 worker 优雅退出的秒数，超时后 SIGKILL
+    - ready_timeout: 平滑重启时等待新 worker 就绪的秒数
+    """
+
+    def __init__(self, host: str, port: int, workers: int, threads: Optional[int] = None, log_level: str = "info",
+                 graceful_timeout: float = 30.0, ready_timeout: float = 30.0):
+        if workers <= 0:
+            raise ValueError("workers 必须为正数。")
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.threads = threads or RENDER_WORKERS or max(1, (os.cpu_count() or 1) // workers)
+        self.log_level = log_level
+        self.graceful_timeout = graceful_timeout
+        self.ready_timeout = ready_timeout
+        self.sock: Optional[socket.socket] = None
+        self.children: Dict[int, float] = {}  # pid -> 启动时间
+        self._reload = False
+        self._stop = False
+
+    # ---- worker ----
+
+    def _run_worker(self, ready_fd: int) -> None:
+        """子进程：在继承的 socket 上运行 uvicorn；启动完成后向 ready_fd 写一个字节。"""
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(sig, signal.SIG_DFL)
+        import uvicorn
+        import api
+        from render_pool import RenderPool
+
+        api.RENDER_POOL = RenderPool(workers=self.threads, max_queue=api.RENDER_POOL.max_queue)
+        server = uvicorn.Server(uvicorn.Config(api.app, log_level=self.log_level, lifespan="on"))
+
+        def notify_ready():
+            while not server.started and not server.should_exit:
+                time.sleep(0.05)
+            try:
+                os.write(ready_fd, b"1")
+                os.close(ready_fd)
+            except OSError:
+                pass
+
+        threading.Thread(target=notify_ready, daemon=True).start()
+        server.run(sockets=[self.sock])
+
+    def _spawn(self) -> Tuple[int, int]:
+        """fork 一个 worker，返回 (pid, 就绪通知的读端)。"""
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                os.close(r)
+                self._run_worker(w)
+            except BaseException as e:
+                print(f"worker {os.getpid()} 异常退出: {e}", file=sys.stderr)
+                code = 1
+            finally:
+                os._exit(code)
+        os.close(w)
+        self.children[pid] = time.monotonic()
+        return pid, r
+
+    @staticmethod
+    def _wait_ready(fd: int, timeout: float) -> bool:
+        try:
+            readable, _, _ = select.select([fd], [], [], timeout)
+            return bool(readable) and os.read(fd, 1) == b"1"
+        finally:
+            os.close(fd)
+
+    def _terminate(self, pids, timeout: float) -> None:
+        """向给定 worker 发送 SIGTERM，等待其退出，超时后 SIGKILL。"""
+        pids = [p for p in pids if p in self.children]
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + timeout
+        while pids and time.monotonic() < deadline:
+            self._reap()
+            pids = [p for p in pids if p in self.children]
+            time.sleep(0.05)
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+            self.children.pop(pid, None)
+
+    def _reap(self) -> list:
+        """回收已退出的 worker，返回 [(pid, 存活秒数)]。"""
+        exited = []
+        while self.children:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            started = self.children.pop(pid, None)
+            if started is not None:
+                exited.append((pid, time.monotonic() - started))
+        return exited
+
+    # ---- 父进程 ----
+
+    def _on_signal(self, signum, frame) -> None:
+        if signum == signal.SIGHUP:
+            self._reload = True
+        else:
+            self._stop = True
+
+    def reload(self) -> None:
+        """平滑重启：逐个用新 worker 替换旧 worker。"""
+        print("收到 SIGHUP，重新加载资源并逐个替换 worker")
+        preload()
+        for old in list(self.children):
+            pid, ready = self._spawn()
+            if not self._wait_ready(ready, self.ready_timeout):
+                print(f"Warning: 新 worker {pid} 未在 {self.ready_timeout} 秒内就绪", file=sys.stderr)
+            self._terminate([old], self.graceful_timeout)
+
+    def serve_forever(self) -> None:
+        preload()
+        self.sock = socket.socket(socket.AF_INET6 if ":" in self.host else socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(2048)
+        self.sock.set_inheritable(True)
+
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, self._on_signal)
+        print(f"主进程 {os.getpid()} 监听 {self.host}:{self.port}，启动 {self.workers} 个 worker")
+        for _ in range(self.workers):
+            _, ready = self._spawn()
+            os.close(ready)
+
+        try:
+            while not self._stop:
+                if self._reload:
+                    self._reload = False
+                    self.reload()
+                for pid, lived in self._reap():
+                    if self._stop:
+                        break
+                    print(f"Warning: worker {pid} 已退出，重新启动", file=sys.stderr)
+                    if lived < 1.0:
+                        time.sleep(1.0)  # 启动即崩溃时避免疯狂重启
+                while len(self.children) < self.workers and not self._stop:
+                    _, ready = self._spawn()
+                    os.close(ready)
+                time.sleep(0.2)
+        finally:
+            print("正在停止所有 worker")
+            self._terminate(list(self.children), self.graceful_timeout)
+            self.sock.close()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="安安素描本 API 多进程服务")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS,
+                        help="worker 进程数，默认 config.SERVER_WORKERS（为 None 时取 CPU 核数）")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="每个 worker 的渲染线程数，默认 config.RENDER_WORKERS；"
+                             "其为 None 时取 max(1, CPU 核数 // workers)")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--graceful-timeout", type=float, default=30.0)
+    args = parser.parse_args(argv)
+
+    if not hasattr(os, "fork"):
+        sys.exit("当前系统不支持 fork，请改用 `python api.py` 启动单进程服务。")
+    server = PreforkServer(
+        host=args.host,
+        port=args.port,
+        workers=args.workers or os.cpu_count() or 1,
+        threads=args.threads,
+        log_level=args.log_level,
+        graceful_timeout=args.graceful_timeout,
+    )
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
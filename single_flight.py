@@ -0,0 +1,90 @@
+# filename: single_flight.py
+"""
+相同请求的在途合并（single-flight）。
+
+同一段文字在群里刷屏时，许多客户端会在几毫秒内请求完全相同的图片；
+结果缓存只能挡住"已经生成完"的重复请求，生成期间到达的请求仍会各自渲染一遍。
+这里按请求键合并在途调用：第一个调用者执行渲染，其余相同键的调用者等待同一个结果
+（异常同样共享），完成后键立即释放，之后的请求交给结果缓存处理。
+
+- do(): 同步版本，供多个线程并发调用的同步代码使用
+- do_async(): asyncio 版本，供 API 的事件循环调用；
+  某个等待者被取消（客户端断开）不会取消共享的渲染，其他等待者照常拿到结果
+
+使用范围：API 的单次生成接口（/generate、/generate/upload、/generate/raw）与批量接口共用一个实例，
+键为 result_cache.render_key 计算的完整规范化请求。桌面端 main.py 的热键回调由 keyboard 的监听线程
+逐个执行，安卓端在 UI 线程中逐次生成，都不会出现并发的相同调用，因此不接入；
+命令行或其他入口若会并发渲染，可用 do() 以同样的键接入。
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self._tasks: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0      # 总调用次数
+        self.executed = 0   # 实际执行次数
+        self.coalesced = 0  # 合并到在途调用的次数
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """执行 fn(*args, **kwargs)；若相同 key 的调用正在进行，则等待并返回它的结果。"""
+        with self._lock:
+            self.calls += 1
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._release(key)
+            future.set_exception(e)
+            raise
+        self._release(key)
+        future.set_result(result)
+        return result
+
+    def _release(self, key: Hashable) -> None:
+        with self._lock:
+            self._calls.pop(key, None)
+
+    async def do_async(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """await fn(*args, **kwargs)；若相同 key 的调用正在进行，则等待它的结果。只能在同一个事件循环中使用。"""
+        task = self._tasks.get(key)
+        with self._lock:
+            self.calls += 1
+            if task is None:
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._on_task_done(key, t))
+        return await asyncio.shield(task)
+
+    def _on_task_done(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # 所有等待者都已离开时，避免 "exception was never retrieved" 警告
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls) + len(self._tasks),
+            }
@@ -0,0 +1,188 @@
+# filename: size_solver.py
+"""
+字号求解器：替代 draw_text_auto 中在 1..region_h 上的二分搜索。
+
+字宽与行高随字号近似线性缩放，因此先在参考字号下测一次字宽，
+按比例缩放后在“估算模型”上完成二分（不触发 FreeType），得到预测字号；
+再用真实排版（精确折行 + 测量）确认预测字号可行、且大一号不可行。
+预测准确时只需 2 次真实排版，原二分需要约 log2(region_h) 次。
+字体有预计算度量表（font_metrics.py）时，估算与真实排版都只查表，不加载各字号的字体。
+
+在“可行性随字号单调”（原二分搜索本身的前提）时，结果与原二分完全一致。
+"""
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from text_measure import GlyphAdvanceTable, get_size_table, span_width, wrap_lines, wrap_spans
+
+# 估算字宽时使用的参考字号：越大，hinting 带来的相对误差越小
+REFERENCE_SIZE = 64
+
+
+class SizeSolution(NamedTuple):
+    size: int               # 选定字号
+    lines: List[str]        # 该字号下的折行结果
+    line_h: int             # 行高（含行距）
+    block_h: int            # 文本块总高
+    line_widths: List[int]  # 每行宽度（已取整，与绘制时的对齐计算一致）
+    exact_layouts: int      # 求解过程中真实排版的次数
+    predicted: int          # 模型预测的字号（0 表示模型判定放不下）
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.solves = 0
+        self.exact_layouts = 0
+        self.exact_hits = 0  # 预测字号即为最终结果的次数
+
+    def record(self, solution: SizeSolution) -> None:
+        with self._lock:
+            self.solves += 1
+            self.exact_layouts += solution.exact_layouts
+            if solution.predicted == solution.size:
+                self.exact_hits += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "solves": self.solves,
+                "exact_layouts": self.exact_layouts,
+                "avg_exact_layouts": (self.exact_layouts / self.solves) if self.solves else 0.0,
+                "prediction_hits": self.exact_hits,
+            }
+
+
+_STATS = _Stats()
+
+
+def size_solver_stats() -> Dict[str, float]:
+    """返回进程级统计：求解次数、真实排版总次数与平均值、预测命中次数。"""
+    return _STATS.snapshot()
+
+
+def _line_height(table: GlyphAdvanceTable, line_spacing: float) -> int:
+    ascent, descent = table.getmetrics()
+    return int((ascent + descent) * (1 + line_spacing))
+
+
+class _Model:
+    """参考字号下的字宽与度量，用于线性缩放估算任意字号的排版。"""
+
+    def __init__(self, text: str, font_path: Optional[str], line_spacing: float):
+        table = get_size_table(font_path, REFERENCE_SIZE)
+        self.paras = text.splitlines() or [""]
+        self.prefixes = [table.prefix_widths(p) for p in self.paras]
+        ascent, descent = table.getmetrics()
+        self.metric_h = ascent + descent
+        self.line_spacing = line_spacing
+
+    def fits(self, size: int, region_w: int, region_h: int) -> bool:
+        scale = size / REFERENCE_SIZE
+        line_h = int(self.metric_h * scale * (1 + self.line_spacing))
+        n_lines = 0
+        max_w = 0.0
+        last_empty = False  # 已生成的最后一行是否为空行
+        for para, (cum, kern_at) in zip(self.paras, self.prefixes):
+            cum_s = [c * scale for c in cum]
+            kern_s = [k * scale for k in kern_at]
+            spans = wrap_spans(para, cum_s, kern_s, region_w)
+            if spans is None:
+                # 估算模型无法二分时，直接交给真实排版判断
+                return True
+            for i, j in spans:
+                max_w = max(max_w, span_width(cum_s, kern_s, i, j))
+            if spans:
+                n_lines += len(spans)
+                last_empty = False
+            # 与 wrap_lines 相同：空段落补一个空行，但不会连续补两个
+            if para == "" and (n_lines == 0 or not last_empty):
+                n_lines += 1
+                last_empty = True
+        total_h = max(line_h * max(1, n_lines), 1)
+        return int(max_w) <= region_w and total_h <= region_h
+
+    def predict(self, hi: int, region_w: int, region_h: int) -> int:
+        lo, best = 1, 0
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            if self.fits(mid, region_w, region_h):
+                best, lo = mid, mid + 1
+            else:
+                hi = mid - 1
+        return best
+
+
+def solve_font_size(
+    text: str,
+    font_path: Optional[str],
+    region_w: int,
+    region_h: int,
+    max_font_height: Optional[int] = None,
+    line_spacing: float = 0.15,
+) -> SizeSolution:
+    """
+    求能放进 region_w × region_h 的最大字号，返回与原二分搜索相同的
+    best_size / best_lines / line_h / block_h，并附带真实排版次数。
+    """
+    hi = min(region_h, max_font_height) if max_font_height else region_h
+    layouts: Dict[int, Tuple[bool, List[str], int, int, List[int]]] = {}
+
+    def exact(size: int) -> bool:
+        """真实排版：与原 wrap_lines + measure_block 一致。"""
+        if size not in layouts:
+            table = get_size_table(font_path, size)
+            lines = wrap_lines(text, table, region_w)
+            line_h = _line_height(table, line_spacing)
+            widths = [int(table.width(ln)) for ln in lines]
+            w = max(widths + [0])
+            h = max(line_h * max(1, len(lines)), 1)
+            layouts[size] = (w <= region_w and h <= region_h, lines, line_h, h, widths)
+        return layouts[size][0]
+
+    predicted = 0
+    best = 0
+    if hi >= 1:
+        predicted = _Model(text, font_path, line_spacing).predict(hi, region_w, region_h)
+        # 以预测值为起点双向倍增，夹出“可行 / 不可行”的边界后再二分
+        start = min(max(predicted, 1), hi)
+        if exact(start):
+            ok, step = start, 1
+            bad = hi + 1
+            while ok < hi:
+                probe = min(ok + step, hi)
+                if exact(probe):
+                    ok = probe
+                    step *= 2
+                else:
+                    bad = probe
+                    break
+        else:
+            bad, step = start, 1
+            ok = 0
+            while bad > 1:
+                probe = max(bad - step, 1)
+                if exact(probe):
+                    ok = probe
+                    break
+                bad = probe
+                step *= 2
+        while bad - ok > 1:
+            mid = (ok + bad) // 2
+            if exact(mid):
+                ok = mid
+            else:
+                bad = mid
+        best = ok
+
+    if best == 0:
+        # 连 1 号字都放不下：与原实现一致，按 1 号字折行并忽略溢出
+        table = get_size_table(font_path, 1)
+        lines = wrap_lines(text, table, region_w)
+        widths = [int(table.width(ln)) for ln in lines]
+        solution = SizeSolution(1, lines, 1, 1, widths, len(layouts) + 1, predicted)
+    else:
+        _, lines, line_h, block_h, widths = layouts[best]
+        solution = SizeSolution(best, lines, line_h, block_h, widths, len(layouts), predicted)
+    _STATS.record(solution)
+    return solution
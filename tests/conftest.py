@@ -0,0 +1,41 @@
+# filename: tests/conftest.py
+"""
+测试公共设置：把仓库根目录加入 sys.path，并提供底图与字体路径。
+
+config.py 中的路径使用 Windows 反斜杠，这里直接拼出跨平台的绝对路径；
+仓库不附带 font.ttf，找不到可用字体时依赖字体的测试会被跳过。
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+BASE_IMAGE = os.path.join(ROOT, "BaseImages", "base.png")
+BASE_OVERLAY = os.path.join(ROOT, "BaseImages", "base_overlay.png")
+
+FONT_CANDIDATES = (
+    os.path.join(ROOT, "font.ttf"),
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "C:\\Windows\\Fonts\\msyh.ttc",
+)
+
+
+def find_font():
+    for path in FONT_CANDIDATES:
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+@pytest.fixture(scope="session")
+def font_path():
+    path = find_font()
+    if path is None:
+        pytest.skip("没有可用的 TrueType 字体")
+    return path
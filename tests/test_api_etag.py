@@ -0,0 +1,108 @@
+# filename: tests/test_api_etag.py
+"""
+api：响应的强 ETag 与 If-None-Match → 304（命中时不渲染），JSON 与二进制接口的 ETag 互不通用。
+"""
+import base64
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from conftest import ROOT
+
+
+@pytest.fixture(scope="module")
+def api_module(font_path, tmp_path_factory):
+    pytest.importorskip("fastapi")
+    pytest.importorskip("httpx")
+    import config
+
+    # config.py 中的路径是相对仓库根目录的 Windows 路径：在导入 api 之前换成本地绝对路径
+    def local(path):
+        return os.path.join(ROOT, *path.split("\\"))
+
+    saved = (dict(config.BASEIMAGE_MAPPING), config.BASEIMAGE_FILE, config.BASE_OVERLAY_FILE, config.FONT_FILE)
+    config.BASEIMAGE_MAPPING.update({k: local(v) for k, v in saved[0].items()})
+    config.BASEIMAGE_FILE = local(saved[1])
+    config.BASE_OVERLAY_FILE = local(saved[2])
+    config.FONT_FILE = font_path
+    try:
+        import api
+        from result_cache import ResultCache
+
+        for name in ("BASEIMAGE_FILE", "BASE_OVERLAY_FILE", "FONT_FILE"):
+            setattr(api, name, getattr(config, name))
+        api.RESULT_CACHE = ResultCache(
+            memory_bytes=16 << 20, disk_dir=str(tmp_path_factory.mktemp("results")), disk_bytes=16 << 20
+        )
+        yield api
+    finally:
+        config.BASEIMAGE_MAPPING.clear()
+        config.BASEIMAGE_MAPPING.update(saved[0])
+        config.BASEIMAGE_FILE, config.BASE_OVERLAY_FILE, config.FONT_FILE = saved[1:]
+
+
+@pytest.fixture(scope="module")
+def client(api_module):
+    from fastapi.testclient import TestClient
+
+    with TestClient(api_module.app) as c:
+        yield c
+
+
+def _renders(api_module):
+    return api_module.RENDER_POOL.stats()["completed"]
+
+
+def test_json_etag_and_304(client, api_module):
+    body = {"text": "你好【安安】#开心#"}
+    first = client.post("/generate", json=body)
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert etag.startswith('"') and etag.endswith('.json"')
+
+    rendered = _renders(api_module)
+    for header in (etag, "W/" + etag, f'"other", {etag}'):
+        resp = client.post("/generate", json=body, headers={"If-None-Match": header})
+        assert resp.status_code == 304
+        assert resp.content == b""
+        assert resp.headers["etag"] == etag
+    assert _renders(api_module) == rendered
+
+    again = client.post("/generate", json=body, headers={"If-None-Match": '"other"'})
+    assert again.status_code == 200
+    assert again.json() == first.json()
+    assert again.headers["etag"] == etag
+
+
+def test_etag_depends_on_input(client):
+    a = client.post("/generate", json={"text": "etag a"}).headers["etag"]
+    b = client.post("/generate", json={"text": "etag b"}).headers["etag"]
+    c = client.post("/generate", json={"text": "etag a", "encoder": "fast"}).headers["etag"]
+    assert len({a, b, c}) == 3
+
+
+def test_binary_etag_differs_from_json(client):
+    buf = io.BytesIO()
+    Image.new("RGB", (300, 200), (255, 0, 0)).save(buf, "PNG")
+    raw = buf.getvalue()
+
+    binary = client.post("/generate/raw", content=raw, headers={"Accept": "image/webp"})
+    assert binary.status_code == 200
+    assert binary.headers["content-type"] == "image/webp"
+    etag = binary.headers["etag"]
+
+    resp = client.post("/generate/raw", content=raw, headers={"Accept": "image/webp", "If-None-Match": etag})
+    assert resp.status_code == 304
+    # 同一输入的上传接口返回相同的字节，ETag 通用
+    resp = client.post(
+        "/generate/upload", files={"image": ("a.png", raw)}, data={"encoder": "webp"}, headers={"If-None-Match": etag}
+    )
+    assert resp.status_code == 304
+
+    # JSON 响应的字节不同，二进制接口的 ETag 对它不匹配
+    body = {"image_base64": base64.b64encode(raw).decode(), "encoder": "webp"}
+    resp = client.post("/generate", json=body, headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["etag"] != etag
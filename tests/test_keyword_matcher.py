@@ -0,0 +1,101 @@
+# filename: tests/test_keyword_matcher.py
+"""
+keyword_matcher：切换指令的匹配规则，与逐位置正则实现（改写为线性扫描之前的版本）的等价性，
+以及大段 "#" 输入下的耗时。
+"""
+import random
+import re
+import time
+
+import pytest
+
+from keyword_matcher import KeywordMatcher
+
+MAPPING = {
+    "#开心#": "happy.png",
+    "##怒##": "angry.png",
+    "# 哭 #": "cry.png",
+    "[笑]": "laugh.png",
+    "开#": "literal_hash.png",
+}
+
+
+def _regex_find(mapping, text):
+    """参照实现：每个位置用前瞻正则尝试字面量键与 "#名字#"，与线性扫描的结果应完全相同。"""
+    names, literals = {}, []
+    for key in mapping:
+        m = re.match(r"^(#+)([^#]+)\1$", key)
+        if m and m.group(2).strip():
+            names.setdefault(m.group(2).strip(), key)
+        else:
+            literals.append(key)
+    literal = "(" + "|".join(re.escape(k) for k in sorted(literals, key=len, reverse=True)) + ")" if literals else "(?!)()"
+    regex = re.compile("(?=" + literal + r"|(#+)([^#\n]+)\2)")
+    found, last_end = [], 0
+    for m in regex.finditer(text):
+        start = m.start()
+        if start < last_end:
+            continue
+        if m.group(1):
+            key, end = m.group(1), start + len(m.group(1))
+        else:
+            key = names.get(m.group(3).strip())
+            if key is None:
+                continue
+            end = start + 2 * len(m.group(2)) + len(m.group(3))
+        found.append((start, end, key))
+        last_end = end
+    return found
+
+
+@pytest.fixture
+def matcher():
+    return KeywordMatcher(MAPPING)
+
+
+@pytest.mark.parametrize("text,expected", [
+    ("#开心#你好", ("happy.png", "你好", "#开心#")),
+    ("你好##开心##", ("happy.png", "你好", "#开心#")),
+    ("#怒#你好", ("angry.png", "你好", "##怒##")),
+    ("# 开心 #你好", ("happy.png", "你好", "#开心#")),
+    ("#哭#", ("cry.png", "", "# 哭 #")),
+    ("[笑] 你好", ("laugh.png", "你好", "[笑]")),
+    ("#怒#你#开心#好[笑]", ("angry.png", "你好", "##怒##")),
+    ("#未知# 你好", ("default.png", "#未知# 你好", None)),
+    ("#未知#开心# 你好", ("happy.png", "#未知 你好", "#开心#")),
+    ("##开心# 你好", ("happy.png", "# 你好", "#开心#")),
+    ("#开心## 你好", ("happy.png", "# 你好", "#开心#")),
+    ("#开\n心#", ("default.png", "#开\n心#", None)),
+    ("", ("default.png", "", None)),
+])
+def test_pick(matcher, text, expected):
+    assert matcher.pick(text, "default.png") == expected
+
+
+def test_literal_wins_at_same_position():
+    matcher = KeywordMatcher({"#开心#": "a.png", "#开": "b.png"})
+    assert matcher.find("#开心#") == [(0, 2, "#开")]
+
+
+@pytest.mark.parametrize("mapping", [MAPPING, dict(MAPPING, **{"#": "hash.png"}), {"#开心#": "a", "#哭#": "b"}])
+def test_matches_regex_reference(mapping):
+    matcher = KeywordMatcher(mapping)
+    rng = random.Random(0)
+    pieces = ["#", "#", "开心", "哭", " ", "怒", "[笑]", "x", "\n", "开"]
+    for _ in range(20000):
+        text = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 14)))
+        assert matcher.find(text) == _regex_find(mapping, text), text
+
+
+@pytest.mark.parametrize("text", [
+    "#" * 100000,
+    "#" * 50000 + "开心" + "#" * 50000,
+    "#" * 50000 + "a" * 50000,
+    "#a" * 50000,
+    "##a#" * 25000,
+])
+def test_linear_time(matcher, text):
+    # 逐位置正则在 1 万个连续 "#" 上已需秒级，这里 10 万字符应在毫秒级完成
+    start = time.perf_counter()
+    matcher.find(text)
+    assert time.perf_counter() - start < 1.0
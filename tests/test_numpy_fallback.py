@@ -0,0 +1,53 @@
+# filename: tests/test_numpy_fallback.py
+"""
+未安装 NumPy 时（如安卓包）glyph_atlas 与 png_prefix 走回退路径，输出像素必须与装有 NumPy 时相同。
+NumPy 在模块导入时检测，因此在子进程中屏蔽后渲染，比较像素摘要。
+"""
+import subprocess
+import sys
+
+import pytest
+
+from conftest import BASE_IMAGE, BASE_OVERLAY, ROOT
+
+SCRIPT = r"""
+import hashlib, io, sys
+if sys.argv[1] == "block":
+    sys.modules["numpy"] = None
+sys.path.insert(0, sys.argv[2])
+from PIL import Image
+import glyph_atlas, png_prefix
+from image_fit_paste import paste_image_auto
+from text_fit_draw import draw_text_auto
+assert (glyph_atlas.np is None) == (sys.argv[1] == "block")
+font, base, overlay = sys.argv[3], sys.argv[4], sys.argv[5]
+outputs = [
+    draw_text_auto(base, (119, 450), (398, 625), "你好【安安】 hello [world]", image_overlay=overlay, font_path=font),
+    draw_text_auto(base, (119, 450), (398, 625), "The quick brown fox " * 8, image_overlay=overlay, font_path=font),
+    paste_image_auto(base, (119, 450), (398, 625), Image.new("RGBA", (50, 30), (255, 0, 0, 128)), image_overlay=overlay),
+]
+for data in outputs:
+    print(hashlib.sha1(Image.open(io.BytesIO(data)).convert("RGBA").tobytes()).hexdigest())
+"""
+
+
+def _render(mode, font):
+    out = subprocess.run(
+        [sys.executable, "-c", SCRIPT, mode, ROOT, font, BASE_IMAGE, BASE_OVERLAY],
+        capture_output=True, text=True, cwd=ROOT, check=True,
+    )
+    return out.stdout.split()
+
+
+def test_fallback_pixels_match(font_path):
+    pytest.importorskip("numpy")
+    assert _render("block", font_path) == _render("numpy", font_path)
+
+
+def test_filter_rows_fallback_uses_none_filter(monkeypatch):
+    import png_prefix
+
+    monkeypatch.setattr(png_prefix, "np", None)
+    raw = bytes(range(256)) * 2  # 4 行 × 32 像素
+    filtered = png_prefix.filter_rows(raw, 32, 0, 4, None)
+    assert filtered == b"\x00" + raw[:128] + b"\x00" + raw[128:256] + b"\x00" + raw[256:384] + b"\x00" + raw[384:]
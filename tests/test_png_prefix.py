@@ -0,0 +1,124 @@
+# filename: tests/test_png_prefix.py
+"""
+png_prefix：缓存的静态段 deflate 与动态段拼接后必须是合法的 zlib 流（adler32 按两段合并），
+解码后的像素与原图一致；encoders 中 RegionImage 与 static_band 的各条编码路径同样如此。
+"""
+import io
+import random
+import struct
+import zlib
+
+import pytest
+from PIL import Image
+
+import png_prefix
+from encoders import RegionImage, StaticBand, encode_image
+from png_prefix import PngPrefixEncoder
+
+W, H = 37, 24
+
+
+def _noise(seed, size=(W, H)):
+    rng = random.Random(seed)
+    return Image.frombytes("RGBA", size, bytes(rng.getrandbits(8) for _ in range(size[0] * size[1] * 4)))
+
+
+def _with_bottom(source, rows, seed):
+    """前 rows 行与 source 相同、其余行为另一组噪声的图像。"""
+    img = _noise(seed, source.size)
+    img.paste(source.crop((0, 0, source.size[0], rows)), (0, 0))
+    return img
+
+
+def _pixels(data):
+    with Image.open(io.BytesIO(data)) as im:
+        assert im.mode == "RGBA"
+        return im.tobytes()
+
+
+def _idat(data):
+    pos, out = 8, b""
+    while pos < len(data):
+        (length,) = struct.unpack(">I", data[pos:pos + 4])
+        tag = data[pos + 4:pos + 8]
+        if tag == b"IDAT":
+            out += data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+    return out
+
+
+@pytest.fixture(params=["numpy", "none"])
+def filter_mode(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(png_prefix, "np", None)
+    return request.param
+
+
+@pytest.mark.parametrize("rows", [0, 1, H // 2, H - 1, H])
+@pytest.mark.parametrize("level", [1, 6])
+def test_encode_roundtrip(rows, level, filter_mode):
+    source = _noise(1)
+    img = _with_bottom(source, rows, 2)
+    data = PngPrefixEncoder().encode(img, "key", source, rows, level)
+    # zlib.decompress 会校验拼接后的 adler32
+    raw = zlib.decompress(_idat(data))
+    assert len(raw) == H * (W * 4 + 1)
+    assert _pixels(data) == img.tobytes()
+
+
+def test_prefix_reused_across_bottoms():
+    source = _noise(3)
+    encoder = PngPrefixEncoder()
+    for seed in range(4, 8):
+        img = _with_bottom(source, 10, seed)
+        assert _pixels(encoder.encode(img, "key", source, 10)) == img.tobytes()
+    stats = encoder.stats()
+    assert stats["misses"] == 1 and stats["hits"] == 3
+
+
+def test_prefix_not_reused_for_other_source():
+    """同一 key 换了源图像（如底图文件被替换）时，不能沿用旧源的静态段。"""
+    encoder = PngPrefixEncoder()
+    old, new = _noise(9), _noise(10)
+    encoder.encode(_with_bottom(old, 12, 11), "key", old, 12)
+    img = _with_bottom(new, 12, 12)
+    assert _pixels(encoder.encode(img, "key", new, 12)) == img.tobytes()
+
+
+def test_encode_rows_rejects_mismatch():
+    encoder = PngPrefixEncoder()
+    source = _noise(13)
+    with pytest.raises(ValueError):
+        encoder.encode_rows((W + 1, H), b"\0" * ((W + 1) * 4 * 4), "key", source, H - 4)
+    with pytest.raises(ValueError):
+        encoder.encode_rows((W, H), b"\0" * 3, "key", source, H - 4)
+    with pytest.raises(ValueError):
+        encoder.encode(source.convert("RGB"), "key", source, 4)
+
+
+def _region(top, band_rows):
+    source = _noise(20)
+    band = _noise(21, (W, band_rows))
+    return RegionImage(source, band, top)
+
+
+@pytest.mark.parametrize("top,band_rows", [(0, 5), (8, 6), (H - 3, 3), (H, 0), (4, 0)])
+def test_region_image_tobytes(top, band_rows):
+    region = _region(top, band_rows)
+    full = region.image()
+    for start in range(H + 1):
+        assert region.tobytes(start) == full.crop((0, start, W, H)).tobytes()
+
+
+@pytest.mark.parametrize("encoder", ["png", "fast", "raw", "webp", "small"])
+@pytest.mark.parametrize("rows", [0, 8, 14, H])
+def test_encode_image_static_band(encoder, rows):
+    region = _region(8, 6)
+    band = StaticBand(("test", "region"), region.source, rows)
+    expected = region.image().tobytes()
+    for img in (region, region.image()):
+        out = encode_image(img, encoder, static_band=band if rows <= 8 else None)
+        assert (out.width, out.height) == (W, H)
+        assert (out.data if encoder == "raw" else _pixels(out.data)) == expected
@@ -0,0 +1,105 @@
+# filename: tests/test_regression.py
+"""
+与优化前的实现逐像素对照：tests/reference/ 下是基线提交中原样保留的 text_fit_draw.py 与 image_fit_paste.py，
+局部合成、字形图集、二分换行、缩放缓存等改动的输出解码后必须与其完全相同。
+"""
+import importlib.util
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from conftest import BASE_IMAGE, BASE_OVERLAY
+
+import image_fit_paste
+import text_fit_draw
+
+REFERENCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reference")
+
+
+def _load_reference(name):
+    spec = importlib.util.spec_from_file_location(f"reference_{name}", os.path.join(REFERENCE_DIR, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+ref_text = _load_reference("text_fit_draw")
+ref_image = _load_reference("image_fit_paste")
+
+BOX = ((119, 450), (398, 625))
+
+TEXTS = [
+    "你好【安安】",
+    "hello world this is a test of wrapping",
+    "a" * 300,
+    "中文" * 200,
+    "line1\n\nline3 [bracket\ncontinues] end",
+    "",
+    "【" + "紫" * 50 + "】普通",
+    "The quick brown fox jumps over the lazy dog " * 10,
+    "AVAVAVAV To Ty WA",
+    "x  y   z",
+    " leading",
+    "trailing ",
+    "verylongwordwithoutspaces_and_more stuff here verylongwordwithoutspacesagain",
+    "【未闭合的括号 continues\n下一行] 与 [第二段】 end",
+]
+
+
+def _pixels(data):
+    with Image.open(io.BytesIO(data)) as im:
+        return im.convert("RGBA").tobytes()
+
+
+def _assert_same_text(text, top_left, bottom_right, **kwargs):
+    expected = ref_text.draw_text_auto(BASE_IMAGE, top_left, bottom_right, text, image_overlay=BASE_OVERLAY, **kwargs)
+    actual = text_fit_draw.draw_text_auto(BASE_IMAGE, top_left, bottom_right, text, image_overlay=BASE_OVERLAY, **kwargs)
+    assert _pixels(actual) == _pixels(expected)
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_text_matches_reference(text, font_path):
+    _assert_same_text(text, *BOX, font_path=font_path)
+    _assert_same_text(text, *BOX, font_path=font_path, max_font_height=64)
+
+
+@pytest.mark.parametrize("text", TEXTS[:4])
+def test_text_default_font_matches_reference(text):
+    _assert_same_text(text, *BOX, font_path=None, max_font_height=40)
+
+
+@pytest.mark.parametrize("align", ["left", "center", "right"])
+@pytest.mark.parametrize("valign", ["top", "middle", "bottom"])
+@pytest.mark.parametrize("box", [BOX, ((119, 450), (125, 453)), ((0, 0), (30, 20)), ((500, 600), (541, 648))])
+def test_text_alignment_matches_reference(align, valign, box, font_path):
+    for text in ("你好【安安】 hello", "line1\n\nline3 [bracket\ncontinues] end"):
+        _assert_same_text(text, *box, font_path=font_path, align=align, valign=valign)
+
+
+def test_text_without_overlay_matches_reference(font_path):
+    expected = ref_text.draw_text_auto(BASE_IMAGE, *BOX, "无图层【紫色】文本", font_path=font_path)
+    actual = text_fit_draw.draw_text_auto(BASE_IMAGE, *BOX, "无图层【紫色】文本", font_path=font_path)
+    assert _pixels(actual) == _pixels(expected)
+
+
+CONTENTS = {
+    "rgba_alpha": lambda: Image.new("RGBA", (50, 30), (255, 0, 0, 128)),
+    "large_rgb": lambda: Image.new("RGB", (3000, 2000), (0, 255, 0)),
+    "tall": lambda: Image.new("RGBA", (10, 400), (0, 0, 255, 255)),
+    "gradient": lambda: Image.linear_gradient("L").convert("RGBA").resize((300, 120)),
+}
+
+
+@pytest.mark.parametrize("name", sorted(CONTENTS))
+@pytest.mark.parametrize("kwargs", [
+    dict(padding=12, allow_upscale=True),
+    dict(padding=0, align="left", valign="bottom"),
+    dict(padding=200, align="right", valign="bottom"),
+    dict(keep_alpha=False, align="right", valign="top"),
+])
+def test_image_matches_reference(name, kwargs):
+    expected = ref_image.paste_image_auto(BASE_IMAGE, *BOX, CONTENTS[name](), image_overlay=BASE_OVERLAY, **kwargs)
+    actual = image_fit_paste.paste_image_auto(BASE_IMAGE, *BOX, CONTENTS[name](), image_overlay=BASE_OVERLAY, **kwargs)
+    assert _pixels(actual) == _pixels(expected)
@@ -0,0 +1,112 @@
+# filename: tests/test_render_pool.py
+"""
+render_pool：排队上限与拒绝、取消排队中的任务时归还名额、统计计数。
+"""
+import asyncio
+import threading
+
+import pytest
+
+from render_pool import PoolFullError, RenderPool
+
+TIMEOUT = 5
+
+
+@pytest.fixture
+def pool():
+    pool = RenderPool(workers=1, max_queue=1)
+    yield pool
+    pool.shutdown()
+
+
+def _occupy(pool):
+    """让唯一的渲染线程阻塞，返回 (放行事件, 该任务的 future)。"""
+    release, started = threading.Event(), threading.Event()
+
+    def block():
+        started.set()
+        release.wait(TIMEOUT)
+        return "blocked"
+
+    future = pool.submit(block)
+    assert started.wait(TIMEOUT)
+    return release, future
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        RenderPool(workers=0)
+    with pytest.raises(ValueError):
+        RenderPool(workers=1, max_queue=-1)
+
+
+def test_rejects_when_full(pool):
+    release, running = _occupy(pool)
+    queued = pool.submit(lambda: "queued")
+    with pytest.raises(PoolFullError) as info:
+        pool.submit(lambda: "rejected")
+    assert info.value.retry_after >= 1
+    stats = pool.stats()
+    assert (stats["running"], stats["queue_depth"], stats["rejected"]) == (1, 1, 1)
+
+    release.set()
+    assert running.result(TIMEOUT) == "blocked"
+    assert queued.result(TIMEOUT) == "queued"
+    stats = pool.stats()
+    assert (stats["running"], stats["queue_depth"], stats["completed"]) == (0, 0, 2)
+
+
+def test_cancel_queued_submit_releases_slot(pool):
+    release, running = _occupy(pool)
+    calls = []
+    queued = pool.submit(calls.append, "cancelled")
+    assert queued.cancel()
+    assert pool.stats()["queue_depth"] == 0
+
+    # 名额已归还：max_queue=1 时还能再排一个
+    again = pool.submit(calls.append, "accepted")
+    release.set()
+    again.result(TIMEOUT)
+    running.result(TIMEOUT)
+    assert calls == ["accepted"]
+
+
+def test_cancel_awaiting_run_releases_slot(pool):
+    calls = []
+
+    async def scenario():
+        release, running = _occupy(pool)
+        task = asyncio.ensure_future(pool.run(calls.append, "cancelled"))
+        await asyncio.sleep(0)
+        assert pool.stats()["queue_depth"] == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert pool.stats()["queue_depth"] == 0
+
+        follow_up = asyncio.ensure_future(pool.run(calls.append, "accepted"))
+        release.set()
+        await asyncio.wait_for(follow_up, TIMEOUT)
+        running.result(TIMEOUT)
+
+    asyncio.run(scenario())
+    assert calls == ["accepted"]
+    stats = pool.stats()
+    assert (stats["queue_depth"], stats["running"], stats["completed"]) == (0, 0, 2)
+
+
+def test_failures_are_counted_and_raised(pool):
+    def fail():
+        raise KeyError("boom")
+
+    with pytest.raises(KeyError):
+        asyncio.run(pool.run(fail))
+    assert asyncio.run(pool.run(lambda a, b=0: a + b, 1, b=2)) == 3
+    stats = pool.stats()
+    assert (stats["completed"], stats["failed"], stats["queue_depth"]) == (1, 1, 0)
+
+
+def test_resubmit_after_shutdown(pool):
+    assert pool.submit(lambda: 1).result(TIMEOUT) == 1
+    pool.shutdown()
+    assert pool.submit(lambda: 2).result(TIMEOUT) == 2
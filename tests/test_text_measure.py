@@ -0,0 +1,81 @@
+# filename: tests/test_text_measure.py
+"""
+text_measure：前缀和 + 二分查找的折行（wrap_spans / wrap_lines）必须与逐前缀测量的原始算法逐行相同。
+"""
+import random
+
+import pytest
+
+from font_cache import get_font
+from text_measure import _wrap_paragraph_reference, get_advance_table, wrap_lines, wrap_spans
+
+ALPHABET = "ab AV中文【】.,W"
+
+
+class _SyntheticTable:
+    """字宽与字距随机、严格可加的字宽表（宽度为 1/64 像素的整数倍，浮点求和无误差）。"""
+
+    def __init__(self, seed, kerning):
+        rng = random.Random(seed)
+        self.advances = {ch: rng.randint(0, 40 * 64) / 64 for ch in ALPHABET}
+        self.kerning = {(a, b): rng.randint(-3 * 64, 64) / 64 for a in ALPHABET for b in ALPHABET} if kerning else {}
+
+    def textlength(self, s):
+        return sum(self.advances[ch] for ch in s) + sum(self.kerning.get(p, 0.0) for p in zip(s, s[1:]))
+
+    def prefix_widths(self, s):
+        cum, kern_at = [0.0], [0.0] * len(s)
+        for i, ch in enumerate(s):
+            k = self.kerning.get((s[i - 1], ch), 0.0) if i else 0.0
+            kern_at[i] = k
+            cum.append(cum[-1] + self.advances[ch] + k)
+        return cum, kern_at
+
+
+def _reference(para, table, max_w):
+    lines = []
+    _wrap_paragraph_reference(para, table, max_w, lines)
+    return lines
+
+
+@pytest.mark.parametrize("kerning", [False, True])
+def test_wrap_spans_matches_reference(kerning):
+    rng = random.Random(1)
+    checked = 0
+    for seed in range(20):
+        table = _SyntheticTable(seed, kerning)
+        for _ in range(300):
+            para = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 40)))
+            max_w = rng.choice([0, 1, 10, 25, rng.randint(0, 400)])
+            cum, kern_at = table.prefix_widths(para)
+            spans = wrap_spans(para, cum, kern_at, max_w)
+            if spans is None:
+                # 负字距使前缀宽度不单调，由调用方退回原始算法
+                assert kerning
+                continue
+            assert [para[i:j] for i, j in spans] == _reference(para, table, max_w), (seed, para, max_w)
+            checked += 1
+    assert checked > 1000
+
+
+def test_wrap_spans_rejects_non_monotonic_prefix():
+    assert wrap_spans("ab", [0.0, 5.0, 4.0], [0.0, -6.0], 10) is None
+
+
+@pytest.mark.parametrize("text", [
+    "The quick brown fox jumps over the lazy dog " * 6,
+    "中文【测试】" * 30,
+    "verylongwordwithoutspaces_and_more stuff here   double  spaces ",
+    "AVAVAVAV To Ty WA\n\nline3 [bracket\ncontinues] end",
+    "",
+])
+@pytest.mark.parametrize("max_w", [0, 8, 60, 279, 1000])
+def test_wrap_lines_matches_reference(text, max_w, font_path):
+    font = get_font(font_path, 37)
+    table = get_advance_table(font)
+    expected = []
+    for para in text.splitlines() or [""]:
+        _wrap_paragraph_reference(para, table, max_w, expected)
+        if para == "" and (not expected or expected[-1] != ""):
+            expected.append("")
+    assert wrap_lines(text, font, max_w) == expected
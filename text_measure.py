@@ -0,0 +1,307 @@
+# filename: text_measure.py
+"""
+文本测量引擎：按字体缓存单字宽度（advance）与相邻字对的字距修正（kerning），
+用前缀和 + 二分查找完成换行，替代对不断增长的前缀反复调用 textlength 的 O(n²) 做法。
+
+换行结果与原 draw_text_auto 内部的 wrap_lines 完全一致：
+- Pillow 的 BASIC 布局下，一段文字的宽度 = 各字 advance 之和 + 相邻字对的 kerning 之和，
+  因此任意子串宽度都能由前缀和精确得到（宽度都是 1/64 像素的整数倍，浮点求和无误差）；
+- 每个段落会用一次真实的 textlength 校验整段宽度，RAQM 等复杂排版下还会逐行校验，
+  一旦不符即对该段退回原始算法。
+
+字体旁有 font_metrics.py 提取的度量表时，字宽与 ascent / descent 直接查表（mmap，不调用 FreeType），
+get_size_table() 按 (字体路径, 字号) 取表时也不加载字体：字号搜索与折行全程不打开 FreeType。
+字体没有字距时表中字宽严格可加，省去每段的 textlength 校验；有字距时字对修正与校验仍由 FreeType 计算。
+"""
+import os
+import threading
+import weakref
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from PIL import ImageFont
+
+from font_cache import get_font
+from font_metrics import SizeMetrics, size_metrics
+
+# ImageDraw.textlength 对 RGBA 底图使用的字体模式
+DEFAULT_MODE = "L"
+
+
+class GlyphAdvanceTable:
+    """
+    单个字体对象（固定字号）的字宽表。
+    - advance(ch): 单字宽度，按字符缓存
+    - kern(a, b): 相邻两字的字距修正，按字对缓存
+    - metrics: 该字号的预计算度量表（见 font_metrics.py），有表时 advance / getmetrics 查表；
+      此时 font 可以是返回字体对象的无参函数，第一次需要 FreeType 时才加载
+    """
+
+    def __init__(
+        self,
+        font: Union[ImageFont.FreeTypeFont, Callable[[], ImageFont.FreeTypeFont]],
+        mode: str = DEFAULT_MODE,
+        metrics: Optional[SizeMetrics] = None,
+    ):
+        self._font = font
+        self.mode = mode
+        self._metrics = metrics if mode == DEFAULT_MODE else None
+        self._advances: Dict[str, float] = {}
+        self._kerning: Dict[Tuple[str, str], float] = {}
+        # 非 BASIC 布局（如 RAQM 塑形）时不保证字宽可加，需要逐行校验；度量表只在 BASIC 布局下加载
+        self.additive = self._metrics is not None or getattr(font, "layout_engine", None) == ImageFont.Layout.BASIC
+        # 无字距的度量表：字宽严格可加，整段宽度无需再用 FreeType 校验
+        self.exact = self._metrics is not None and not self._metrics.kerning
+
+    @property
+    def font(self) -> ImageFont.FreeTypeFont:
+        if callable(self._font):
+            self._font = self._font()
+        return self._font
+
+    def getmetrics(self) -> Tuple[int, int]:
+        """(ascent, descent)，与 font.getmetrics() 相同。"""
+        if self._metrics is not None:
+            return self._metrics.getmetrics()
+        return self.font.getmetrics()
+
+    def width(self, s: str) -> float:
+        """整段宽度（与 textlength 相同）；无字距的度量表直接累加字宽。"""
+        if self.exact:
+            return sum(map(self.advance, s))
+        return self.textlength(s)
+
+    def textlength(self, s: str) -> float:
+        """直接调用字体测量（与 ImageDraw.textlength 等价）。"""
+        return self.font.getlength(s, self.mode)
+
+    def advance(self, ch: str) -> float:
+        w = self._advances.get(ch)
+        if w is None:
+            if self._metrics is not None:
+                w = self._metrics.advance(ch)
+            if w is None:
+                w = self.textlength(ch)
+            self._advances[ch] = w
+        return w
+
+    def kern(self, a: str, b: str) -> float:
+        if self.exact:
+            return 0.0
+        pair = (a, b)
+        k = self._kerning.get(pair)
+        if k is None:
+            k = self.textlength(a + b) - self.advance(a) - self.advance(b)
+            self._kerning[pair] = k
+        return k
+
+    def prefix_widths(self, s: str) -> Tuple[List[float], List[float]]:
+        """
+        返回 (cum, kern_at)：
+        - cum[j] 为 s[:j] 的宽度（含内部字距修正）
+        - kern_at[i] 为 s[i-1] 与 s[i] 之间的字距修正（kern_at[0] == 0）
+        子串 s[i:j] 的宽度即 cum[j] - cum[i] - kern_at[i]。
+        """
+        kern_at = [0.0] * len(s)
+        steps = []
+        prev = None
+        for i, ch in enumerate(s):
+            step = self.advance(ch)
+            if prev is not None:
+                k = self.kern(prev, ch)
+                kern_at[i] = k
+                step += k
+            steps.append(step)
+            prev = ch
+        cum = [0.0]
+        cum.extend(accumulate(steps))
+        return cum, kern_at
+
+
+_TABLES: "weakref.WeakKeyDictionary[ImageFont.FreeTypeFont, GlyphAdvanceTable]" = weakref.WeakKeyDictionary()
+_TABLES_LOCK = threading.Lock()
+# 有度量表的字号按 (字体路径, face index, 字号) 缓存，不依赖字体对象是否已加载
+_SIZE_TABLES: Dict[Tuple[str, int, int], GlyphAdvanceTable] = {}
+
+
+def _metrics_table(path: str, size: int, index: int, metrics: SizeMetrics, font=None) -> GlyphAdvanceTable:
+    key = (path, index, size)
+    table = _SIZE_TABLES.get(key)
+    if table is None:
+        with _TABLES_LOCK:
+            table = _SIZE_TABLES.get(key)
+            if table is None:
+                table = GlyphAdvanceTable(font or (lambda: get_font(path, size, index)), metrics=metrics)
+                _SIZE_TABLES[key] = table
+    return table
+
+
+def get_advance_table(font: ImageFont.FreeTypeFont) -> GlyphAdvanceTable:
+    """取得字体对象对应的字宽表；与 font_cache 共享的字体对象一起复用。"""
+    table = _TABLES.get(font)
+    if table is None:
+        path = getattr(font, "path", None)
+        metrics = None
+        if isinstance(path, str) and getattr(font, "layout_engine", None) == ImageFont.Layout.BASIC:
+            metrics = size_metrics(path, font.size, font.index)
+        if metrics is not None:
+            table = _metrics_table(os.path.abspath(path), font.size, font.index, metrics, font)
+        with _TABLES_LOCK:
+            table = _TABLES.get(font) or table or GlyphAdvanceTable(font)
+            _TABLES[font] = table
+    return table
+
+
+def get_size_table(font_path: Optional[str], size: int, index: int = 0) -> GlyphAdvanceTable:
+    """按 (字体路径, 字号) 取字宽表；有度量表时不加载字体，只有退回 FreeType 时才打开。"""
+    metrics = size_metrics(font_path, size, index)
+    if metrics is None:
+        return get_advance_table(get_font(font_path, size, index))
+    return _metrics_table(os.path.abspath(font_path), size, index, metrics)
+
+
+def _wrap_paragraph_reference(para: str, table: GlyphAdvanceTable, max_w: int, lines: List[str]) -> None:
+    """原始的逐前缀测量算法，作为无法用前缀和精确计算时的后备。"""
+    textlength = table.textlength
+    has_space = (" " in para)
+    units = para.split(" ") if has_space else list(para)
+    buf = ""
+
+    def unit_join(a: str, b: str) -> str:
+        if not a:
+            return b
+        return (a + " " + b) if has_space else (a + b)
+
+    for u in units:
+        trial = unit_join(buf, u)
+        w = textlength(trial)
+        if w <= max_w:
+            buf = trial
+        else:
+            if buf:
+                lines.append(buf)
+            if has_space and len(u) > 1:
+                tmp = ""
+                for ch in u:
+                    if textlength(tmp + ch) <= max_w:
+                        tmp += ch
+                    else:
+                        if tmp:
+                            lines.append(tmp)
+                        tmp = ch
+                buf = tmp
+            else:
+                if textlength(u) <= max_w:
+                    buf = u
+                else:
+                    lines.append(u)
+                    buf = ""
+    if buf != "":
+        lines.append(buf)
+
+
+def span_width(cum: List[float], kern_at: List[float], i: int, j: int) -> float:
+    """由前缀和计算子串 [i, j) 的宽度。"""
+    return cum[j] - cum[i] - kern_at[i] if j > i else 0.0
+
+
+def wrap_spans(para: str, cum: List[float], kern_at: List[float], max_w: float) -> Optional[List[Tuple[int, int]]]:
+    """
+    用前缀和重现 _wrap_paragraph_reference 的贪心换行，返回每行在 para 中的区间 [i, j)。
+    前缀宽度不单调时无法用二分查找，返回 None。
+    """
+    n = len(para)
+    # 贪心“第一次放不下”等价于“最长能放下的前缀”，要求前缀宽度单调不减
+    for j in range(n):
+        if cum[j + 1] < cum[j]:
+            return None
+
+    def width(i: int, j: int) -> float:
+        return cum[j] - cum[i] - kern_at[i] if j > i else 0.0
+
+    def longest_fit(i: int, end: int) -> int:
+        """从 i 开始、不超过 end 的最长可放下子串的结束位置（至少为 i）。"""
+        j = bisect_right(cum, cum[i] + kern_at[i] + max_w, i, end + 1) - 1
+        return max(j, i)
+
+    spans: List[Tuple[int, int]] = []
+    if " " not in para:
+        # 逐字模式：单字放不下时独占一行
+        i = 0
+        while i < n:
+            j = longest_fit(i, n)
+            if j == i:
+                j = i + 1
+            spans.append((i, j))
+            i = j
+    else:
+        # 按空格分词，buf 始终是 para 中的连续子串 [bs, be)
+        bs = be = 0
+        pos = 0
+        for u in para.split(" "):
+            us, ue = pos, pos + len(u)
+            pos = ue + 1
+            ts = us if bs == be else bs
+            if width(ts, ue) <= max_w:
+                bs, be = ts, ue
+                continue
+            if be > bs:
+                spans.append((bs, be))
+            if len(u) > 1:
+                # 单词过长：在单词内部逐字折行，放不下的字另起一行（即使单字超宽）
+                i = us
+                while True:
+                    j = longest_fit(i, ue)
+                    if j == i:
+                        j = i + 1
+                    if j >= ue:
+                        break
+                    spans.append((i, j))
+                    i = j
+                bs, be = i, ue
+            elif width(us, ue) <= max_w:
+                bs, be = us, ue
+            else:
+                spans.append((us, ue))
+                bs = be = ue
+        if be > bs:
+            spans.append((bs, be))
+    return spans
+
+
+def _wrap_paragraph_fast(para: str, table: GlyphAdvanceTable, max_w: int) -> Optional[List[str]]:
+    """
+    按字宽表折行；若字宽模型与真实测量不符，返回 None 由调用方退回原始算法。
+    """
+    cum, kern_at = table.prefix_widths(para)
+    if para and not table.exact and table.textlength(para) != cum[-1]:
+        return None
+    spans = wrap_spans(para, cum, kern_at, max_w)
+    if spans is None:
+        return None
+    out = [para[i:j] for i, j in spans]
+    if not table.additive:
+        for (i, j), ln in zip(spans, out):
+            if table.textlength(ln) != span_width(cum, kern_at, i, j):
+                return None
+    return out
+
+
+def wrap_lines(txt: str, font: Union[ImageFont.FreeTypeFont, GlyphAdvanceTable], max_w: int) -> List[str]:
+    """
+    将文本按最大宽度 max_w 折行（段落之间以换行符分隔）；font 也可以直接给字宽表。
+    - 含空格的段落按单词折行，过长的单词在内部逐字折行
+    - 不含空格的段落（如中文）逐字折行
+    """
+    table = font if isinstance(font, GlyphAdvanceTable) else get_advance_table(font)
+    lines: List[str] = []
+    for para in txt.splitlines() or [""]:
+        para_lines = _wrap_paragraph_fast(para, table, max_w)
+        if para_lines is None:
+            _wrap_paragraph_reference(para, table, max_w, lines)
+        else:
+            lines.extend(para_lines)
+        if para == "" and (not lines or lines[-1] != ""):
+            lines.append("")
+    return lines